@@ -0,0 +1,88 @@
+"""
+智能体会话模块 - 对话ID与 DashScope session_id 的映射，上游负责多轮上下文，每轮只发送新的 prompt
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from auth import AgentSession, User, session_scope
+
+# 未登录用户的映射只保存在内存中：{(client_ip, conversation_id): (session_id, 过期时间)}
+_anonymous: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+_anonymous_lock = threading.Lock()
+ANONYMOUS_MAX_ENTRIES = 10000
+
+
+def get_session_id(user: Optional[User], client_ip: str, conversation_id: str, ttl_minutes: int) -> Optional[str]:
+    """查找未过期的 session_id"""
+    if user is None:
+        key = (client_ip, conversation_id)
+        with _anonymous_lock:
+            entry = _anonymous.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del _anonymous[key]
+                return None
+            return entry[0]
+
+    cutoff = datetime.utcnow() - timedelta(minutes=ttl_minutes)
+    with session_scope() as db:
+        row = db.query(AgentSession).filter(
+            AgentSession.user_id == user.id,
+            AgentSession.conversation_id == conversation_id,
+            AgentSession.updated_at >= cutoff
+        ).first()
+        return row.session_id if row else None
+
+
+def save_session_id(user_id: Optional[int], client_ip: str, conversation_id: str, session_id: str, ttl_minutes: int):
+    """保存/刷新映射，并顺带淘汰该用户已过期的会话"""
+    if user_id is None:
+        key = (client_ip, conversation_id)
+        with _anonymous_lock:
+            _anonymous[key] = (session_id, time.monotonic() + ttl_minutes * 60)
+            _anonymous.move_to_end(key)
+            now = time.monotonic()
+            # 从最旧的开始清理过期项，并限制总条数
+            while _anonymous:
+                oldest_key, (_, expires) = next(iter(_anonymous.items()))
+                if expires >= now and len(_anonymous) <= ANONYMOUS_MAX_ENTRIES:
+                    break
+                del _anonymous[oldest_key]
+        return
+
+    # 在流式响应过程中调用，请求的数据库会话已关闭，这里单独开一个
+    now = datetime.utcnow()
+    with session_scope() as db:
+        db.query(AgentSession).filter(
+            AgentSession.user_id == user_id,
+            AgentSession.updated_at < now - timedelta(minutes=ttl_minutes)
+        ).delete(synchronize_session=False)
+        row = db.query(AgentSession).filter(
+            AgentSession.user_id == user_id,
+            AgentSession.conversation_id == conversation_id
+        ).first()
+        if row:
+            row.session_id = session_id
+            row.updated_at = now
+        else:
+            db.add(AgentSession(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                session_id=session_id,
+                updated_at=now
+            ))
+        db.commit()
+
+
+def evict_expired(ttl_minutes: int) -> int:
+    """删除所有过期会话（启动时调用一次），返回删除条数"""
+    with session_scope() as db:
+        deleted = db.query(AgentSession).filter(
+            AgentSession.updated_at < datetime.utcnow() - timedelta(minutes=ttl_minutes)
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
@@ -1,33 +1,46 @@
 """
 用户认证模块 - 用户名密码注册登录
 """
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple
+import secrets
 import jwt
-from passlib.context import CryptContext
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, inspect, text, Boolean, Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# 环境变量由入口（main.py）统一加载
 
 # JWT配置
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7天
 
-# 密码加密
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # 数据库配置
 DATABASE_URL = "sqlite:///./users.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 会话工厂在首次使用时才绑定引擎
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
 
+@lru_cache(maxsize=1)
+def pwd_context():
+    """密码加密上下文（首次使用时加载 passlib/bcrypt）"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+@lru_cache(maxsize=1)
+def get_engine():
+    """数据库引擎（首次使用时创建）"""
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    SessionLocal.configure(bind=engine)
+    return engine
+
+
 class User(Base):
     """用户模型"""
     __tablename__ = "users"
@@ -38,16 +51,42 @@ class User(Base):
     nickname = Column(String, nullable=True)  # 昵称（显示名称）
     email = Column(String, nullable=True)  # 邮箱（可选）
     avatar = Column(String, nullable=True)  # 头像URL
+    is_admin = Column(Boolean, nullable=False, default=False, server_default="0")  # 管理员（可访问 /api/admin/*）
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime, default=datetime.utcnow)
 
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+class AgentSession(Base):
+    """对话与 DashScope 智能体 session_id 的映射"""
+    __tablename__ = "agent_sessions"
+    __table_args__ = (UniqueConstraint("user_id", "conversation_id"),)
 
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    conversation_id = Column(String, nullable=False)  # 前端生成的对话ID
+    session_id = Column(String, nullable=False)  # DashScope 返回的 session_id
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)  # 用于TTL淘汰
 
-def get_db():
-    """获取数据库会话"""
+
+def init_db():
+    """创建缺失的数据表并补齐新增列；由应用启动时调用一次（或 python auth.py 手动执行）"""
+    Base.metadata.create_all(bind=get_engine())
+    migrate_db()
+
+
+def migrate_db():
+    """create_all 不会修改已有的表：为旧数据库补上后来新增的列"""
+    engine = get_engine()
+    columns = {column["name"] for column in inspect(engine).get_columns("users")}
+    if "is_admin" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT 0"))
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """请求之外使用的数据库会话（先绑定引擎，DB_AUTO_CREATE=false 时没有 init_db 代为创建）"""
+    get_engine()
     db = SessionLocal()
     try:
         yield db
@@ -55,14 +94,20 @@ def get_db():
         db.close()
 
 
+def get_db():
+    """获取数据库会话"""
+    with session_scope() as db:
+        yield db
+
+
 def hash_password(password: str) -> str:
     """密码加密"""
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -85,12 +130,19 @@ def verify_token(token: str) -> Optional[dict]:
         return payload
     except jwt.ExpiredSignatureError:
         return None
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         return None
 
 
+# 微信登录用户的用户名前缀（wechat_<openid>）
+WECHAT_USERNAME_PREFIX = "wechat_"
+
+
 def create_user(db: Session, username: str, password: str, nickname: str = None, email: str = None) -> Tuple[Optional[User], Optional[str]]:
     """创建新用户"""
+    # wechat_ 前缀保留给微信登录用户，避免被抢注
+    if username.startswith(WECHAT_USERNAME_PREFIX):
+        return None, "用户名不能以 wechat_ 开头"
     # 检查用户名是否已存在
     existing_user = db.query(User).filter(User.username == username).first()
     if existing_user:
@@ -131,6 +183,55 @@ def authenticate_user(db: Session, username: str, password: str) -> Tuple[Option
     return user, None
 
 
+def get_or_create_wechat_user(db: Session, openid: str, nickname: str = None, avatar: str = None) -> User:
+    """微信登录：用户名为 wechat_<openid>，首次登录时创建（随机密码，只能通过微信登录），之后同步昵称和头像"""
+    username = f"{WECHAT_USERNAME_PREFIX}{openid}"
+    user = db.query(User).filter(User.username == username).first()
+    if user is None:
+        user = User(
+            username=username,
+            password_hash=hash_password(secrets.token_urlsafe(32)),
+            nickname=nickname or username,
+            avatar=avatar
+        )
+        db.add(user)
+    else:
+        user.nickname = nickname or user.nickname
+        user.avatar = avatar or user.avatar
+    user.last_login = datetime.utcnow()
+    db.commit()
+    db.refresh(user)
+    return user
+
+
 def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
     """根据ID获取用户"""
     return db.query(User).filter(User.id == user_id).first()
+
+
+def set_admin(db: Session, username: str, is_admin: bool) -> bool:
+    """设置用户的管理员标记，用户不存在时返回 False"""
+    user = db.query(User).filter(User.username == username).first()
+    if not user:
+        return False
+    user.is_admin = is_admin
+    db.commit()
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="初始化数据库 / 设置管理员")
+    parser.add_argument("--grant-admin", metavar="USERNAME", help="将用户设为管理员")
+    parser.add_argument("--revoke-admin", metavar="USERNAME", help="取消用户的管理员权限")
+    args = parser.parse_args()
+
+    init_db()
+    print(f"数据库表已创建: {DATABASE_URL}")
+    for username, flag in ((args.grant_admin, True), (args.revoke_admin, False)):
+        if username:
+            with session_scope() as db:
+                print(f"{username}: {'已更新' if set_admin(db, username, flag) else '用户不存在'}")
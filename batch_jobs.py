@@ -0,0 +1,177 @@
+"""
+批量任务模块 - 有界并发执行批量请求，按完成顺序产出结果，支持断线后按 job_id 续传
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from fast_json import loads, ndjson_line
+
+
+class BatchItemError(Exception):
+    """输入行本身无效（JSON 或参数格式错误），不会提交给上游"""
+
+
+class BatchJob:
+    """一个批量任务：结果按完成顺序追加，多个连接可以从任意偏移量跟随"""
+
+    def __init__(self, owner_id: int, items: List[object]):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.items = items
+        self.total = len(items)
+        self.results: List[dict] = []
+        self.failed = 0
+        self.done = False
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cond = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    def progress(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": "done" if self.done else "running",
+            "total": self.total,
+            "completed": len(self.results),
+            "failed": self.failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    async def _add(self, result: dict):
+        async with self._cond:
+            self.results.append(result)
+            if not result["ok"]:
+                self.failed += 1
+            self._cond.notify_all()
+
+    async def _run_one(self, index: int, item, worker: Callable, semaphore: asyncio.Semaphore):
+        if isinstance(item, BatchItemError):
+            await self._add({"index": index, "ok": False, "status": 400, "error": str(item)})
+            return
+        async with semaphore:
+            try:
+                result = {"index": index, "ok": True, "result": await run_in_threadpool(worker, item)}
+            except HTTPException as e:
+                result = {"index": index, "ok": False, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                result = {"index": index, "ok": False, "status": 500, "error": str(e)[:500]}
+        await self._add(result)
+
+    async def run(self, worker: Callable, concurrency: int):
+        """执行全部条目；单条失败只记录在该条结果中"""
+        semaphore = asyncio.Semaphore(concurrency)
+        try:
+            await asyncio.gather(*(
+                self._run_one(index, item, worker, semaphore) for index, item in enumerate(self.items)
+            ))
+        except Exception as e:
+            logging.error(f"Batch job {self.id} aborted: {e}")
+        finally:
+            self.items = []  # 输入不再需要，释放内存
+            async with self._cond:
+                self.done = True
+                self.finished_at = time.time()
+                self._cond.notify_all()
+
+    def start(self, worker: Callable, concurrency: int):
+        # 任务独立于 HTTP 连接运行，客户端断开后仍会继续
+        self._task = asyncio.get_running_loop().create_task(self.run(worker, concurrency))
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[bytes]:
+        """以 NDJSON 行输出：任务信息、offset 之后的每条结果、最后的汇总"""
+        yield ndjson_line({"job_id": self.id, "total": self.total, "offset": offset})
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.results) > offset or self.done)
+                new_results = self.results[offset:]
+                done = self.done
+            for result in new_results:
+                yield ndjson_line(result)
+            offset += len(new_results)
+            if done and offset >= len(self.results):
+                break
+        yield ndjson_line({"done": True, **self.progress()})
+
+
+class BatchJobStore:
+    """内存中的任务表；完成超过 ttl 秒的任务会被清理"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_jobs: int = 100):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.jobs: Dict[str, BatchJob] = {}
+
+    def _cleanup(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.done and job.finished_at and now - job.finished_at > self.ttl_seconds:
+                del self.jobs[job_id]
+
+    def create(self, owner_id: int, items: List[object], max_per_owner: Optional[int] = None) -> BatchJob:
+        self._cleanup()
+        running = [job for job in self.jobs.values() if not job.done]
+        if len(self.jobs) >= self.max_jobs or len(running) >= self.max_jobs:
+            raise HTTPException(status_code=429, detail="Too many batch jobs / 批量任务过多，请稍后再试")
+        if max_per_owner is not None and sum(1 for job in running if job.owner_id == owner_id) >= max_per_owner:
+            raise HTTPException(
+                status_code=429,
+                detail=f"At most {max_per_owner} running batch jobs per user / 每个用户最多同时运行 {max_per_owner} 个批量任务"
+            )
+        job = BatchJob(owner_id, items)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, owner_id: int) -> BatchJob:
+        job = self.jobs.get(job_id)
+        if job is None or job.owner_id != owner_id:
+            raise HTTPException(status_code=404, detail="Batch job not found / 批量任务不存在")
+        return job
+
+
+def body_too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Batch body too large (> {limit // (1024 * 1024)} MB) / 请求体过大"
+    )
+
+
+async def read_request_body(request: Request, limit: int) -> bytes:
+    """读取请求体，超过 limit 字节时返回 413：先看 Content-Length，再边接收边计数（分块传输没有长度）"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise body_too_large(limit)
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise body_too_large(limit)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def parse_jsonl(body: bytes, max_items: int) -> List[object]:
+    """逐行解析 JSONL（跳过空行）；无效行转为 BatchItemError，仍占用一个 index"""
+    items: List[object] = []
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Batch body must be UTF-8 JSONL / 请求体必须是 UTF-8 编码的 JSONL")
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if len(items) >= max_items:
+            raise HTTPException(status_code=413, detail=f"Too many items, max {max_items} / 条目过多，最多 {max_items} 条")
+        try:
+            items.append(loads(line))
+        except ValueError as e:
+            items.append(BatchItemError(f"Invalid JSON / JSON 格式错误: {e}"))
+    return items
@@ -0,0 +1,111 @@
+"""
+响应压缩基准 - 用 CompressionMiddleware 处理典型的 /api/chat、/api/models JSON 响应和智能体 SSE 流，
+输出各编码的传输字节数、每请求 CPU 时间，以及 SSE 流中被压缩器攒住、没有立即发出的事件数
+（对比 Starlette 自带的 GZipMiddleware）
+
+用法: python bench_compression.py [--requests 200] [--events 300] [--gzip-level 6] [--brotli-quality 4]
+"""
+import argparse
+import asyncio
+import time
+
+from starlette.middleware.gzip import GZipMiddleware
+
+import compression
+from compression import CompressionMiddleware
+from config import DEFAULT_PROVIDERS
+from fast_json import SSE_DONE, dumps, sse_frame
+
+TEXT = "我理解你现在的感受，这确实不容易。可以试着先把让你焦虑的事情写下来，再一件一件地看。"
+
+
+def chat_body() -> bytes:
+    return dumps({
+        "response": TEXT * 6,
+        "model": "qwen-plus",
+        "provider": "aliyun",
+        "usage": {"prompt_tokens": 812, "completion_tokens": 240, "total_tokens": 1052},
+    })
+
+
+def models_body() -> bytes:
+    return dumps({"providers": DEFAULT_PROVIDERS})
+
+
+def sse_frames(count: int) -> list:
+    frames = [sse_frame({"event": "message", "answer": TEXT[i % len(TEXT):i % len(TEXT) + 4],
+                         "conversation_id": "c7f3a2e0-1b4d-4e8a-9f21-6d0c5b7e9a13"}) for i in range(count)]
+    return frames + [SSE_DONE]
+
+
+def make_app(frames: list, content_type: bytes):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type)]
+        if len(frames) == 1:
+            headers.append((b"content-length", str(len(frames[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, frame in enumerate(frames):
+            await send({"type": "http.response.body", "body": frame, "more_body": i < len(frames) - 1})
+    return app
+
+
+async def run_once(app, accept: str):
+    """返回 (传输字节数, 消息数, 未产生输出的消息数)"""
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept.encode())]}
+    sent = {"bytes": 0, "messages": 0, "empty": 0}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            sent["messages"] += 1
+            sent["bytes"] += len(message.get("body", b""))
+            if not message.get("body") and message.get("more_body"):
+                sent["empty"] += 1
+
+    await app(scope, receive, send)
+    return sent
+
+
+async def bench(name: str, app, accept: str, requests: int, input_messages: int):
+    await run_once(app, accept)  # 预热
+    started = time.process_time()
+    for _ in range(requests):
+        sent = await run_once(app, accept)
+    cpu = (time.process_time() - started) / requests
+    # 被攒住的事件：输入消息数减去实际发出的非空消息数
+    held = input_messages - (sent["messages"] - sent["empty"])
+    print(f"{name:<34} {sent['bytes']:>8} bytes  {cpu * 1e6:>8.1f} µs/req  held back {held:>4}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="响应压缩基准")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--events", type=int, default=300, help="SSE 流的事件数")
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--brotli-quality", type=int, default=4)
+    args = parser.parse_args()
+
+    cases = [
+        ("/api/chat", [chat_body()], b"application/json"),
+        ("/api/models", [models_body()], b"application/json"),
+        (f"SSE {args.events} events", sse_frames(args.events), b"text/event-stream"),
+    ]
+    encodings = ["identity", "gzip"] + (["br"] if compression.brotli is not None else [])
+    if compression.brotli is None:
+        print("brotli not installed, skipping br\n")
+
+    for label, frames, content_type in cases:
+        app = make_app(frames, content_type)
+        middleware = CompressionMiddleware(app, gzip_level=args.gzip_level, brotli_quality=args.brotli_quality)
+        print(f"{label} ({sum(len(f) for f in frames)} bytes raw)")
+        for encoding in encodings:
+            await bench(f"  CompressionMiddleware {encoding}", middleware, encoding, args.requests, len(frames))
+        await bench("  starlette GZipMiddleware gzip", GZipMiddleware(app, compresslevel=args.gzip_level),
+                    "gzip", args.requests, len(frames))
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+流式分块基准 - 对比每个 SSE 分块的序列化开销，并模拟逐 token 上游测量分块合并的帧数与延迟
+
+用法: python bench_sse.py [--chunks 200000] [--chunk-chars 8] [--tokens 400] [--token-interval-ms 5] [--windows 0,20,50]
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import fast_json
+from stream_coalescer import coalesce_text
+
+TEXT = "我理解你现在的感受，这确实不容易。Let's take it one step at a time. "
+
+
+def make_chunks(count: int, size: int) -> list:
+    text = TEXT * (count * size // len(TEXT) + 1)
+    return [text[i * size:(i + 1) * size] for i in range(count)]
+
+
+def bench(name: str, fn, chunks: list) -> float:
+    started = time.perf_counter()
+    total = 0
+    for chunk in chunks:
+        total += len(fn(chunk))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<34} {elapsed * 1000:>8.1f} ms  {elapsed / len(chunks) * 1e9:>7.0f} ns/chunk  {total} bytes")
+    return elapsed
+
+
+async def measure_coalescing(tokens: list, interval_ms: float, window_ms: float, max_chars: int):
+    """上游每 interval_ms 产出一个 token，统计合并后的帧数、字节数、首帧时间和每个 token 的额外等待"""
+    loop = asyncio.get_running_loop()
+    emitted = deque()
+
+    async def upstream():
+        for token in tokens:
+            await asyncio.sleep(interval_ms / 1000)
+            emitted.append((loop.time(), len(token)))
+            yield {"text": token}
+
+    started = loop.time()
+    first_frame = None
+    frames = 0
+    size = 0
+    delays = []
+    async for event in coalesce_text(upstream(), window_ms, max_chars):
+        now = loop.time()
+        first_frame = first_frame if first_frame is not None else now - started
+        frames += 1
+        size += len(fast_json.sse_frame(event))
+        chars = len(event["text"])
+        while chars > 0 and emitted:
+            at, length = emitted.popleft()
+            delays.append(now - at)
+            chars -= length
+    delays.sort()
+    print(f"window {window_ms:>5.0f} ms  frames={frames:>5}  bytes={size:>7}  "
+          f"first={first_frame * 1000:>6.1f} ms  total={(loop.time() - started) * 1000:>7.1f} ms  "
+          f"added p50={delays[len(delays) // 2] * 1000:>5.1f} ms  max={delays[-1] * 1000:>5.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 分块基准")
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-interval-ms", type=float, default=5)
+    parser.add_argument("--windows", default="0,20,50", help="逗号分隔的合并窗口（毫秒）")
+    parser.add_argument("--max-chars", type=int, default=256)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks, args.chunk_chars)
+    print(f"backend: {fast_json.BACKEND}, {len(chunks)} chunks x {args.chunk_chars} chars\n")
+
+    # 原实现：每块构造 dict、json.dumps 和 f-string，再由 StreamingResponse 编码为 bytes
+    bench("f-string + json.dumps + encode",
+          lambda t: f"data: {json.dumps({'text': t}, ensure_ascii=False)}\n\n".encode("utf-8"), chunks)
+
+    stdlib = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    bench("cached JSONEncoder, bytes frame",
+          lambda t: b"data: " + stdlib.encode({"text": t}).encode("utf-8") + b"\n\n", chunks)
+
+    bench(f"fast_json.sse_frame ({fast_json.BACKEND})", lambda t: fast_json.sse_frame({"text": t}), chunks)
+
+    print(f"\ncoalescing: {args.tokens} tokens, one every {args.token_interval_ms} ms\n")
+    tokens = make_chunks(args.tokens, 2)
+    for window in (float(w) for w in args.windows.split(",")):
+        asyncio.run(measure_coalescing(tokens, args.token_interval_ms, window, args.max_chars))
+
+
+if __name__ == "__main__":
+    main()
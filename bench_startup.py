@@ -0,0 +1,66 @@
+"""
+启动耗时基准 - 用 python -X importtime 统计导入 main 的耗时，超出预算时返回非零退出码
+
+用法: python bench_startup.py [--budget-ms 1500] [--top 15] [--runs 3]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure() -> list:
+    """在子进程中导入 main，返回 [(模块, 自身耗时us, 累计耗时us, 层级)]"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=str(Path(__file__).resolve().parent),
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit("导入 main 失败")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py 导入耗时预算检查")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # 取多次运行的最小值，减少磁盘缓存等噪声
+    best = None
+    for _ in range(args.runs):
+        rows = measure()
+        total = next(cumulative for name, _, cumulative, _ in rows if name == "main")
+        if best is None or total < best[0]:
+            best = (total, rows)
+
+    total_us, rows = best
+    top_level = sorted((r for r in rows if r[3] <= 3), key=lambda r: r[2], reverse=True)
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for name, _, cumulative, _ in top_level[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>14.1f}")
+    print(f"\nimport main: {total_us / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if total_us / 1000 > args.budget_ms:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+上游响应读取基准 - 本地 HTTP 服务返回大体积 base64 图片 / 长文本响应，对比原实现（resp.json() + resp.text）
+与 upstream_body 流式读取的单请求内存峰值（tracemalloc）和耗时
+
+用法: python bench_upstream.py [--image-mb 8] [--images 2] [--text-kb 512]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fast_json import loads
+from upstream_body import SPILL_PREFIX, read_body, read_json_spilling
+
+LIMIT = 1024 * 1024 * 1024
+
+
+def make_bodies(image_mb: float, images: int, text_kb: int) -> dict:
+    raw = os.urandom(int(image_mb * 1024 * 1024))
+    image = json.dumps({
+        "created": int(time.time()),
+        "data": [{"b64_json": base64.b64encode(raw).decode("ascii")} for _ in range(images)],
+    }).encode("utf-8")
+    text = "我理解你现在的感受。" * (text_kb * 1024 // 30)
+    chat = json.dumps({
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": len(text)},
+        "model": "bench",
+    }, ensure_ascii=False).encode("utf-8")
+    return {"/image": image, "/chat": chat, "raw_sha": hashlib.sha256(raw).hexdigest()}
+
+
+def serve(bodies: dict) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(name: str, fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<42} peak {peak / 1024 / 1024:>8.1f} MB  {elapsed * 1000:>8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游响应读取基准")
+    parser.add_argument("--image-mb", type=float, default=8, help="单张图片解码后的大小")
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--text-kb", type=int, default=512)
+    args = parser.parse_args()
+
+    bodies = make_bodies(args.image_mb, args.images, args.text_kb)
+    server = serve(bodies)
+    base = f"http://127.0.0.1:{server.server_port}"
+    print(f"image response {len(bodies['/image']) / 1024 / 1024:.1f} MB, "
+          f"chat response {len(bodies['/chat']) / 1024:.0f} KB\n")
+
+    def legacy(path):
+        resp = requests.get(base + path)
+        data = resp.json()
+        resp.text  # 原实现在错误 / 回退路径上还会读取 resp.text
+        if path == "/image":
+            # 原实现把 base64 拼成 data URL 字符串
+            data = [f"data:image/png;base64,{item['b64_json']}" for item in data["data"]]
+        return data
+
+    def streamed_chat():
+        with requests.get(base + "/chat", stream=True) as resp:
+            return loads(read_body(resp, LIMIT))
+
+    spill_dir = tempfile.mkdtemp(prefix="bench-upstream-")
+
+    def streamed_image():
+        with requests.get(base + "/image", stream=True) as resp:
+            return read_json_spilling(resp, LIMIT, spill_dir, LIMIT)
+
+    measure("chat: resp.json() + resp.text", lambda: legacy("/chat"))
+    measure("chat: read_body + loads", streamed_chat)
+    measure("image: resp.json() + resp.text + data URL", lambda: legacy("/image"))
+    result = measure("image: read_json_spilling", streamed_image)
+
+    for item in result["data"]:
+        path = item["b64_json"][len(SPILL_PREFIX):]
+        with open(path, "rb") as f:
+            ok = hashlib.sha256(f.read()).hexdigest() == bodies["raw_sha"]
+        os.unlink(path)
+        print(f"  spilled {os.path.basename(path)}: {'ok' if ok else 'MISMATCH'}")
+    os.rmdir(spill_dir)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
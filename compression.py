@@ -0,0 +1,137 @@
+"""
+响应压缩模块 - 按 Accept-Encoding 选择 brotli / gzip；小响应不压缩；SSE / NDJSON 流每个事件压缩后立即 flush，不增加延迟
+"""
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from static_assets import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只使用 gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/x-ndjson", "text/",
+)
+# 逐事件 flush 的流式类型
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+class GzipStream:
+    """gzip 流式压缩；flush 使用 Z_SYNC_FLUSH，客户端立即可解出已发送的内容"""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """压缩 JSON / 文本响应与 SSE 流；已编码、分段（206）或过小的响应原样返回"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 512, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _stream(self, encoding: str):
+        return BrotliStream(self.brotli_quality) if encoding == "br" else GzipStream(self.gzip_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        stream = None  # None: 尚未决定；False: 不压缩
+        flush_each = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start, stream, flush_each
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if stream is None:
+                headers = MutableHeaders(scope=start)
+                content_type = headers.get("content-type", "")
+                flush_each = content_type.startswith(STREAMING_TYPES)
+                compressible = (
+                    content_type.startswith(COMPRESSIBLE_TYPES)
+                    and "content-encoding" not in headers
+                    and "content-range" not in headers
+                    and start["status"] not in (204, 206, 304)
+                )
+                # 一次发完的小响应不值得压缩
+                if not compressible or (not more_body and not flush_each and len(body) < self.minimum_size):
+                    stream = False
+                    await send(start)
+                    await send(message)
+                    return
+
+                stream = self._stream(encoding)
+                headers["Content-Encoding"] = encoding
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                if more_body or flush_each:
+                    del headers["Content-Length"]
+                    await send(start)
+                else:
+                    compressed = stream.compress(body, flush=False) + stream.finish()
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+            elif stream is False:
+                await send(message)
+                return
+
+            # 流式：SSE / NDJSON 每条消息都 flush；其它流式响应由压缩器自行缓冲
+            out = stream.compress(body, flush=flush_each)
+            if not more_body:
+                out += stream.finish()
+            if out or not more_body:
+                await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,346 @@
+"""
+配置模块 - 启动时从环境变量加载一次并校验，支持整体原子替换的热重载
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from dotenv import dotenv_values
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from prompt_registry import DEFAULT_PROMPTS, PromptEntry, PromptRegistry
+
+# 默认支持的模型列表（可通过 PROVIDERS_FILE 指定 JSON 文件覆盖）
+DEFAULT_PROVIDERS = {
+    "aliyun": [
+        {"id": "qwen-plus", "name": "Qwen Plus", "name_zh": "通义千问 Plus"},
+        {"id": "qwen-turbo", "name": "Qwen Turbo", "name_zh": "通义千问 Turbo"},
+        {"id": "qwen-max", "name": "Qwen Max", "name_zh": "通义千问 Max"},
+        {"id": "qwen-long", "name": "Qwen Long", "name_zh": "通义千问 Long"}
+    ],
+    "openai": [
+        {"id": "gpt-4", "name": "GPT-4"},
+        {"id": "gpt-4-turbo", "name": "GPT-4 Turbo"},
+        {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"}
+    ]
+}
+
+
+class ProviderModel(BaseModel):
+    """模型列表中的一项"""
+    model_config = ConfigDict(frozen=True, extra="allow")
+
+    id: str
+    name: str
+    name_zh: Optional[str] = None
+
+
+class CachedJSON:
+    """预先序列化的 JSON 响应，带 ETag，命中 If-None-Match 时返回 304"""
+
+    def __init__(self, content):
+        self.body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        # 压缩由中间件按 Accept-Encoding 完成，同一 ETag 会对应原始和压缩后的不同字节，因此用弱 ETag
+        self.etag = f'W/"{hashlib.sha256(self.body).hexdigest()[:16]}"'
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        # If-None-Match 按弱比较：忽略 W/ 前缀
+        opaque = self.etag[2:]
+        tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+        if "*" in tags or opaque in [tag[2:] if tag.startswith("W/") else tag for tag in tags]:
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+class Settings(BaseModel):
+    """应用配置（不可变；重载时整体替换）"""
+    model_config = ConfigDict(frozen=True)
+
+    app_name: str = "多云聊天平台"
+    app_name_en: str = "Multi-Cloud Chat"
+    daily_free_limit: int = Field(10, ge=0)
+    require_auth: bool = False
+    admin_usernames: List[str] = []
+
+    wechat_app_id: str = ""
+    wechat_app_secret: str = ""
+    wechat_api_base: str = "https://api.weixin.qq.com"
+    wechat_userinfo_ttl: float = Field(3600, ge=0)
+
+    chat_endpoint: str = "https://api.openai.com/v1"
+    chat_model: str = "qwen-plus"
+    chat_api_key: str = ""
+
+    image_endpoint: str = "https://api.openai.com/v1/images/generations"
+    image_model: str = "dall-e-3"
+    image_size: str = "1024x1024"
+    image_api_key: str = ""
+    image_max_n: int = Field(4, ge=1, le=10)
+    image_max_n_per_request: int = Field(1, ge=1)
+    image_max_concurrency: int = Field(4, ge=1)
+    image_store_enabled: bool = True
+    image_store_dir: str = "./image_store"
+    image_store_max_mb: int = Field(512, ge=1)
+    image_store_max_file_mb: int = Field(20, ge=1)
+    image_thumb_size: int = Field(256, ge=16)
+    image_task_timeout: float = Field(180, gt=0)
+
+    agent_api_key: str = ""
+    agent_app_id: str = ""
+    agent_session_ttl_minutes: int = Field(60, ge=1)
+
+    safety_filter_enabled: bool = True
+    safety_phrases_file: Optional[str] = None
+    safety_response: Optional[str] = None
+
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = Field(0.92, gt=0, le=1)
+    semantic_cache_capacity: int = Field(5000, ge=1)
+
+    batch_concurrency: int = Field(8, ge=1)
+    batch_max_items: int = Field(10000, ge=1)
+    batch_max_body_mb: int = Field(16, ge=1)
+    batch_job_ttl_minutes: int = Field(60, ge=1)
+    batch_max_jobs_per_user: int = Field(2, ge=1)
+
+    ws_max_streams: int = Field(8, ge=1)
+    ws_stream_window: int = Field(64, ge=1)
+
+    agent_coalesce_ms: float = Field(0, ge=0)
+    ws_coalesce_ms: float = Field(0, ge=0)
+    coalesce_max_chars: int = Field(256, ge=1)
+
+    upstream_max_response_mb: int = Field(8, ge=1)
+    upstream_max_image_mb: int = Field(20, ge=1)
+
+    loop_monitor_interval_ms: float = Field(100, gt=0)
+    loop_lag_threshold_ms: float = Field(250, gt=0)
+    threadpool_queue_threshold: int = Field(20, ge=0)
+
+    profiler_enabled: bool = False
+    profiler_interval_ms: float = Field(10, gt=0)
+    slow_request_ms: float = Field(1000, gt=0)
+    slow_request_keep: int = Field(50, ge=1)
+
+    key_validation_enabled: bool = True
+    key_validation_ttl: float = Field(3600, ge=0)
+    key_invalid_ttl: float = Field(600, ge=0)
+    key_probe_timeout: float = Field(5, gt=0)
+    custom_endpoint_slow_ms: float = Field(10000, gt=0)
+
+    compression_enabled: bool = True
+    compression_min_size: int = Field(512, ge=0)
+    gzip_level: int = Field(6, ge=1, le=9)
+    brotli_quality: int = Field(4, ge=0, le=11)
+
+    drain_timeout: float = Field(25, ge=0)
+    usage_state_file: Optional[str] = "usage_state.json"
+
+    db_auto_create: bool = True
+    health_check_interval: float = Field(10, gt=0)
+    ready_max_in_flight: int = Field(200, ge=1)
+
+    providers: Dict[str, List[ProviderModel]] = DEFAULT_PROVIDERS
+    prompts: List[PromptEntry] = []
+
+    _config_json: CachedJSON = PrivateAttr()
+    _models_json: CachedJSON = PrivateAttr()
+    _prompt_registry: PromptRegistry = PrivateAttr()
+    _prompts_json: CachedJSON = PrivateAttr()
+
+    def model_post_init(self, __context):
+        # /api/config 和 /api/models 的响应只依赖配置，预先序列化
+        self._config_json = CachedJSON({
+            "appName": self.app_name,
+            "appNameEn": self.app_name_en,
+            "dailyFreeLimit": self.daily_free_limit,
+            "wechatEnabled": bool(self.wechat_app_id),
+            "wechatAppId": self.wechat_app_id,
+            "requireAuth": self.require_auth
+        })
+        self._models_json = CachedJSON({
+            provider: [model.model_dump(exclude_none=True) for model in models]
+            for provider, models in self.providers.items()
+        })
+        # 提示词在加载配置时解析一次（token 数、上游消息均已预先计算）
+        self._prompt_registry = PromptRegistry(self.prompts)
+        self._prompts_json = CachedJSON(self._prompt_registry.listing())
+
+    @property
+    def config_json(self) -> CachedJSON:
+        return self._config_json
+
+    @property
+    def models_json(self) -> CachedJSON:
+        return self._models_json
+
+    @property
+    def prompt_registry(self) -> PromptRegistry:
+        return self._prompt_registry
+
+    @property
+    def prompts_json(self) -> CachedJSON:
+        return self._prompts_json
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+def _load_providers() -> dict:
+    path = os.getenv("PROVIDERS_FILE")
+    if not path:
+        return DEFAULT_PROVIDERS
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_prompts() -> list:
+    path = os.getenv("PROMPTS_FILE")
+    if not path:
+        return DEFAULT_PROMPTS
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def settings_from_env() -> Settings:
+    """从环境变量构建配置；格式错误时抛出 ValidationError / ValueError"""
+    return Settings(
+        app_name=os.getenv("APP_NAME", "多云聊天平台"),
+        app_name_en=os.getenv("APP_NAME_EN", "Multi-Cloud Chat"),
+        daily_free_limit=os.getenv("DAILY_FREE_LIMIT", "10"),
+        require_auth=_env_bool("REQUIRE_AUTH", "false"),
+        admin_usernames=[name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()],
+        wechat_app_id=os.getenv("WECHAT_APP_ID", ""),
+        wechat_app_secret=os.getenv("WECHAT_APP_SECRET", ""),
+        wechat_api_base=os.getenv("WECHAT_API_BASE", "https://api.weixin.qq.com"),
+        wechat_userinfo_ttl=os.getenv("WECHAT_USERINFO_TTL", "3600"),
+        chat_endpoint=os.getenv("DEFAULT_CHAT_ENDPOINT", "https://api.openai.com/v1"),
+        chat_model=os.getenv("DEFAULT_CHAT_MODEL", "qwen-plus"),
+        chat_api_key=os.getenv("DEFAULT_CHAT_API_KEY", ""),
+        image_endpoint=os.getenv("DEFAULT_IMAGE_ENDPOINT", "https://api.openai.com/v1/images/generations"),
+        image_model=os.getenv("DEFAULT_IMAGE_MODEL", "dall-e-3"),
+        image_size=os.getenv("DEFAULT_IMAGE_SIZE", "1024x1024"),
+        image_api_key=os.getenv("DEFAULT_IMAGE_API_KEY", ""),
+        image_max_n=os.getenv("IMAGE_MAX_N", "4"),
+        image_max_n_per_request=os.getenv("IMAGE_MAX_N_PER_REQUEST", "1"),
+        image_max_concurrency=os.getenv("IMAGE_MAX_CONCURRENCY", "4"),
+        image_store_enabled=_env_bool("IMAGE_STORE_ENABLED", "true"),
+        image_store_dir=os.getenv("IMAGE_STORE_DIR", "./image_store"),
+        image_store_max_mb=os.getenv("IMAGE_STORE_MAX_MB", "512"),
+        image_store_max_file_mb=os.getenv("IMAGE_STORE_MAX_FILE_MB", "20"),
+        image_thumb_size=os.getenv("IMAGE_THUMB_SIZE", "256"),
+        image_task_timeout=os.getenv("IMAGE_TASK_TIMEOUT", "180"),
+        agent_api_key=os.getenv("DEFAULT_AGENT_API_KEY", ""),
+        agent_app_id=os.getenv("AGENT_APP_ID", ""),
+        agent_session_ttl_minutes=os.getenv("AGENT_SESSION_TTL_MINUTES", "60"),
+        safety_filter_enabled=_env_bool("SAFETY_FILTER_ENABLED", "true"),
+        safety_phrases_file=os.getenv("SAFETY_PHRASES_FILE") or None,
+        safety_response=os.getenv("SAFETY_RESPONSE") or None,
+        semantic_cache_enabled=_env_bool("SEMANTIC_CACHE_ENABLED", "false"),
+        semantic_cache_threshold=os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"),
+        semantic_cache_capacity=os.getenv("SEMANTIC_CACHE_CAPACITY", "5000"),
+        batch_concurrency=os.getenv("BATCH_CONCURRENCY", "8"),
+        batch_max_items=os.getenv("BATCH_MAX_ITEMS", "10000"),
+        batch_max_body_mb=os.getenv("BATCH_MAX_BODY_MB", "16"),
+        batch_job_ttl_minutes=os.getenv("BATCH_JOB_TTL_MINUTES", "60"),
+        batch_max_jobs_per_user=os.getenv("BATCH_MAX_JOBS_PER_USER", "2"),
+        ws_max_streams=os.getenv("WS_MAX_STREAMS", "8"),
+        ws_stream_window=os.getenv("WS_STREAM_WINDOW", "64"),
+        agent_coalesce_ms=os.getenv("AGENT_COALESCE_MS", "0"),
+        ws_coalesce_ms=os.getenv("WS_COALESCE_MS", "0"),
+        coalesce_max_chars=os.getenv("COALESCE_MAX_CHARS", "256"),
+        upstream_max_response_mb=os.getenv("UPSTREAM_MAX_RESPONSE_MB", "8"),
+        upstream_max_image_mb=os.getenv("UPSTREAM_MAX_IMAGE_MB", "20"),
+        loop_monitor_interval_ms=os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"),
+        loop_lag_threshold_ms=os.getenv("LOOP_LAG_THRESHOLD_MS", "250"),
+        threadpool_queue_threshold=os.getenv("THREADPOOL_QUEUE_THRESHOLD", "20"),
+        profiler_enabled=_env_bool("PROFILER_ENABLED", "false"),
+        profiler_interval_ms=os.getenv("PROFILER_INTERVAL_MS", "10"),
+        slow_request_ms=os.getenv("SLOW_REQUEST_MS", "1000"),
+        slow_request_keep=os.getenv("SLOW_REQUEST_KEEP", "50"),
+        key_validation_enabled=_env_bool("KEY_VALIDATION_ENABLED", "true"),
+        key_validation_ttl=os.getenv("KEY_VALIDATION_TTL", "3600"),
+        key_invalid_ttl=os.getenv("KEY_INVALID_TTL", "600"),
+        key_probe_timeout=os.getenv("KEY_PROBE_TIMEOUT", "5"),
+        custom_endpoint_slow_ms=os.getenv("CUSTOM_ENDPOINT_SLOW_MS", "10000"),
+        compression_enabled=_env_bool("COMPRESSION_ENABLED", "true"),
+        compression_min_size=os.getenv("COMPRESSION_MIN_SIZE", "512"),
+        gzip_level=os.getenv("GZIP_LEVEL", "6"),
+        brotli_quality=os.getenv("BROTLI_QUALITY", "4"),
+        drain_timeout=os.getenv("DRAIN_TIMEOUT", "25"),
+        usage_state_file=os.getenv("USAGE_STATE_FILE", "usage_state.json") or None,
+        db_auto_create=_env_bool("DB_AUTO_CREATE", "true"),
+        health_check_interval=os.getenv("HEALTH_CHECK_INTERVAL", "10"),
+        ready_max_in_flight=os.getenv("READY_MAX_IN_FLIGHT", "200"),
+        providers=_load_providers(),
+        prompts=_load_prompts(),
+    )
+
+
+# 只在启动时生效的配置（中间件、图片存储目录等在启动时构建），热重载修改它们时记录警告
+RESTART_REQUIRED = (
+    "compression_enabled", "compression_min_size", "gzip_level", "brotli_quality",
+    "db_auto_create", "image_store_enabled", "image_store_dir", "image_store_max_mb",
+    "image_store_max_file_mb", "image_thumb_size",
+)
+
+# 启动前已存在于进程环境中的变量（编排系统 / 容器注入），优先于 .env，热重载时也不被覆盖
+_process_env_keys: frozenset = frozenset()
+# 由 .env 写入进程环境的变量
+_dotenv_keys: set = set()
+
+
+def load_env(path: Optional[str] = None):
+    """启动时加载 .env（不覆盖已有环境变量）；由入口在导入其它模块之前调用一次"""
+    global _process_env_keys
+    _process_env_keys = frozenset(os.environ)
+    _apply_dotenv(path)
+
+
+def _apply_dotenv(path: Optional[str] = None):
+    """把 .env 的值写入进程环境：跳过进程原有的变量，.env 中已删除的变量一并移除"""
+    values = {k: v for k, v in dotenv_values(path).items() if v is not None and k not in _process_env_keys}
+    for key in _dotenv_keys - values.keys():
+        os.environ.pop(key, None)
+    os.environ.update(values)
+    _dotenv_keys.clear()
+    _dotenv_keys.update(values)
+
+
+def restart_required_changes(old: Settings, new: Settings) -> List[str]:
+    return [name for name in RESTART_REQUIRED if getattr(old, name) != getattr(new, name)]
+
+
+_settings: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    """当前配置（FastAPI 依赖项）；首次调用时加载"""
+    global _settings
+    if _settings is None:
+        _settings = settings_from_env()
+    return _settings
+
+
+def reload_settings() -> Settings:
+    """重新读取 .env 并整体替换配置；进程环境变量仍然优先；校验失败时保留旧配置并抛出异常"""
+    global _settings
+    _apply_dotenv()
+    try:
+        new_settings = settings_from_env()
+    except (ValidationError, ValueError, OSError) as e:
+        logging.error(f"Config reload failed, keeping previous settings: {e}")
+        raise
+    old_settings, _settings = _settings, new_settings
+    if old_settings is not None:
+        changed = restart_required_changes(old_settings, new_settings)
+        if changed:
+            logging.warning(f"Config reloaded, but these settings only take effect after a restart: {', '.join(changed)}")
+    logging.info("Config reloaded / 配置已重新加载")
+    return new_settings
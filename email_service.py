@@ -5,14 +5,11 @@ import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
-from dotenv import load_dotenv
 import random
 import string
 from datetime import datetime, timedelta
 from typing import Dict
 
-load_dotenv()
-
 # 验证码存储 {email: {"code": "123456", "expires": datetime}}
 verification_codes: Dict[str, dict] = {}
 
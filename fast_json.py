@@ -0,0 +1,56 @@
+"""
+JSON 序列化模块 - 安装了 orjson 时使用 orjson，否则回退到标准库；流式接口直接输出 bytes 帧
+"""
+import json
+from typing import Any
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库
+    orjson = None
+
+# 标准库编码器只创建一次，避免每次调用 json.dumps 重新构造
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def dumps(obj: Any) -> bytes:
+    """紧凑的 UTF-8 JSON（不转义非 ASCII 字符）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return _encoder.encode(obj).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    """同 dumps，返回 str（WebSocket 文本帧等场景）"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return _encoder.encode(obj)
+
+
+# 解析失败时两者都抛出 ValueError 的子类（json.JSONDecodeError）
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def sse_frame(data: Any) -> bytes:
+    """一条 SSE 事件：data: <json>\\n\\n"""
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+
+def ndjson_line(data: Any) -> bytes:
+    """一行 NDJSON"""
+    return dumps(data) + b"\n"
+
+
+class FastJSONResponse(Response):
+    """直接序列化返回内容，不经过 FastAPI 的 jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
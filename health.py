@@ -0,0 +1,163 @@
+"""
+健康检查模块 - 存活探针常量返回，就绪探针只读取后台检查的缓存结果
+"""
+import asyncio
+import logging
+import time
+import urllib.parse
+from typing import Callable, Dict, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# 存活探针：预先构建好的 ASGI 消息，每次原样发送（不创建 Response 对象）
+LIVENESS_PATH = "/healthz"
+LIVENESS_START = {
+    "type": "http.response.start",
+    "status": 200,
+    "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", b"2")],
+}
+LIVENESS_BODY = {"type": "http.response.body", "body": b"ok"}
+
+
+class LivenessMiddleware:
+    """最外层中间件：存活探针直接返回，不经过其它中间件和路由"""
+
+    def __init__(self, app: ASGIApp, path: str = LIVENESS_PATH):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"] == self.path:
+            await send(LIVENESS_START)
+            await send(LIVENESS_BODY)
+            return
+        await self.app(scope, receive, send)
+
+
+class InFlightCounter:
+    """正在处理的 HTTP 请求数（作为排队深度）"""
+
+    def __init__(self):
+        self.count = 0
+
+
+class InFlightMiddleware:
+    """在请求开始/结束时更新 InFlightCounter"""
+
+    def __init__(self, app: ASGIApp, counter: InFlightCounter):
+        self.app = app
+        self.counter = counter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.counter.count += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.counter.count -= 1
+
+
+class HealthMonitor:
+    """周期性执行各项检查并缓存结果；/readyz 只读取缓存"""
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.checks: Dict[str, Callable[[], dict]] = {}
+        self.results: Dict[str, dict] = {}
+        self.checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, check: Callable[[], dict]):
+        """注册检查函数：同步函数，返回 {"ok": bool, ...}，在线程池中执行"""
+        self.checks[name] = check
+
+    async def run_once(self):
+        results = {}
+        for name, check in self.checks.items():
+            started = time.monotonic()
+            try:
+                result = await run_in_threadpool(check)
+            except Exception as e:
+                result = {"ok": False, "error": str(e)[:200]}
+            result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+            results[name] = result
+        self.results = results
+        self.checked_at = time.time()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Health check loop error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def readiness_response(self) -> JSONResponse:
+        """就绪探针：不做任何 I/O，只返回缓存结果"""
+        if self.checked_at is None:
+            return JSONResponse({"ready": False, "reason": "checks pending"}, status_code=503)
+        ready = all(result.get("ok") for result in self.results.values())
+        body = {
+            "ready": ready,
+            "checked_at": self.checked_at,
+            "age_s": round(time.time() - self.checked_at, 1),
+            "checks": self.results,
+        }
+        return JSONResponse(body, status_code=200 if ready else 503)
+
+
+def database_check(get_engine: Callable) -> Callable[[], dict]:
+    """数据库连通性检查"""
+    def check() -> dict:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"ok": True}
+    return check
+
+
+def upstream_check(endpoint: str, timeout: float = 3.0) -> Callable[[], dict]:
+    """上游服务可达性检查：只请求域名根路径，不消耗配额；5xx 或连接失败视为不可用"""
+    parsed = urllib.parse.urlparse(endpoint)
+    url = f"{parsed.scheme}://{parsed.netloc}/"
+
+    def check() -> dict:
+        if not parsed.netloc:
+            return {"ok": True, "skipped": True}
+        import requests  # 延迟导入，加快冷启动
+
+        try:
+            resp = requests.get(url, timeout=timeout, allow_redirects=False)
+        except requests.RequestException as e:
+            return {"ok": False, "error": str(e)[:200]}
+        return {"ok": resp.status_code < 500, "status": resp.status_code}
+    return check
+
+
+def queue_check(in_flight: InFlightCounter, max_in_flight: int, pending: Optional[Callable[[], int]] = None) -> Callable[[], dict]:
+    """排队深度检查：正在处理的请求数和后台待处理任务数"""
+    def check() -> dict:
+        depth = in_flight.count
+        result = {"ok": depth <= max_in_flight, "in_flight": depth, "limit": max_in_flight}
+        if pending is not None:
+            result["background_pending"] = pending()
+        return result
+    return check
@@ -0,0 +1,292 @@
+"""
+图片生成模块 - 并发拆分多图请求，支持 DashScope 异步任务轮询
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from typing import AsyncIterator, List, Optional, Set
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from fast_json import loads
+from upstream_body import SPILL_PREFIX, error_message, read_body, read_json_spilling
+
+# 异步任务状态
+TASK_DONE_STATUSES = {"SUCCEEDED"}
+TASK_FAILED_STATUSES = {"FAILED", "CANCELED", "UNKNOWN"}
+
+# 轮询间隔：从 POLL_INITIAL 开始，每次乘以 POLL_BACKOFF，最长 POLL_MAX 秒
+POLL_INITIAL = 0.5
+POLL_BACKOFF = 1.5
+POLL_MAX = 5.0
+
+
+def is_aliyun_endpoint(endpoint: str) -> bool:
+    """是否为阿里云 DashScope 原生图片接口"""
+    return "ali" in endpoint or "multimodal-generation" in endpoint or "image-synthesis" in endpoint
+
+
+def is_async_only_endpoint(endpoint: str) -> bool:
+    """通义万相 image-synthesis 只支持异步任务模式"""
+    return "image-synthesis" in endpoint
+
+
+def build_image_payload(endpoint: str, model: str, prompt: str, size: str, n: int) -> dict:
+    """按接口类型构建请求体"""
+    if is_async_only_endpoint(endpoint):
+        return {
+            "model": model,
+            "input": {"prompt": prompt},
+            "parameters": {"size": size, "n": n}
+        }
+
+    if is_aliyun_endpoint(endpoint):
+        return {
+            "model": model,
+            "input": {
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "text": prompt
+                            }
+                        ]
+                    }
+                ]
+            },
+            "parameters": {
+                "size": size,
+                "n": n
+            }
+        }
+
+    # 默认OpenAI格式
+    return {
+        "model": model,
+        "prompt": prompt,
+        "size": size,
+        "n": n
+    }
+
+
+def extract_images(result: dict) -> List[dict]:
+    """从上游响应中解析图片列表（阿里云 multimodal / 万相 / OpenAI 三种格式）"""
+    images = []
+    output = result.get("output") if isinstance(result, dict) else None
+
+    if isinstance(output, dict):
+        # 阿里云 multimodal-generation 格式
+        for choice in output.get("choices") or []:
+            if "message" in choice and "content" in choice["message"]:
+                for content_item in choice["message"]["content"]:
+                    if "image" in content_item:
+                        images.append({"url": content_item["image"]})
+        # 通义万相异步任务格式
+        for item in output.get("results") or []:
+            if isinstance(item, dict) and item.get("url"):
+                images.append({"url": item["url"]})
+
+    # OpenAI 格式
+    if isinstance(result, dict):
+        for item in result.get("data") or []:
+            if isinstance(item, dict):
+                if item.get("url"):
+                    images.append({"url": item["url"]})
+                elif item.get("b64_json"):
+                    b64 = item["b64_json"]
+                    if b64.startswith(SPILL_PREFIX):
+                        # 已在读取响应时解码到文件
+                        images.append({"file": b64[len(SPILL_PREFIX):]})
+                    else:
+                        images.append({"url": f"data:image/png;base64,{b64}"})
+
+    return images
+
+
+def discard_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_task_id(result: dict) -> Optional[str]:
+    """响应中带 task_id 且尚无结果时视为异步任务"""
+    output = result.get("output") if isinstance(result, dict) else None
+    if not isinstance(output, dict) or not output.get("task_id"):
+        return None
+    if output.get("task_status") in TASK_DONE_STATUSES and extract_images(result):
+        return None
+    return output["task_id"]
+
+
+def task_url(endpoint: str, task_id: str) -> str:
+    """根据提交地址推导任务查询地址"""
+    parsed = urllib.parse.urlparse(endpoint)
+    return f"{parsed.scheme}://{parsed.netloc}/api/v1/tasks/{task_id}"
+
+
+class ImageClient:
+    """图片生成客户端：n > 1 时拆分为并发子请求，异步任务自适应轮询"""
+
+    def __init__(self, endpoint: str, api_key: str, model: str, size: str,
+                 max_n_per_request: Optional[int] = None,
+                 max_concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 max_response_bytes: int = 8 * 1024 * 1024,
+                 max_image_bytes: int = 20 * 1024 * 1024,
+                 spill_dir: Optional[str] = None):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.model = model
+        self.size = size
+        self.max_n_per_request = max(1, max_n_per_request or 1)
+        self.max_concurrency = max(1, max_concurrency or 4)
+        self.timeout = timeout or 180.0
+        # 响应体上限（不含解码到文件的 base64 图片）；base64 图片单张上限及写入目录
+        self.max_response_bytes = max_response_bytes
+        self.max_image_bytes = max_image_bytes
+        self.spill_dir = spill_dir
+        # 已解码到文件、尚未交给调用方的图片；iter_images 结束后（如客户端断开）产生的文件直接删除
+        self._spills: Set[str] = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _headers(self, async_task: bool = False) -> dict:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        if async_task:
+            headers["X-DashScope-Async"] = "enable"
+        return headers
+
+    def split_n(self, n: int) -> List[int]:
+        """把 n 拆成每个不超过 max_n_per_request 的子请求"""
+        n = max(1, n)
+        sizes = [self.max_n_per_request] * (n // self.max_n_per_request)
+        if n % self.max_n_per_request:
+            sizes.append(n % self.max_n_per_request)
+        return sizes
+
+    def _submit(self, prompt: str, n: int) -> dict:
+        """提交单个子请求（同步，运行在线程池中）"""
+        data = build_image_payload(self.endpoint, self.model, prompt, self.size, n)
+        async_task = is_async_only_endpoint(self.endpoint)
+        import requests  # 延迟导入，加快冷启动
+
+        try:
+            resp = requests.post(self.endpoint, headers=self._headers(async_task), json=data, timeout=60, stream=True)
+            logging.debug(f"图片子请求响应状态: {resp.status_code}")
+            if resp.status_code >= 400:
+                raise HTTPException(
+                    status_code=resp.status_code,
+                    detail=f"API请求失败: {error_message(resp)[:200]}"
+                )
+            with resp:
+                result = read_json_spilling(resp, self.max_response_bytes, self.spill_dir, self.max_image_bytes)
+            self._track_spills(result)
+            return result
+        except requests.RequestException as e:
+            raise HTTPException(status_code=502, detail=f"Upstream request failed / 上游请求失败: {str(e)}")
+        except ValueError as e:
+            raise HTTPException(status_code=502, detail=f"Invalid upstream response / 上游响应无法解析: {str(e)[:200]}")
+
+    def _track_spills(self, result: dict):
+        """记录子请求解码出的文件（线程池中调用；协程被取消时结果会丢失，由 iter_images 结束时统一删除）"""
+        paths = [image["file"] for image in extract_images(result) if image.get("file")]
+        with self._lock:
+            if not self._closed:
+                self._spills.update(paths)
+                return
+        discard_files(paths)
+
+    def _query_task(self, task_id: str) -> dict:
+        """查询异步任务状态（同步，运行在线程池中）"""
+        import requests  # 延迟导入，加快冷启动
+
+        try:
+            resp = requests.get(task_url(self.endpoint, task_id), headers=self._headers(), timeout=30, stream=True)
+            if resp.status_code >= 400:
+                raise HTTPException(status_code=resp.status_code, detail=f"任务查询失败: {error_message(resp)[:200]}")
+            with resp:
+                return loads(read_body(resp, self.max_response_bytes))
+        except requests.RequestException as e:
+            raise HTTPException(status_code=502, detail=f"Task query failed / 任务查询失败: {str(e)}")
+        except ValueError as e:
+            raise HTTPException(status_code=502, detail=f"Invalid upstream response / 上游响应无法解析: {str(e)[:200]}")
+
+    async def _poll(self, task_id: str) -> dict:
+        """自适应间隔轮询异步任务直到完成或超时"""
+        deadline = time.monotonic() + self.timeout
+        interval = POLL_INITIAL
+        while True:
+            await asyncio.sleep(interval)
+            result = await run_in_threadpool(self._query_task, task_id)
+            status = (result.get("output") or {}).get("task_status")
+            if status in TASK_DONE_STATUSES:
+                return result
+            if status in TASK_FAILED_STATUSES:
+                message = (result.get("output") or {}).get("message") or status
+                raise HTTPException(status_code=502, detail=f"图片任务失败: {message}")
+            if time.monotonic() + interval > deadline:
+                raise HTTPException(status_code=504, detail="Image task timed out / 图片任务超时")
+            interval = min(interval * POLL_BACKOFF, POLL_MAX)
+
+    async def _generate_one(self, prompt: str, n: int, semaphore: asyncio.Semaphore) -> List[dict]:
+        async with semaphore:
+            result = await run_in_threadpool(self._submit, prompt, n)
+            task_id = get_task_id(result)
+            if task_id:
+                result = await self._poll(task_id)
+            return extract_images(result)
+
+    async def iter_images(self, prompt: str, n: int) -> AsyncIterator[dict]:
+        """按完成顺序逐张产出图片；单个子请求失败时产出 error 项，不影响其它子请求"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [
+            asyncio.ensure_future(self._generate_one(prompt, sub_n, semaphore))
+            for sub_n in self.split_n(n)
+        ]
+        index = 0
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    images = await future
+                except HTTPException as e:
+                    yield {"error": e.detail, "status": e.status_code}
+                    continue
+                except Exception as e:
+                    yield {"error": str(e), "status": 500}
+                    continue
+                for image in images:
+                    if image.get("file"):
+                        with self._lock:
+                            self._spills.discard(image["file"])
+                    yield {"index": index, **image}
+                    index += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+            with self._lock:
+                self._closed = True
+                orphans, self._spills = list(self._spills), set()
+            discard_files(orphans)
+
+    async def generate(self, prompt: str, n: int) -> List[dict]:
+        """等待全部子请求完成；全部失败时抛出第一个错误"""
+        images, errors = [], []
+        async for item in self.iter_images(prompt, n):
+            if "error" in item:
+                errors.append(item)
+            else:
+                images.append({k: v for k, v in item.items() if k != "index"})
+        if not images and errors:
+            raise HTTPException(status_code=errors[0]["status"], detail=errors[0]["error"])
+        return images
@@ -0,0 +1,424 @@
+"""
+图片存储模块 - 后台下载上游图片到本地内容寻址存储，生成缩略图，按 LRU 限制磁盘占用
+"""
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import logging
+import mimetypes
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+from config import get_settings
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时不生成缩略图，直接返回原图
+    Image = None
+
+# 内容寻址的文件不会变化，可以长期缓存
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_TYPE_EXT = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# 下载失败后保留源地址（用于重定向）的条数
+MAX_FAILED_SOURCES = 1000
+
+
+def url_key(url: str) -> str:
+    """源地址对应的稳定 key（下载完成前即可返回给前端）"""
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def is_public_url(url: str) -> bool:
+    """只下载解析到公网地址的 http(s) 地址，避免借图片存储读取内网服务或云元数据接口"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0].split("%")[0]).is_global for info in infos)
+
+
+def is_image_type(content_type: str) -> bool:
+    return (content_type or "").split(";")[0].strip().lower().startswith("image/")
+
+
+def guess_ext(content_type: str, head: bytes) -> str:
+    """根据 Content-Type 或文件头判断扩展名"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in CONTENT_TYPE_EXT:
+        return CONTENT_TYPE_EXT[content_type]
+    if head.startswith(b"\x89PNG"):
+        return ".png"
+    if head.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith(b"GIF8"):
+        return ".gif"
+    return ".bin"
+
+
+class ImageStore:
+    """内容寻址图片存储：blobs/<sha256><ext>，thumbs/<sha256>.jpg"""
+
+    def __init__(self, root: str, max_bytes: int, max_file_bytes: int, thumb_size: int = 256, workers: int = 4):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.thumb_dir = self.root / "thumbs"
+        self.index_path = self.root / "index.json"
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.thumb_size = thumb_size
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-store")
+        # key -> 文件名（sha256 + 扩展名）
+        self._keys: Dict[str, str] = {}
+        # key -> 源地址（下载中）；下载失败后移入 _failed，保留最近 MAX_FAILED_SOURCES 条用于重定向
+        self._sources: Dict[str, str] = {}
+        self._failed: "OrderedDict[str, str]" = OrderedDict()
+        # key -> 下载中的 Future
+        self._pending: Dict[str, Future] = {}
+        # 文件名 -> 占用字节数（含缩略图），按访问顺序排列
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._load()
+
+    def _load(self):
+        """启动时扫描磁盘，按修改时间恢复 LRU 顺序"""
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.thumb_dir.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.blob_dir.iterdir():
+            if path.is_file() and path.name.startswith("."):
+                # 进程中断时遗留的临时文件（一小时内的可能属于其它 worker，保留）
+                if path.stat().st_mtime < time.time() - 3600:
+                    path.unlink()
+            elif path.is_file():
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size + self._thumb_bytes(path.name)))
+        for _, name, size in sorted(entries):
+            self._lru[name] = size
+            self._total += size
+
+        if self.index_path.exists():
+            try:
+                index = json.loads(self.index_path.read_text())
+                self._keys = {k: v for k, v in index.items() if v in self._lru}
+            except (ValueError, OSError) as e:
+                logging.warning(f"Image store index unreadable: {e}")
+
+    def _save_index(self):
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._keys))
+        os.replace(tmp, self.index_path)
+
+    def _thumb_path(self, name: str) -> Path:
+        return self.thumb_dir / (name.rsplit(".", 1)[0] + ".jpg")
+
+    def _thumb_bytes(self, name: str) -> int:
+        thumb = self._thumb_path(name)
+        return thumb.stat().st_size if thumb.exists() else 0
+
+    # ---- 下载 ----
+
+    def submit(self, source_url: str) -> str:
+        """登记源地址并在后台下载，立即返回 key（data: 地址只解码保存，不保留源地址）"""
+        key = url_key(source_url)
+        with self._lock:
+            if key in self._keys or key in self._pending:
+                return key
+            if not source_url.startswith("data:"):
+                self._sources[key] = source_url
+            self._pending[key] = self._executor.submit(self._download, key, source_url)
+        return key
+
+    def submit_file(self, path: str) -> str:
+        """登记已解码到 blob 目录下的临时文件（上游 base64 图片），后台移入存储，立即返回 key"""
+        key = url_key(f"file:{path}")
+        with self._lock:
+            self._pending[key] = self._executor.submit(self._import_file, key, path)
+        return key
+
+    def _download(self, key: str, source_url: str) -> Optional[str]:
+        try:
+            name = self._fetch_to_blob(source_url)
+        except Exception as e:
+            logging.warning(f"Image download failed for {source_url[:80]}: {e}")
+            with self._lock:
+                self._pending.pop(key, None)
+                source = self._sources.pop(key, None)
+                if source is not None:
+                    self._failed[key] = source
+                    while len(self._failed) > MAX_FAILED_SOURCES:
+                        self._failed.popitem(last=False)
+            return None
+        return self._register(key, name)
+
+    def _import_file(self, key: str, path: str) -> Optional[str]:
+        try:
+            name = self._adopt_file(path)
+        except Exception as e:
+            logging.warning(f"Image import failed for {path}: {e}")
+            if os.path.exists(path):
+                os.unlink(path)
+            with self._lock:
+                self._pending.pop(key, None)
+            return None
+        return self._register(key, name)
+
+    def _register(self, key: str, name: str) -> str:
+        """生成缩略图并把 blob 记入索引和 LRU"""
+        self._make_thumbnail(name)
+        with self._lock:
+            size = (self.blob_dir / name).stat().st_size + self._thumb_bytes(name)
+            if name not in self._lru:
+                self._lru[name] = size
+                self._total += size
+            self._lru.move_to_end(name)
+            self._keys[key] = name
+            self._pending.pop(key, None)
+            self._sources.pop(key, None)
+            self._failed.pop(key, None)
+            self._evict()
+            self._save_index()
+        return name
+
+    def _fetch_to_blob(self, source_url: str) -> str:
+        """边下载边计算 sha256，写入临时文件后原子改名"""
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, prefix=".dl-")
+        written = 0
+        head = b""
+        content_type = ""
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if source_url.startswith("data:"):
+                    meta, _, payload = source_url.partition(",")
+                    content_type = meta[5:].split(";")[0]
+                    if not is_image_type(content_type):
+                        raise ValueError(f"not an image: {content_type[:50]}")
+                    data = base64.b64decode(payload)
+                    if len(data) > self.max_file_bytes:
+                        raise ValueError("image too large")
+                    digest.update(data)
+                    f.write(data)
+                    head = data[:16]
+                else:
+                    import requests  # 延迟导入，加快冷启动
+
+                    if not is_public_url(source_url):
+                        raise ValueError("image URL is not a public http(s) address")
+                    # 不跟随重定向：跳转目标未经过地址检查
+                    with requests.get(source_url, stream=True, timeout=60, allow_redirects=False) as resp:
+                        if resp.status_code != 200:
+                            raise ValueError(f"HTTP {resp.status_code}")
+                        content_type = resp.headers.get("Content-Type", "")
+                        if not is_image_type(content_type):
+                            raise ValueError(f"not an image: {content_type[:50]}")
+                        for chunk in resp.iter_content(chunk_size=64 * 1024):
+                            if not chunk:
+                                continue
+                            written += len(chunk)
+                            if written > self.max_file_bytes:
+                                raise ValueError("image too large")
+                            if len(head) < 16:
+                                head += chunk[:16]
+                            digest.update(chunk)
+                            f.write(chunk)
+            name = digest.hexdigest() + guess_ext(content_type, head)
+            target = self.blob_dir / name
+            if target.exists():
+                os.unlink(tmp_path)
+                os.utime(target)
+            else:
+                os.replace(tmp_path, target)
+            return name
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _adopt_file(self, path: str) -> str:
+        """计算临时文件的 sha256 后原子改名为内容寻址文件名"""
+        if os.path.getsize(path) > self.max_file_bytes:
+            raise ValueError("image too large")
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            head = f.read(16)
+            digest.update(head)
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        ext = guess_ext("", head)
+        if ext == ".bin":
+            raise ValueError("not an image")
+        name = digest.hexdigest() + ext
+        target = self.blob_dir / name
+        if target.exists():
+            os.unlink(path)
+            os.utime(target)
+        else:
+            os.replace(path, target)
+        return name
+
+    def _make_thumbnail(self, name: str):
+        if Image is None:
+            return
+        thumb = self._thumb_path(name)
+        if thumb.exists():
+            return
+        try:
+            with Image.open(self.blob_dir / name) as img:
+                img.thumbnail((self.thumb_size, self.thumb_size))
+                img.convert("RGB").save(thumb, "JPEG", quality=80)
+        except Exception as e:
+            logging.warning(f"Thumbnail generation failed for {name}: {e}")
+
+    def _evict(self):
+        """超过容量上限时删除最久未访问的文件（调用方持有锁）"""
+        while self._total > self.max_bytes and len(self._lru) > 1:
+            name, size = self._lru.popitem(last=False)
+            self._total -= size
+            for path in (self.blob_dir / name, self._thumb_path(name)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._keys = {k: v for k, v in self._keys.items() if v != name}
+
+    def pending_count(self) -> int:
+        """后台等待下载的图片数"""
+        return len(self._pending)
+
+    def flush(self, timeout: float) -> int:
+        """停机前等待后台下载完成（最多 timeout 秒），返回仍未完成的数量"""
+        with self._lock:
+            futures = list(self._pending.values())
+        if not futures:
+            return 0
+        _, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            logging.warning(f"Image store: {len(not_done)} download(s) unfinished at shutdown")
+        return len(not_done)
+
+    # ---- 读取 ----
+
+    async def resolve(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (文件名, 源地址)；下载中时等待下载完成"""
+        with self._lock:
+            name = self._keys.get(key)
+            future = self._pending.get(key)
+        if name is None and future is not None:
+            name = await asyncio.wrap_future(future)
+        with self._lock:
+            source = self._sources.get(key) or self._failed.get(key)
+        if name is not None:
+            with self._lock:
+                if name in self._lru:
+                    self._lru.move_to_end(name)
+                else:
+                    name = None
+        return name, source
+
+    def blob_path(self, name: str) -> Path:
+        return self.blob_dir / name
+
+    def thumb_path(self, name: str) -> Path:
+        thumb = self._thumb_path(name)
+        return thumb if thumb.exists() else self.blob_dir / name
+
+
+def read_range(path: Path, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+async def serve_file(path: Path, etag: str, request: Request) -> Response:
+    """带 ETag / Range / 长缓存头返回文件（文件读取在线程池中进行）"""
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    size = (await run_in_threadpool(path.stat)).st_size
+    range_header = request.headers.get("range")
+    if range_header:
+        match = RANGE_RE.match(range_header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start_s, end_s = match.groups()
+        if start_s:
+            start = int(start_s)
+            end = min(int(end_s), size - 1) if end_s else size - 1
+        else:
+            start = max(0, size - int(end_s))
+            end = size - 1
+        if start > end or start >= size:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        body = await run_in_threadpool(read_range, path, start, end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(body, status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(str(path), media_type=media_type, headers=headers)
+
+
+async def serve_image(store: ImageStore, key: str, request: Request, thumbnail: bool = False) -> Response:
+    """图片路由：本地命中直接返回，下载失败时重定向到源地址"""
+    name, source = await store.resolve(key)
+    if name is None:
+        if source:
+            return RedirectResponse(source, status_code=302)
+        raise HTTPException(status_code=404, detail="Image not found / 图片不存在")
+
+    digest = name.rsplit(".", 1)[0]
+    if thumbnail:
+        return await serve_file(await run_in_threadpool(store.thumb_path, name), f'"{digest}-t"', request)
+    return await serve_file(store.blob_path(name), f'"{digest}"', request)
+
+
+_store: Optional[ImageStore] = None
+
+
+def get_image_store() -> Optional[ImageStore]:
+    """获取全局图片存储；IMAGE_STORE_ENABLED=false 时返回 None（首次使用时按当时的配置创建，修改需重启）"""
+    global _store
+    settings = get_settings()
+    if _store is None and settings.image_store_enabled:
+        _store = ImageStore(
+            root=settings.image_store_dir,
+            max_bytes=settings.image_store_max_mb * 1024 * 1024,
+            max_file_bytes=settings.image_store_max_file_mb * 1024 * 1024,
+            thumb_size=settings.image_thumb_size,
+        )
+    return _store
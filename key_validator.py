@@ -0,0 +1,245 @@
+"""
+自定义 API Key 校验模块 - 首次使用某个 端点 + Key 组合时用模型列表接口探测一次，结果按 Key 的哈希缓存；
+已知无效的 Key（上游返回 401）直接返回错误，不再等待上游；记录每个 Key 的上游耗时，供 /api/usage 提示端点过慢
+"""
+import hashlib
+import logging
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+VALID = "valid"
+INVALID = "invalid"
+# 端点不支持模型列表、网络错误或 5xx：不拦截请求
+UNVERIFIED = "unverified"
+
+# 端点路径以这些后缀结尾时，把后缀换成 /models 作为探测地址（OpenAI 兼容接口）
+PROBE_SUFFIXES = ("/chat/completions", "/completions", "/images/generations", "/embeddings")
+# 探测结果为 unverified 时的缓存时间（秒）
+UNVERIFIED_TTL = 60
+# 每个 Key 保留最近这么多次上游耗时
+LATENCY_SAMPLES = 20
+# 最多缓存的 Key 数和客户端数
+MAX_KEYS = 10000
+MAX_CLIENTS = 10000
+
+
+def key_id(endpoint: str, api_key: str) -> str:
+    """缓存键：端点与 Key 的 sha256 前缀（内存中不保存 Key 原文）"""
+    return hashlib.sha256(f"{endpoint}\n{api_key}".encode("utf-8")).hexdigest()[:24]
+
+
+def models_url(endpoint: str) -> Optional[str]:
+    """由聊天 / 图片端点推出模型列表地址；无法推出时返回 None"""
+    parts = urlsplit(endpoint)
+    if parts.scheme not in ("http", "https"):
+        return None
+    path = parts.path.rstrip("/")
+    for suffix in PROBE_SUFFIXES:
+        if path.endswith(suffix):
+            return f"{parts.scheme}://{parts.netloc}{path[:-len(suffix)]}/models"
+    if path.endswith("/v1"):
+        return f"{parts.scheme}://{parts.netloc}{path}/models"
+    return None
+
+
+class KeyRecord:
+    """一个 端点 + Key 组合的校验结果与最近的上游耗时"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.status = UNVERIFIED
+        self.detail = ""
+        self.expires = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+
+class KeyValidator:
+    """按 Key 哈希缓存校验结果（有效 / 无效 / 未能确认）和最近的上游耗时"""
+
+    def __init__(self, valid_ttl: float = 3600, invalid_ttl: float = 600,
+                 probe_timeout: float = 5, slow_threshold: float = 10.0):
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self.probe_timeout = probe_timeout
+        self.slow_threshold = slow_threshold
+        self._records: "OrderedDict[str, KeyRecord]" = OrderedDict()
+        # 客户端（"user:<id>"，未登录为 "ip:<ip>"）-> 最近使用的 Key 哈希（/api/usage 不携带 Key）
+        self._clients: "OrderedDict[str, str]" = OrderedDict()
+        self._probing: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, kid: str, endpoint: str) -> KeyRecord:
+        """调用方需持有 _lock"""
+        record = self._records.get(kid)
+        if record is None:
+            record = self._records[kid] = KeyRecord(urlsplit(endpoint).netloc or endpoint)
+            while len(self._records) > MAX_KEYS:
+                self._records.popitem(last=False)
+        self._records.move_to_end(kid)
+        return record
+
+    def _set(self, kid: str, endpoint: str, status: str, detail: str = ""):
+        ttl = {VALID: self.valid_ttl, INVALID: self.invalid_ttl}.get(status, UNVERIFIED_TTL)
+        with self._lock:
+            record = self._record(kid, endpoint)
+            record.status, record.detail, record.expires = status, detail, time.monotonic() + ttl
+
+    def _probe(self, endpoint: str, api_key: str) -> tuple:
+        url = models_url(endpoint)
+        if url is None:
+            return UNVERIFIED, "endpoint has no models list"
+
+        import requests  # 延迟导入，加快冷启动
+
+        try:
+            resp = requests.get(url, headers={"Authorization": f"Bearer {api_key}"}, timeout=self.probe_timeout)
+            resp.close()
+        except requests.RequestException as e:
+            return UNVERIFIED, str(e)[:200]
+        # 403 可能只是 Key 没有列出模型的权限，不据此判定无效
+        if resp.status_code == 401:
+            return INVALID, f"HTTP {resp.status_code}"
+        if resp.status_code < 300:
+            return VALID, ""
+        return UNVERIFIED, f"HTTP {resp.status_code}"
+
+    def validate(self, endpoint: str, api_key: str, client: Optional[str] = None) -> str:
+        """返回校验结果（缓存过期时探测；同一 Key 的并发请求只探测一次）；会阻塞，需在线程中调用"""
+        kid = key_id(endpoint, api_key)
+        with self._lock:
+            if client is not None:
+                self._clients[client] = kid
+                self._clients.move_to_end(client)
+                while len(self._clients) > MAX_CLIENTS:
+                    self._clients.popitem(last=False)
+            record = self._records.get(kid)
+            if record is not None and record.expires > time.monotonic():
+                return record.status
+            future = self._probing.get(kid)
+            owner = future is None
+            if owner:
+                future = self._probing[kid] = Future()
+        if not owner:
+            try:
+                return future.result(timeout=self.probe_timeout + 5)
+            except FutureTimeout:
+                return UNVERIFIED
+
+        try:
+            status, detail = self._probe(endpoint, api_key)
+            self._set(kid, endpoint, status, detail)
+            if status == INVALID:
+                logging.info(f"Custom API key {kid[:8]} rejected by {urlsplit(endpoint).netloc}: {detail}")
+            future.set_result(status)
+            return status
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._probing.pop(kid, None)
+
+    def lookup(self, endpoint: str, api_key: str, client: Optional[str] = None) -> Optional[str]:
+        """只查缓存（不阻塞，可在事件循环中调用）；未缓存或已过期返回 None"""
+        kid = key_id(endpoint, api_key)
+        with self._lock:
+            if client is not None and self._clients.get(client) != kid:
+                return None  # 交给 validate 更新客户端与 Key 的对应关系
+            record = self._records.get(kid)
+            if record is not None and record.expires > time.monotonic():
+                return record.status
+        return None
+
+    def ensure_valid(self, endpoint: str, api_key: str, client: Optional[str] = None):
+        """Key 已知无效时抛出 400（需在线程中调用）"""
+        raise_if_invalid(self.validate(endpoint, api_key, client))
+
+    async def ensure_valid_async(self, endpoint: str, api_key: str, client: Optional[str] = None):
+        status = self.lookup(endpoint, api_key, client)
+        if status is None:
+            status = await run_in_threadpool(self.validate, endpoint, api_key, client)
+        raise_if_invalid(status)
+
+    def observe_rejection(self, endpoint: str, api_key: str, status_code: int) -> bool:
+        """上游返回 401 时把 Key 标记为无效；403（可能只是没有该模型或接口的权限）只让缓存过期，
+        下次请求重新探测模型列表；返回是否为这两种状态"""
+        kid = key_id(endpoint, api_key)
+        if status_code == 401:
+            self._set(kid, endpoint, INVALID, f"HTTP {status_code}")
+            return True
+        if status_code == 403:
+            with self._lock:
+                record = self._records.get(kid)
+                if record is not None and record.status == VALID:
+                    record.expires = 0.0
+            return True
+        return False
+
+    def observe(self, endpoint: str, api_key: str, elapsed: float, status_code: int = 200):
+        """记录一次真实上游请求：耗时计入统计；401 / 403 见 observe_rejection"""
+        if self.observe_rejection(endpoint, api_key, status_code):
+            return
+        kid = key_id(endpoint, api_key)
+        with self._lock:
+            record = self._record(kid, endpoint)
+            record.latencies.append(elapsed)
+            if status_code < 300 and record.status != VALID:
+                # 请求成功说明 Key 可用
+                record.status, record.detail, record.expires = VALID, "", time.monotonic() + self.valid_ttl
+
+    def client_report(self, client: str) -> Optional[dict]:
+        """该客户端最近使用的自定义 Key 的状态与耗时（供 /api/usage 返回）"""
+        with self._lock:
+            kid = self._clients.get(client)
+            record = self._records.get(kid) if kid else None
+            if record is None:
+                return None
+            latencies = list(record.latencies)
+            status, host = record.status, record.host
+        report = {"endpoint": host, "status": status}
+        if latencies:
+            median = statistics.median(latencies)
+            report["median_latency_ms"] = round(median * 1000)
+            report["requests"] = len(latencies)
+            report["slow"] = median >= self.slow_threshold
+        if status == INVALID:
+            report["warning"] = f"Custom API key was rejected by {host} / 自定义 API Key 被 {host} 拒绝"
+        elif report.get("slow"):
+            report["warning"] = (
+                f"Custom endpoint {host} is slow (median {report['median_latency_ms']} ms) / "
+                f"自定义端点响应较慢（中位数 {report['median_latency_ms']} 毫秒）"
+            )
+        return report
+
+
+def raise_if_invalid(status: str):
+    if status == INVALID:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid API key for this endpoint / 该端点拒绝了此 API Key，请检查 Key 和接口地址"
+        )
+
+
+_validator: Optional[KeyValidator] = None
+
+
+def get_key_validator(settings) -> Optional[KeyValidator]:
+    """KEY_VALIDATION_ENABLED=true 时返回全局校验器（TTL 等参数随配置重载更新，已缓存的结果保留）"""
+    global _validator
+    if not settings.key_validation_enabled:
+        return None
+    if _validator is None:
+        _validator = KeyValidator()
+    _validator.valid_ttl = settings.key_validation_ttl
+    _validator.invalid_ttl = settings.key_invalid_ttl
+    _validator.probe_timeout = settings.key_probe_timeout
+    _validator.slow_threshold = settings.custom_endpoint_slow_ms / 1000
+    return _validator
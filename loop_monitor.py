@@ -0,0 +1,176 @@
+"""
+事件循环监控模块 - 测量事件循环调度延迟和 Starlette 线程池（anyio 默认线程限制器）的占用与排队；
+超过阈值时记录阻塞事件循环的调用栈，供 /loopz 返回给负载均衡器摘除卡住的 worker
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Deque, Optional, Tuple
+
+import anyio.to_thread
+from fastapi.responses import JSONResponse
+
+# /loopz 按最近这么多秒内的最大延迟判断是否卡顿（卡住期间探针本身无法响应，恢复后仍需报告一段时间）
+RECENT_SECONDS = 5.0
+
+# 线程池线程名（Starlette run_in_threadpool / iterate_in_threadpool 使用 anyio 工作线程）
+WORKER_THREAD_NAME = "AnyIO worker thread"
+
+
+def format_stack(frame, limit: int = 30) -> str:
+    return "".join(traceback.format_stack(frame, limit=limit))
+
+
+def innermost_app_frame(frame) -> Optional[str]:
+    """线程当前所在的最内层应用代码位置（非标准库 / 第三方库）；空闲线程返回 None"""
+    while frame is not None:
+        code = frame.f_code
+        if "site-packages" not in code.co_filename and "/lib/python" not in code.co_filename:
+            return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+        frame = frame.f_back
+    return None
+
+
+class LoopMonitor:
+    """每 interval 秒唤醒一次测量调度延迟；看门狗线程在事件循环卡住期间抓取其调用栈"""
+
+    def __init__(self, interval: float = 0.1, lag_threshold: float = 0.25,
+                 queue_threshold: int = 20, window: float = 60.0, keep_stalls: int = 20):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.queue_threshold = queue_threshold
+        self.window = window
+        self.lag = 0.0
+        # (monotonic 时间, 延迟秒数)
+        self.lags: Deque[Tuple[float, float]] = deque()
+        self.stalls: Deque[dict] = deque(maxlen=keep_stalls)
+        self.stall_count = 0
+        self.threadpool = {"total": 0, "busy": 0, "waiting": 0, "max_waiting": 0}
+        self.saturated = False
+        self._beat = time.monotonic()
+        self._stall_stack: Optional[str] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---- 事件循环侧 ----
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self._beat = time.monotonic()
+            self._record_lag(max(0.0, now - expected), now)
+            self._sample_threadpool()
+
+    def _record_lag(self, lag: float, now: float):
+        self.lag = lag
+        self.lags.append((now, lag))
+        while self.lags and self.lags[0][0] < now - self.window:
+            self.lags.popleft()
+        if lag >= self.lag_threshold:
+            self.stall_count += 1
+            stall = {"at": time.time() - lag, "lag_ms": round(lag * 1000, 1), "stack": self._stall_stack}
+            self.stalls.append(stall)
+            # 看门狗没抓到栈（卡顿短于检查间隔）时只记录时长
+            logging.warning(
+                f"Event loop blocked for {stall['lag_ms']} ms"
+                + (f", blocking stack:\n{stall['stack']}" if stall["stack"] else "")
+            )
+        self._stall_stack = None
+
+    def _sample_threadpool(self):
+        stats = anyio.to_thread.current_default_thread_limiter().statistics()
+        waiting = stats.tasks_waiting
+        self.threadpool = {
+            "total": int(stats.total_tokens),
+            "busy": stats.borrowed_tokens,
+            "waiting": waiting,
+            "max_waiting": max(self.threadpool["max_waiting"], waiting),
+        }
+        saturated = stats.borrowed_tokens >= stats.total_tokens and waiting >= self.queue_threshold
+        if saturated and not self.saturated:
+            logging.warning(
+                f"Threadpool saturated: {stats.borrowed_tokens}/{int(stats.total_tokens)} busy, "
+                f"{waiting} waiting; workers are in: {self.worker_summary()}"
+            )
+        elif self.saturated and not saturated:
+            logging.info("Threadpool recovered")
+        self.saturated = saturated
+
+    def worker_summary(self, top: int = 5) -> dict:
+        """线程池线程当前所在位置的计数（最多 top 项）"""
+        workers = {thread.ident for thread in threading.enumerate() if thread.name == WORKER_THREAD_NAME}
+        frames = sys._current_frames()
+        locations = (innermost_app_frame(frames[ident]) for ident in workers if ident in frames)
+        counts = Counter(location for location in locations if location)
+        return dict(counts.most_common(top))
+
+    # ---- 看门狗线程 ----
+
+    def _watch(self):
+        captured_for = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat < self.lag_threshold or captured_for == beat:
+                continue
+            # 事件循环在本次心跳之后一直没有被调度：抓取它此刻的调用栈
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._stall_stack = format_stack(frame)
+            captured_for = beat
+
+    # ---- 生命周期与状态 ----
+
+    def start(self):
+        """在事件循环线程中调用"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        lags = sorted(lag for _, lag in self.lags)
+        return {
+            "lag_ms": round(self.lag * 1000, 1),
+            "window_s": self.window,
+            "p99_lag_ms": round(lags[int(len(lags) * 0.99)] * 1000, 1) if lags else 0.0,
+            "max_lag_ms": round(lags[-1] * 1000, 1) if lags else 0.0,
+            "stalls": self.stall_count,
+            # 调用栈只写日志和管理员接口，不出现在公开的探针响应中
+            "last_stall": {k: v for k, v in self.stalls[-1].items() if k != "stack"} if self.stalls else None,
+            "threadpool": self.threadpool,
+            "threadpool_saturated": self.saturated,
+        }
+
+    def recent_max_lag(self) -> float:
+        since = asyncio.get_running_loop().time() - RECENT_SECONDS
+        return max((lag for at, lag in reversed(self.lags) if at >= since), default=0.0)
+
+    def status_response(self) -> JSONResponse:
+        """最近 RECENT_SECONDS 秒内延迟超过阈值或线程池饱和时返回 503"""
+        body = self.status()
+        healthy = self.recent_max_lag() < self.lag_threshold and not self.saturated
+        body["ok"] = healthy
+        return JSONResponse(body, status_code=200 if healthy else 503)
@@ -1,39 +1,111 @@
-from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi import FastAPI, HTTPException, Request, Depends, Header, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Literal, Dict
 import os
 from pathlib import Path
-import requests
-from dotenv import load_dotenv
 import json
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+import secrets
+import signal
 from datetime import datetime, date, timedelta
 from collections import defaultdict
 import logging
+import time
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from starlette.requests import HTTPConnection
 import urllib.parse
 
+# Load environment variables from .env file（必须在导入其它模块之前，且只加载一次；已有的环境变量优先）
+from config import load_env
+load_env()
+
 # 导入认证模块
 from auth import (
     get_db, create_access_token, verify_token,
-    create_user, authenticate_user, get_user_by_id, User
+    create_user, authenticate_user, get_user_by_id, get_or_create_wechat_user, User, get_engine, init_db
+)
+from batch_jobs import BatchJobStore, parse_jsonl, read_request_body
+from agent_sessions import get_session_id, save_session_id, evict_expired
+from config import Settings, get_settings, reload_settings, restart_required_changes
+from image_service import ImageClient
+from safety_filter import get_safety_filter
+from semantic_cache import get_semantic_cache, cache_namespace
+from image_store import get_image_store, serve_image
+from static_assets import StaticAssets
+from fast_json import FastJSONResponse, SSE_DONE, sse_frame, ndjson_line, loads
+from stream_coalescer import coalesce_text
+from ws_transport import StreamMux, receive_auth, CLOSE_UNAUTHORIZED
+from shutdown import GracefulShutdown, DrainMiddleware, RESTART_MESSAGE
+from wechat_client import close_wechat_client, get_wechat_client
+from upstream_body import ERROR_EXCERPT_BYTES, error_message, read_body
+from profiler import SamplingProfiler, SlowRequestLog, SlowRequestMiddleware, collapsed
+from loop_monitor import LoopMonitor
+from prompt_registry import PromptEntry, prompt_usage
+from key_validator import KeyValidator, get_key_validator
+from compression import CompressionMiddleware
+from health import (
+    HealthMonitor, InFlightCounter, InFlightMiddleware, LivenessMiddleware,
+    database_check, upstream_check, queue_check
 )
 
 logging.basicConfig(level=logging.DEBUG)
 
-# Load environment variables from .env file
-load_dotenv()
 
-app = FastAPI(title="OpenChatBox API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时建表、构建静态资源、启动后台检查；关闭时保存用量并停止后台任务"""
+    settings = get_settings()
+    # 建表只在进程启动时执行一次；多实例部署可设为 false 并提前运行 python auth.py
+    if settings.db_auto_create:
+        await run_in_threadpool(init_db)
+    await run_in_threadpool(evict_expired, settings.agent_session_ttl_minutes)
+    load_usage_state(settings.usage_state_file)
+    static_assets.build()
+    health_monitor.start()
+    loop_monitor.start()
+    install_reload_signal()
+    graceful_shutdown.install()
+    if settings.profiler_enabled:
+        profiler.start()
+    yield
+    profiler.stop()
+    # uvicorn 已停止接收连接并等待进行中的请求结束（SIGTERM 时先经过排空）
+    save_usage_state(get_settings().usage_state_file)
+    store = get_image_store()
+    if store is not None:
+        await run_in_threadpool(store.flush, 5.0)
+    await close_wechat_client()
+    await loop_monitor.stop()
+    await health_monitor.stop()
+
+
+def install_reload_signal():
+    """kill -HUP <pid> 触发配置热重载（Windows 或非主线程时跳过）"""
+    def on_sighup():
+        try:
+            reload_config()
+        except Exception:
+            pass
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
+    except (NotImplementedError, RuntimeError, AttributeError, ValueError):
+        logging.debug("SIGHUP reload not available on this platform")
+
+
+app = FastAPI(title="OpenChatBox API", lifespan=lifespan)
 
 # Get the parent directory (project root)
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 
-# Mount static files
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+# Mount static files（预压缩 + 内容哈希文件名）
+static_assets = StaticAssets(STATIC_DIR)
+app.mount("/static", static_assets, name="static")
 
 # 配置 CORS
 app.add_middleware(
@@ -44,10 +116,120 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 压缩 JSON 响应与 SSE / NDJSON 流（流式响应逐事件 flush；静态资源已预压缩，不会重复压缩）
+if get_settings().compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=get_settings().compression_min_size,
+        gzip_level=get_settings().gzip_level,
+        brotli_quality=get_settings().brotli_quality,
+    )
+
+# 统计正在处理的请求数，供就绪探针使用
+in_flight = InFlightCounter()
+app.add_middleware(InFlightMiddleware, counter=in_flight)
+
+# 可选的采样分析：PROFILER_ENABLED=true 时启动，慢请求保留处理期间的调用栈
+profiler = SamplingProfiler(interval=get_settings().profiler_interval_ms / 1000)
+slow_requests = SlowRequestLog(keep=get_settings().slow_request_keep, threshold=get_settings().slow_request_ms / 1000)
+app.add_middleware(SlowRequestMiddleware, profiler=profiler, log=slow_requests)
+
+# SIGTERM 时排空：新请求快速返回 503，进行中的流在期限内完成（仅在存活探针之内，拒绝的请求不计入 in-flight）
+graceful_shutdown = GracefulShutdown(in_flight, drain_timeout=get_settings().drain_timeout)
+app.add_middleware(DrainMiddleware, shutdown=graceful_shutdown)
+
+# 存活探针在最外层直接应答（预先构建的响应，不经过排空、分析、计数、压缩和 CORS）
+app.add_middleware(LivenessMiddleware)
+
+# 后台健康检查（探针请求本身不做任何 I/O）
+health_monitor = HealthMonitor(interval=get_settings().health_check_interval)
+health_monitor.register("database", database_check(get_engine))
+
+
+def register_config_checks(settings: Settings):
+    """注册依赖配置的检查（配置重载时重新注册）"""
+    health_monitor.register("upstream", upstream_check(settings.chat_endpoint))
+    health_monitor.register(
+        "queue",
+        queue_check(
+            in_flight,
+            settings.ready_max_in_flight,
+            pending=lambda: get_image_store().pending_count() if get_image_store() else 0
+        )
+    )
+
+
+register_config_checks(get_settings())
+
+# 事件循环延迟与线程池占用（/loopz）
+loop_monitor = LoopMonitor(
+    interval=get_settings().loop_monitor_interval_ms / 1000,
+    lag_threshold=get_settings().loop_lag_threshold_ms / 1000,
+    queue_threshold=get_settings().threadpool_queue_threshold
+)
+
+# 批量任务（内存中保存，完成后按 TTL 清理）
+batch_jobs = BatchJobStore(ttl_seconds=get_settings().batch_job_ttl_minutes * 60)
+
+
+def apply_runtime_settings(settings: Settings):
+    """配置重载后更新启动时创建的组件；config.RESTART_REQUIRED 中的配置需重启才生效"""
+    slow_requests.threshold = settings.slow_request_ms / 1000
+    slow_requests.resize(settings.slow_request_keep)
+    profiler.interval = settings.profiler_interval_ms / 1000
+    if settings.profiler_enabled and not profiler.running:
+        profiler.start()
+    elif not settings.profiler_enabled and profiler.running:
+        profiler.stop()
+    graceful_shutdown.drain_timeout = settings.drain_timeout
+    health_monitor.interval = settings.health_check_interval
+    register_config_checks(settings)
+    loop_monitor.interval = settings.loop_monitor_interval_ms / 1000
+    loop_monitor.lag_threshold = settings.loop_lag_threshold_ms / 1000
+    loop_monitor.queue_threshold = settings.threadpool_queue_threshold
+    batch_jobs.ttl_seconds = settings.batch_job_ttl_minutes * 60
+
+
+def reload_config() -> List[str]:
+    """重新读取 .env 与环境变量并应用；返回需要重启才能生效的已修改配置"""
+    old = get_settings()
+    settings = reload_settings()
+    apply_runtime_settings(settings)
+    return restart_required_changes(old, settings)
+
 # IP限流存储：{date: {ip: count}}
 ip_usage: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
 
-def get_client_ip(request: Request) -> str:
+def save_usage_state(path: Optional[str]):
+    """把今日 IP 用量写入文件，重启后继续计数"""
+    today = date.today().isoformat()
+    if not path or today not in ip_usage:
+        return
+    try:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"date": today, "usage": ip_usage[today]}, f)
+        os.replace(tmp, path)
+        logging.info(f"Saved usage state for {len(ip_usage[today])} IPs to {path}")
+    except OSError as e:
+        logging.error(f"Failed to save usage state: {e}")
+
+
+def load_usage_state(path: Optional[str]):
+    """启动时恢复今日 IP 用量（文件不是今天的则忽略）"""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to load usage state: {e}")
+        return
+    if state.get("date") == date.today().isoformat():
+        ip_usage[state["date"]].update(state.get("usage") or {})
+
+
+def get_client_ip(request: HTTPConnection) -> str:
     """获取客户端真实IP地址"""
     # 优先从代理头获取（如果使用了反向代理）
     forwarded = request.headers.get("X-Forwarded-For")
@@ -61,14 +243,14 @@ def get_client_ip(request: Request) -> str:
     # 直接连接的IP
     return request.client.host if request.client else "unknown"
 
-def check_ip_limit(ip: str, has_custom_key: bool) -> bool:
-    """检查IP是否超过每日限制"""
+def check_ip_limit(ip: str, has_custom_key: bool, cost: int = 1) -> bool:
+    """检查IP剩余额度是否够本次消耗（cost 为本次计入的次数，例如生成的图片张数）"""
     # 如果使用自定义key，不限制
     if has_custom_key:
         return True
     
     today = date.today().isoformat()
-    daily_limit = int(os.getenv("DAILY_FREE_LIMIT", "10"))
+    daily_limit = get_settings().daily_free_limit
     
     # 获取今天的使用记录
     if today not in ip_usage:
@@ -77,9 +259,9 @@ def check_ip_limit(ip: str, has_custom_key: bool) -> bool:
         ip_usage[today] = defaultdict(int)
     
     current_usage = ip_usage[today][ip]
-    return current_usage < daily_limit
+    return current_usage + cost <= daily_limit
 
-def increment_ip_usage(ip: str, has_custom_key: bool):
+def increment_ip_usage(ip: str, has_custom_key: bool, amount: int = 1):
     """增加IP使用计数"""
     # 如果使用自定义key，不计数
     if has_custom_key:
@@ -89,12 +271,12 @@ def increment_ip_usage(ip: str, has_custom_key: bool):
     if today not in ip_usage:
         ip_usage[today] = defaultdict(int)
     
-    ip_usage[today][ip] += 1
+    ip_usage[today][ip] += amount
 
 def get_ip_usage(ip: str) -> dict:
     """获取IP使用情况"""
     today = date.today().isoformat()
-    daily_limit = int(os.getenv("DAILY_FREE_LIMIT", "10"))
+    daily_limit = get_settings().daily_free_limit
     
     if today not in ip_usage:
         return {"used": 0, "limit": daily_limit, "remaining": daily_limit}
@@ -107,6 +289,9 @@ def get_ip_usage(ip: str) -> dict:
     }
 
 # 请求模型
+# 单次生成图片张数的硬上限（IMAGE_MAX_N 不能超过此值）
+IMAGE_MAX_N_LIMIT = 10
+
 class Message(BaseModel):
     role: Literal["system", "user", "assistant"]
     content: str
@@ -119,20 +304,23 @@ class ChatRequest(BaseModel):
     max_tokens: Optional[int] = None
     temperature: Optional[float] = 0.7
     api_key: Optional[str] = None  # 改为可选
+    prompt_id: Optional[str] = None  # 服务端提示词注册表中的 "id" 或 "id@version"，作为首条系统消息
 
 class ImageRequest(BaseModel):
     prompt: str
     model: Optional[str] = None  # 改为可选
     size: Optional[str] = None  # 改为可选
-    n: int = 1
+    n: int = Field(1, ge=1, le=IMAGE_MAX_N_LIMIT)  # 实际上限由 IMAGE_MAX_N 配置
     api_key: Optional[str] = None  # 改为可选
     endpoint_url: Optional[str] = None  # 改为可选
+    stream: bool = False  # 是否以 SSE 逐张返回
 
 
 class AgentRequest(BaseModel):
     input: dict
     parameters: Optional[dict] = {}
     api_key: Optional[str] = None
+    conversation_id: Optional[str] = None  # 前端对话ID，服务端据此复用 DashScope session_id
 
 
 class RegisterRequest(BaseModel):
@@ -147,12 +335,21 @@ class LoginRequest(BaseModel):
     password: str  # 密码
 
 
+class WeChatLoginRequest(BaseModel):
+    code: str = Field(min_length=1, max_length=128)  # 微信回调返回的授权码
+
+
 def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> Optional[User]:
     """获取当前登录用户（可选）"""
     if not authorization or not authorization.startswith("Bearer "):
         return None
     
     token = authorization.replace("Bearer ", "")
+    return user_from_token(db, token)
+
+
+def user_from_token(db: Session, token: str) -> Optional[User]:
+    """JWT 对应的用户；令牌无效或用户不存在时返回 None"""
     payload = verify_token(token)
     
     if not payload:
@@ -162,8 +359,7 @@ def get_current_user(authorization: Optional[str] = Header(None), db: Session =
     if not user_id:
         return None
     
-    user = get_user_by_id(db, user_id)
-    return user
+    return get_user_by_id(db, user_id)
 
 
 def require_auth(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> User:
@@ -179,83 +375,74 @@ def require_auth(authorization: Optional[str] = Header(None), db: Session = Depe
     return user
 
 
-def wechat_get_access_token(code: str) -> dict:
-    """通过微信授权码获取access_token"""
-    app_id = os.getenv("WECHAT_APP_ID")
-    app_secret = os.getenv("WECHAT_APP_SECRET")
-    
-    if not app_id or not app_secret:
-        raise HTTPException(
-            status_code=500, 
-            detail="WeChat not configured / 微信登录未配置"
-        )
-    
-    url = f"https://api.weixin.qq.com/sns/oauth2/access_token"
-    params = {
-        "appid": app_id,
-        "secret": app_secret,
-        "code": code,
-        "grant_type": "authorization_code"
-    }
-    
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        data = resp.json()
-        
-        if "errcode" in data:
-            raise HTTPException(
-                status_code=400,
-                detail=f"WeChat auth failed / 微信认证失败: {data.get('errmsg', 'Unknown error')}"
-            )
-        
-        return data
-    except requests.RequestException as e:
+def is_admin_user(user: User, settings: Settings) -> bool:
+    """is_admin 标记的用户，或 ADMIN_USERNAMES 中列出的用户"""
+    return bool(user.is_admin) or user.username in settings.admin_usernames
+
+
+def require_admin(user: User = Depends(require_auth), settings: Settings = Depends(get_settings)) -> User:
+    """需要管理员权限的依赖项"""
+    if not is_admin_user(user, settings):
+        raise HTTPException(status_code=403, detail="Admin only / 仅限管理员")
+    return user
+
+
+def ensure_login(current_user: Optional[User], settings: Settings):
+    """REQUIRE_AUTH=true 时未登录用户返回 401"""
+    if settings.require_auth and not current_user:
         raise HTTPException(
-            status_code=502,
-            detail=f"WeChat API request failed / 微信API请求失败: {str(e)}"
+            status_code=401,
+            detail="Authentication required. Please login. / 需要登录才能使用。"
         )
 
 
-def wechat_get_user_info(access_token: str, openid: str) -> dict:
-    """获取微信用户信息"""
-    url = "https://api.weixin.qq.com/sns/userinfo"
-    params = {
-        "access_token": access_token,
-        "openid": openid,
-        "lang": "zh_CN"
-    }
-    
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        data = resp.json()
-        
-        if "errcode" in data:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to get user info / 获取用户信息失败: {data.get('errmsg', 'Unknown error')}"
-            )
-        
-        return data
-    except requests.RequestException as e:
+def client_identity(current_user: Optional[User], client_ip: str) -> str:
+    """按用户区分客户端（未登录时按 IP），避免 NAT 后的多个用户共用缓存或 Key 状态"""
+    return f"user:{current_user.id}" if current_user else f"ip:{client_ip}"
+
+
+def ensure_quota(client_ip: str, has_custom_key: bool, cost: int = 1):
+    """免费配额不足时返回 429"""
+    if not check_ip_limit(client_ip, has_custom_key, cost):
+        usage = get_ip_usage(client_ip)
         raise HTTPException(
-            status_code=502,
-            detail=f"WeChat API request failed / 微信API请求失败: {str(e)}"
+            status_code=429,
+            detail=f"Daily free quota exceeded ({usage['used']}/{usage['limit']}). Please provide your own API key. / 每日免费配额已用完 ({usage['used']}/{usage['limit']})，请输入自己的 API Key。"
         )
 
-def get_default_config():
-    """从环境变量获取默认配置"""
-    return {
-        "chat_endpoint": os.getenv("DEFAULT_CHAT_ENDPOINT", "https://api.openai.com/v1"),
-        "chat_model": os.getenv("DEFAULT_CHAT_MODEL", "qwen-plus"),
-        "chat_api_key": os.getenv("DEFAULT_CHAT_API_KEY", ""),
-        "image_endpoint": os.getenv("DEFAULT_IMAGE_ENDPOINT", "https://api.openai.com/v1/images/generations"),
-        "image_model": os.getenv("DEFAULT_IMAGE_MODEL", "dall-e-3"),
-        "image_size": os.getenv("DEFAULT_IMAGE_SIZE", "1024x1024"),
-        "image_api_key": os.getenv("DEFAULT_IMAGE_API_KEY", ""),
-    }
 
+def localize_image(image: dict, fetch_remote: bool = True) -> dict:
+    """把上游图片地址换成本地存储地址，后台下载原图；已解码到文件的 base64 图片直接移入存储
 
-def make_api_request(endpoint: str, data: dict, api_key: str):
+    fetch_remote=False（用户自定义的图片端点）时不在服务端下载其返回的图片地址，原样交给浏览器
+    """
+    store = get_image_store()
+    if image.get("file"):
+        path = image.pop("file")
+        if store is not None:
+            key = store.submit_file(path)
+            return {**image, "url": f"api/images/{key}", "thumbnail": f"api/images/{key}/thumb"}
+        # base64 图片需要图片存储提供访问地址（不再重新编码成 data URL 放进响应）
+        os.unlink(path)
+        return {
+            **image,
+            "error": "base64 images require IMAGE_STORE_ENABLED=true / 返回 base64 图片的端点需要启用图片存储",
+            "status": 502,
+        }
+    if store is None or not image.get("url"):
+        return image
+    if not fetch_remote and not image["url"].startswith("data:"):
+        return image
+    key = store.submit(image["url"])
+    # 相对路径，配合 index.html 的 <base> 适配 SCRIPT_NAME 前缀
+    localized = {**image, "url": f"api/images/{key}", "thumbnail": f"api/images/{key}/thumb"}
+    # data: 地址可能有数 MB，不再原样返回
+    if not image["url"].startswith("data:"):
+        localized["source_url"] = image["url"]
+    return localized
+
+
+def make_api_request(endpoint: str, data: dict, api_key: str, max_response_bytes: int):
     """发送HTTP请求到云平台API；如果 endpoint 是完整 URL 则直接使用，不再盲目拼接"""
     # 如果 endpoint 是完整 URL，直接使用
     if isinstance(endpoint, str) and endpoint.lower().startswith(("http://", "https://")):
@@ -269,45 +456,74 @@ def make_api_request(endpoint: str, data: dict, api_key: str):
         "Authorization": f"Bearer {api_key}"  # 直接使用传入的 api_key
     }
     
+    import requests  # 延迟导入，加快冷启动
+
     try:
-        resp = requests.post(url, headers=headers, json=data, timeout=60)
+        resp = requests.post(url, headers=headers, json=data, timeout=60, stream=True)
+        if resp.status_code >= 400:
+            # 只读取错误响应的开头部分
+            raise HTTPException(
+                status_code=resp.status_code,
+                detail=f"API request failed / API请求失败: {error_message(resp)[:200]}"
+            )
+        # 限制大小，直接从 bytes 解析一次（不再经过 resp.text）
+        with resp:
+            body = read_body(resp, max_response_bytes)
     except requests.RequestException as e:
         raise HTTPException(status_code=502, detail=f"Upstream request failed / 上游请求失败: {str(e)}")
-    
-    if resp.status_code >= 400:
-        # 尝试解析错误信息
-        try:
-            error_data = resp.json()
-            error_msg = error_data.get("error", {}).get("message", resp.text)
-        except:
-            error_msg = resp.text
-        
-        raise HTTPException(
-            status_code=resp.status_code, 
-            detail=f"API request failed / API请求失败: {error_msg[:200]}"
-        )
-    
+
     try:
-        return resp.json()
+        return loads(body)
     except ValueError:
-        return {"raw_text": resp.text}
+        return {"raw_text": body[:ERROR_EXCERPT_BYTES].decode("utf-8", "replace")}
+
+def chat_api_request(endpoint: str, data: dict, api_key: str, settings: Settings,
+                     validator: Optional[KeyValidator] = None):
+    """发送聊天请求；使用自定义 Key 时记录上游耗时，上游返回 401 时缓存为无效 Key"""
+    max_bytes = settings.upstream_max_response_mb * 1024 * 1024
+    if validator is None:
+        return make_api_request(endpoint, data, api_key, max_bytes)
+    started = time.monotonic()
+    try:
+        result = make_api_request(endpoint, data, api_key, max_bytes)
+    except HTTPException as e:
+        validator.observe(endpoint, api_key, time.monotonic() - started, e.status_code)
+        raise
+    validator.observe(endpoint, api_key, time.monotonic() - started)
+    return result
 
 @app.get("/")
-async def root():
+async def root(req: Request):
     """Serve the main HTML page / 提供主页面"""
-    return FileResponse(str(STATIC_DIR / "index.html"))
+    return static_assets.index_response(req)
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness probe (cached background checks) / 就绪探针（后台检查缓存结果）"""
+    if graceful_shutdown.draining:
+        return FastJSONResponse({"status": "draining", "detail": RESTART_MESSAGE}, status_code=503)
+    return health_monitor.readiness_response()
+
+@app.get("/loopz")
+async def loopz():
+    """Event-loop lag and threadpool saturation (503 when stalled) / 事件循环延迟与线程池占用（卡顿时返回 503）"""
+    return loop_monitor.status_response()
+
 
 @app.get("/api/config")
-async def get_config():
+async def get_config(req: Request, settings: Settings = Depends(get_settings)):
     """Get application configuration / 获取应用配置"""
-    return {
-        "appName": os.getenv("APP_NAME", "多云聊天平台"),
-        "appNameEn": os.getenv("APP_NAME_EN", "Multi-Cloud Chat"),
-        "dailyFreeLimit": int(os.getenv("DAILY_FREE_LIMIT", "10")),
-        "wechatEnabled": bool(os.getenv("WECHAT_APP_ID")),
-        "wechatAppId": os.getenv("WECHAT_APP_ID", ""),
-        "requireAuth": os.getenv("REQUIRE_AUTH", "false").lower() == "true"
-    }
+    return settings.config_json.response(req)
+
+
+@app.post("/api/admin/reload-config")
+async def admin_reload_config(user: User = Depends(require_admin)):
+    """Reload configuration from environment / 重新加载配置"""
+    try:
+        restart_required = reload_config()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Config reload failed / 配置重载失败: {str(e)[:200]}")
+    return {"reloaded": True, "restart_required": restart_required}
 
 
 @app.post("/api/auth/register")
@@ -370,6 +586,144 @@ async def login(request: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Login failed / 登录失败: {str(e)}")
 
 
+# 微信扫码登录的 state（防止登录 CSRF），保存在 cookie 中
+WECHAT_STATE_COOKIE = "wechat_state"
+WECHAT_QRCONNECT_URL = "https://open.weixin.qq.com/connect/qrconnect"
+
+
+async def wechat_sign_in(code: str, db: Session, settings: Settings) -> dict:
+    """用授权码换取微信用户信息，查找或创建对应用户并签发 JWT"""
+    info = await get_wechat_client(settings).login(code)
+    openid = info.get("openid")
+    if not openid:
+        raise HTTPException(status_code=502, detail="WeChat returned no openid / 微信未返回 openid")
+    user = await run_in_threadpool(
+        get_or_create_wechat_user, db, openid, info.get("nickname"), info.get("headimgurl")
+    )
+    return {
+        "token": create_access_token({"user_id": user.id}),
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "nickname": user.nickname,
+            "email": user.email,
+            "avatar": user.avatar
+        }
+    }
+
+
+@app.post("/api/auth/wechat")
+async def wechat_login(
+    request: WeChatLoginRequest,
+    db: Session = Depends(get_db),
+    settings: Settings = Depends(get_settings)
+):
+    """微信登录（客户端自行完成授权跳转，提交授权码）"""
+    return await wechat_sign_in(request.code, db, settings)
+
+
+@app.get("/api/auth/wechat/authorize")
+async def wechat_authorize(req: Request, settings: Settings = Depends(get_settings)):
+    """跳转到微信扫码登录页，授权后回到 /wechat-callback"""
+    if not settings.wechat_app_id or not settings.wechat_app_secret:
+        raise HTTPException(status_code=500, detail="WeChat not configured / 微信登录未配置")
+    state = secrets.token_urlsafe(16)
+    params = urllib.parse.urlencode({
+        "appid": settings.wechat_app_id,
+        "redirect_uri": f"{req.base_url}wechat-callback",
+        "response_type": "code",
+        "scope": "snsapi_login",
+        "state": state,
+    })
+    response = RedirectResponse(f"{WECHAT_QRCONNECT_URL}?{params}#wechat_redirect", status_code=302)
+    response.set_cookie(WECHAT_STATE_COOKIE, state, max_age=600, httponly=True, samesite="lax")
+    return response
+
+
+@app.get("/wechat-callback")
+async def wechat_callback(
+    req: Request,
+    code: str = "",
+    state: str = "",
+    db: Session = Depends(get_db),
+    settings: Settings = Depends(get_settings)
+):
+    """微信授权回调：登录后带着令牌回到首页（令牌放在 # 之后，不会发送给服务器或写入访问日志）"""
+    expected = req.cookies.get(WECHAT_STATE_COOKIE)
+    if not code or not expected or not secrets.compare_digest(state, expected):
+        fragment = urllib.parse.urlencode({"wechat_error": "Invalid login state / 登录状态无效，请重新扫码"})
+    else:
+        try:
+            result = await wechat_sign_in(code, db, settings)
+            fragment = urllib.parse.urlencode({"wechat_token": result["token"]})
+        except HTTPException as e:
+            fragment = urllib.parse.urlencode({"wechat_error": str(e.detail)})
+    response = RedirectResponse(f"{req.base_url}#{fragment}", status_code=302)
+    response.delete_cookie(WECHAT_STATE_COOKIE)
+    return response
+
+
+@app.get("/api/admin/semantic-cache")
+async def admin_semantic_cache_stats(
+    user: User = Depends(require_admin),
+    settings: Settings = Depends(get_settings)
+):
+    """Semantic cache metrics / 语义缓存命中率与延迟"""
+    cache = get_semantic_cache(settings)
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+def ensure_profiler():
+    if not profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler disabled, set PROFILER_ENABLED=true / 采样分析未启用")
+
+
+@app.get("/api/admin/profile", response_class=PlainTextResponse)
+async def admin_profile(seconds: float = 0, user: User = Depends(require_admin)):
+    """Sampled stacks in collapsed format (all, or the last N seconds) / 采样调用栈（collapsed 格式，可生成火焰图）"""
+    ensure_profiler()
+    stacks = profiler.window(time.monotonic() - seconds) if seconds > 0 else profiler.snapshot()
+    return PlainTextResponse(collapsed(stacks))
+
+
+@app.get("/api/admin/slow-requests")
+async def admin_slow_requests(user: User = Depends(require_admin), settings: Settings = Depends(get_settings)):
+    """Recent slow requests / 最近的慢请求"""
+    ensure_profiler()
+    return {
+        "profiler": profiler.stats(),
+        "threshold_ms": settings.slow_request_ms,
+        "requests": slow_requests.summaries(),
+    }
+
+
+@app.get("/api/admin/slow-requests/{trace_id}", response_class=PlainTextResponse)
+async def admin_slow_request_stacks(trace_id: int, user: User = Depends(require_admin)):
+    """Stacks sampled while a slow request was running / 慢请求处理期间的采样调用栈"""
+    ensure_profiler()
+    trace = slow_requests.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found / 记录不存在")
+    return PlainTextResponse(collapsed(trace["stacks"]))
+
+
+@app.get("/api/admin/loop-stalls")
+async def admin_loop_stalls(user: User = Depends(require_admin)):
+    """Recent event-loop stalls with blocking stacks / 最近的事件循环卡顿及阻塞调用栈"""
+    return {
+        "stalls": list(reversed(loop_monitor.stalls)),
+        "threadpool_workers": loop_monitor.worker_summary(top=20),
+    }
+
+
+@app.get("/api/admin/prompt-usage")
+async def admin_prompt_usage(user: User = Depends(require_admin), settings: Settings = Depends(get_settings)):
+    """Usage per prompt version since startup / 启动以来各提示词版本的用量"""
+    return {"prompts": settings.prompt_registry.listing(), "usage": prompt_usage.snapshot()}
+
+
 @app.get("/api/auth/me")
 async def get_current_user_info(user: User = Depends(require_auth)):
     """获取当前用户信息"""
@@ -383,210 +737,365 @@ async def get_current_user_info(user: User = Depends(require_auth)):
 
 
 @app.get("/api/usage")
-async def get_usage(req: Request):
+async def get_usage(req: Request, current_user: Optional[User] = Depends(get_current_user)):
     """Get current IP usage / 获取当前IP使用情况"""
     client_ip = get_client_ip(req)
-    return get_ip_usage(client_ip)
+    usage = get_ip_usage(client_ip)
+    # 该用户（未登录按 IP）最近使用的自定义 Key 的校验结果与上游耗时（不含 Key 本身）
+    validator = get_key_validator(get_settings())
+    custom_key = validator.client_report(client_identity(current_user, client_ip)) if validator is not None else None
+    if custom_key is not None:
+        usage["custom_key"] = custom_key
+    return usage
 
 @app.get("/api/models")
-async def get_models():
+async def get_models(req: Request, settings: Settings = Depends(get_settings)):
     """Get supported model list / 获取支持的模型列表"""
+    return settings.models_json.response(req)
+
+@app.get("/api/prompts")
+async def get_prompts(req: Request, settings: Settings = Depends(get_settings)):
+    """Registered system prompts (without content) / 可用的系统提示词列表（不含正文）"""
+    return settings.prompts_json.response(req)
+
+def safety_response(request: ChatRequest, settings: Settings) -> Optional[dict]:
+    """最后一条用户消息命中危机关键词时返回求助信息"""
+    safety = get_safety_filter(settings)
+    last_user = next((m.content for m in reversed(request.messages) if m.role == "user"), "")
+    if safety and safety.check(last_user):
+        logging.warning("Safety filter matched incoming chat message")
+        return {
+            "message": {"role": "assistant", "content": safety.response},
+            "usage": {},
+            "model": "safety-filter",
+            "flagged": True
+        }
+    return None
+
+
+def resolve_chat_target(request: ChatRequest, settings: Settings):
+    """确定端点、API Key 和模型（请求参数优先，其次默认配置）"""
+    endpoint = request.endpoint_url or settings.chat_endpoint
+    api_key = request.api_key or settings.chat_api_key
+    model = request.model or settings.chat_model
+
+    if not endpoint:
+        raise HTTPException(status_code=400, detail="API endpoint URL is required")
+    
+    if not api_key:
+        raise HTTPException(status_code=400, detail="API key is required")
+
+    return endpoint, api_key, model
+
+
+def resolve_prompt(request: ChatRequest, settings: Settings) -> Optional[PromptEntry]:
+    return settings.prompt_registry.resolve(request.prompt_id) if request.prompt_id else None
+
+
+def build_chat_payload(request: ChatRequest, model: str, prompt: Optional[PromptEntry] = None) -> dict:
+    """构建 OpenAI 兼容的请求体"""
+    # 转换消息格式；注册表中的提示词固定放在最前面，保持前缀稳定
+    messages = [prompt.message] if prompt else []
+    messages += [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    
+    # 构建请求参数
+    data = {
+        "model": model,
+        "messages": messages,
+        "temperature": request.temperature,
+    }
+
+    if request.max_tokens:
+        data["max_tokens"] = request.max_tokens
+    return data
+
+
+def chat_response(request: ChatRequest, result: dict) -> dict:
+    """把上游响应整理为前端使用的格式"""
     return {
-        "aliyun": [
-            {"id": "qwen-plus", "name": "Qwen Plus", "name_zh": "通义千问 Plus"},
-            {"id": "qwen-turbo", "name": "Qwen Turbo", "name_zh": "通义千问 Turbo"},
-            {"id": "qwen-max", "name": "Qwen Max", "name_zh": "通义千问 Max"},
-            {"id": "qwen-long", "name": "Qwen Long", "name_zh": "通义千问 Long"}
-        ],
-        "openai": [
-            {"id": "gpt-4", "name": "GPT-4"},
-            {"id": "gpt-4-turbo", "name": "GPT-4 Turbo"},
-            {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"}
-        ]
+        "message": {
+            "role": "assistant",
+            "content": result["choices"][0]["message"]["content"]
+        },
+        "usage": result.get("usage", {}),
+        "model": result.get("model", request.model)
     }
 
-@app.post("/api/chat")
+
+async def chat_completion(
+    request: ChatRequest,
+    client_ip: str,
+    current_user: Optional[User],
+    settings: Settings
+) -> dict:
+    """聊天核心逻辑（HTTP 与 WebSocket 共用）"""
+    # 检查是否需要强制认证
+    ensure_login(current_user, settings)
+
+    # 安全预过滤：危机消息直接返回求助信息，不调用大模型、不计配额
+    flagged = safety_response(request, settings)
+    if flagged:
+        return flagged
+
+    has_custom_key = bool(request.api_key)
+    
+    prompt = resolve_prompt(request, settings)
+
+    # 检查IP限制
+    ensure_quota(client_ip, has_custom_key)
+    
+    endpoint, api_key, model = resolve_chat_target(request, settings)
+    data = build_chat_payload(request, model, prompt)
+
+    # 自定义 Key：已知无效时立即返回，首次使用时探测一次
+    validator = get_key_validator(settings) if has_custom_key else None
+    if validator is not None:
+        await validator.ensure_valid_async(endpoint, api_key, client_identity(current_user, client_ip))
+    
+    logging.info(
+        f"Chat request: model={model} (requested {request.model}), prompt={prompt.key if prompt else '-'}"
+        + (f" ({prompt.token_count} tokens)" if prompt else "")
+    )
+
+    # 语义缓存：只用于使用默认 Key 的首轮提问（没有历史回答、只有一条用户消息），
+    # 按用户（未登录按 IP）隔离；自定义 Key 的请求既不读也不写缓存，避免用无效 Key 取得默认 Key 的回答
+    cache = get_semantic_cache(settings) if not has_custom_key else None
+    user_messages = [m.content for m in request.messages if m.role == "user"]
+    cacheable = cache is not None and len(user_messages) == 1 and not any(
+        m.role == "assistant" for m in request.messages
+    )
+    if cacheable:
+        system_prompt = "\n".join(
+            ([prompt.key] if prompt else []) + [m.content for m in request.messages if m.role == "system"]
+        )
+        namespace = cache_namespace(client_identity(current_user, client_ip), endpoint, model, system_prompt, request.temperature)
+        cached = cache.lookup(namespace, user_messages[0])
+        if cached is not None:
+            # 命中同样计入免费额度
+            increment_ip_usage(client_ip, False)
+            if prompt:
+                prompt_usage.record(prompt.key, None)
+            return {**cached, "usage": {}, "cached": True}
+    
+    # 调用 API（在线程池中执行，不阻塞事件循环）
+    result = await run_in_threadpool(chat_api_request, endpoint, data, api_key, settings, validator)
+    
+    # 增加IP使用计数
+    if not has_custom_key:
+        increment_ip_usage(client_ip, False)
+    
+    response = chat_response(request, result)
+    if prompt:
+        prompt_usage.record(prompt.key, response["usage"])
+    if cacheable:
+        cache.store(namespace, user_messages[0], response)
+    return response
+
+
+@app.post("/api/chat", response_class=FastJSONResponse)
 async def chat(
     request: ChatRequest, 
     req: Request,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
+    current_user: Optional[User] = Depends(get_current_user),
+    settings: Settings = Depends(get_settings)
 ):
     """Chat API / 聊天接口"""
     try:
-        # 检查是否需要强制认证
-        require_auth_enabled = os.getenv("REQUIRE_AUTH", "false").lower() == "true"
-        if require_auth_enabled and not current_user:
-            raise HTTPException(
-                status_code=401,
-                detail="Authentication required. Please login. / 需要登录才能使用。"
-            )
-
-        defaults = get_default_config()
-        # 获取客户端IP
-        client_ip = get_client_ip(req)
-        has_custom_key = bool(request.api_key)
-        
-        # 检查IP限制
-        if not check_ip_limit(client_ip, has_custom_key):
-            usage = get_ip_usage(client_ip)
-            raise HTTPException(
-                status_code=429,
-                detail=f"Daily free quota exceeded ({usage['used']}/{usage['limit']}). Please provide your own API key. / 每日免费配额已用完 ({usage['used']}/{usage['limit']})，请输入自己的 API Key。"
-            )
-        
-        endpoint = request.endpoint_url or defaults["chat_endpoint"]
-        api_key = request.api_key or defaults["chat_api_key"]
-        model = request.model or defaults["chat_model"]
-
-        if not endpoint:
-            raise HTTPException(status_code=400, detail="API endpoint URL is required")
-        
-        if not api_key:
-            raise HTTPException(status_code=400, detail="API key is required")
-        
-        # 转换消息格式
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # 构建请求参数
-        data = {
-            "model": model,
-            "messages": messages,
-            "temperature": request.temperature,
-        }
-        
-        print(f"前端传入model: {request.model}, 实际使用model: {model}")
-
-        if request.max_tokens:
-            data["max_tokens"] = request.max_tokens
-        
-        # 调用 API
-        result = make_api_request(endpoint, data, api_key)
-        
-        # 增加IP使用计数
-        if not has_custom_key:
-            increment_ip_usage(client_ip, False)
-        
-        return {
-            "message": {
-                "role": "assistant",
-                "content": result["choices"][0]["message"]["content"]
-            },
-            "usage": result.get("usage", {}),
-            "model": result.get("model", request.model)
-        }
+        return FastJSONResponse(await chat_completion(request, get_client_ip(req), current_user, settings))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Request failed / 请求失败: {str(e)}")
     
-@app.post("/api/generate-image")
+def batch_chat_worker(user: User, settings: Settings):
+    """批量任务中单条聊天请求的处理函数（在线程池中执行）"""
+    def run(item: dict) -> dict:
+        try:
+            request = ChatRequest.model_validate(item)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid request / 参数错误: {str(e)[:300]}")
+
+        flagged = safety_response(request, settings)
+        if flagged:
+            return flagged
+
+        # 使用默认 Key 的批量条目仅限管理员，避免耗尽共享配额
+        if not request.api_key and not is_admin_user(user, settings):
+            raise HTTPException(status_code=403, detail="api_key is required for batch items / 批量请求需要提供 api_key")
+
+        prompt = resolve_prompt(request, settings)
+        endpoint, api_key, model = resolve_chat_target(request, settings)
+        validator = get_key_validator(settings) if request.api_key else None
+        if validator is not None:
+            validator.ensure_valid(endpoint, api_key, client_identity(user, ""))
+        result = chat_api_request(endpoint, build_chat_payload(request, model, prompt), api_key, settings, validator)
+        response = chat_response(request, result)
+        if prompt:
+            prompt_usage.record(prompt.key, response["usage"])
+        return response
+    return run
+
+
+def batch_stream(lines):
+    """排空期限到达时以一行 error 结束结果流（任务保存在内存中，重启后不可续传）"""
+    return graceful_shutdown.guard(
+        lines, terminal=(ndjson_line({"error": RESTART_MESSAGE, "retry": False}),)
+    )
+
+
+@app.post("/api/chat/batch")
+async def chat_batch(
+    req: Request,
+    user: User = Depends(require_auth),
+    settings: Settings = Depends(get_settings)
+):
+    """Batch chat: JSONL in, NDJSON out in completion order / 批量聊天：JSONL 输入，按完成顺序输出 NDJSON"""
+    body = await read_request_body(req, settings.batch_max_body_mb * 1024 * 1024)
+    items = parse_jsonl(body, settings.batch_max_items)
+    if not items:
+        raise HTTPException(status_code=400, detail="Empty batch / 批量请求为空")
+
+    job = batch_jobs.create(user.id, items, settings.batch_max_jobs_per_user)
+    job.start(batch_chat_worker(user, settings), settings.batch_concurrency)
+    return StreamingResponse(batch_stream(job.follow()), media_type="application/x-ndjson")
+
+
+@app.get("/api/chat/batch/{job_id}")
+async def chat_batch_resume(job_id: str, offset: int = 0, user: User = Depends(require_auth)):
+    """Resume a batch result stream from offset / 从指定偏移量继续获取批量结果"""
+    job = batch_jobs.get(job_id, user.id)
+    return StreamingResponse(batch_stream(job.follow(max(0, offset))), media_type="application/x-ndjson")
+
+
+@app.get("/api/chat/batch/{job_id}/status")
+async def chat_batch_status(job_id: str, user: User = Depends(require_auth)):
+    """Batch job progress / 批量任务进度"""
+    return batch_jobs.get(job_id, user.id).progress()
+
+
+async def prepare_image(
+    request: ImageRequest,
+    client_ip: str,
+    current_user: Optional[User],
+    settings: Settings
+) -> ImageClient:
+    """校验权限和配额，构建图片生成客户端（HTTP 与 WebSocket 共用）"""
+    # 检查是否需要强制认证
+    ensure_login(current_user, settings)
+    
+    # 每张图片都是一次上游调用：张数受 IMAGE_MAX_N 限制，免费额度需足够请求的张数（生成后按成功张数扣除）
+    if request.n > settings.image_max_n:
+        raise HTTPException(
+            status_code=400,
+            detail=f"n must be at most {settings.image_max_n} / 单次最多生成 {settings.image_max_n} 张图片"
+        )
+    ensure_quota(client_ip, bool(request.api_key), request.n)
+
+    endpoint = request.endpoint_url or settings.image_endpoint
+    api_key = request.api_key or settings.image_api_key
+    model = request.model or settings.image_model
+    size = request.size or settings.image_size
+    
+    if not endpoint:
+        raise HTTPException(status_code=400, detail="API endpoint URL is required")
+    
+    if not api_key:
+        raise HTTPException(status_code=400, detail="API key is required")
+
+    # 自定义 Key：已知无效时立即返回
+    validator = get_key_validator(settings) if request.api_key else None
+    if validator is not None:
+        await validator.ensure_valid_async(endpoint, api_key, client_identity(current_user, client_ip))
+    
+    logging.debug(f"调用图片生成API: {endpoint}, n={request.n}")
+
+    store = get_image_store()
+
+    return ImageClient(
+        endpoint, api_key, model, size,
+        max_n_per_request=settings.image_max_n_per_request,
+        max_concurrency=settings.image_max_concurrency,
+        timeout=settings.image_task_timeout,
+        max_response_bytes=settings.upstream_max_response_mb * 1024 * 1024,
+        max_image_bytes=settings.upstream_max_image_mb * 1024 * 1024,
+        # base64 图片直接解码到图片存储目录，之后原子改名移入
+        spill_dir=str(store.blob_dir) if store else None
+    )
+
+
+def uses_default_image_endpoint(request: ImageRequest, settings: Settings) -> bool:
+    """只有配置的图片端点返回的地址才由服务端下载；自定义端点可以返回任意地址"""
+    return not request.endpoint_url or request.endpoint_url == settings.image_endpoint
+
+
+async def image_events(client: ImageClient, prompt: str, n: int, validator: Optional[KeyValidator] = None,
+                       fetch_remote: bool = True, charge_ip: Optional[str] = None):
+    """逐张产出本地化后的图片；出错时产出 error 项（自定义 Key 被上游拒绝时更新其校验状态）
+
+    charge_ip 不为空时，流结束（包括客户端中断）后按实际发出的图片张数计入该 IP 的免费额度
+    """
+    delivered = 0
+    try:
+        async for item in client.iter_images(prompt, n):
+            if "error" in item and validator is not None:
+                validator.observe_rejection(client.endpoint, client.api_key, item["status"])
+            item = localize_image(item, fetch_remote)
+            yield item
+            if "error" not in item:
+                delivered += 1
+    except Exception as e:
+        logging.error(f"Image streaming error: {e}")
+        yield {"error": str(e)}
+    finally:
+        if charge_ip is not None and delivered:
+            increment_ip_usage(charge_ip, False, delivered)
+
+
+@app.post("/api/generate-image", response_class=FastJSONResponse)
 async def generate_image(
     request: ImageRequest, 
     req: Request,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
+    current_user: Optional[User] = Depends(get_current_user),
+    settings: Settings = Depends(get_settings)
 ):
     """Image generation API / 生成图片接口"""
     try:
-        # 检查是否需要强制认证
-        require_auth_enabled = os.getenv("REQUIRE_AUTH", "false").lower() == "true"
-        if require_auth_enabled and not current_user:
-            raise HTTPException(
-                status_code=401,
-                detail="Authentication required. Please login. / 需要登录才能使用。"
-            )
-        defaults = get_default_config()
-        
-        # 获取客户端IP
         client_ip = get_client_ip(req)
         has_custom_key = bool(request.api_key)
-        
-        # 检查IP限制
-        if not check_ip_limit(client_ip, has_custom_key):
-            usage = get_ip_usage(client_ip)
-            raise HTTPException(
-                status_code=429,
-                detail=f"Daily free quota exceeded ({usage['used']}/{usage['limit']}). Please provide your own API key. / 每日免费配额已用完 ({usage['used']}/{usage['limit']})，请输入自己的 API Key。"
-            )
+        client = await prepare_image(request, client_ip, current_user, settings)
+        validator = get_key_validator(settings) if has_custom_key else None
+        fetch_remote = uses_default_image_endpoint(request, settings)
 
-        endpoint = request.endpoint_url or defaults["image_endpoint"]
-        api_key = request.api_key or defaults["image_api_key"]
-        model = request.model or defaults["image_model"]
-        size = request.size or defaults["image_size"]
-        
-        if not endpoint:
-            raise HTTPException(status_code=400, detail="API endpoint URL is required")
-        
-        if not api_key:
-            raise HTTPException(status_code=400, detail="API key is required")
-        
-        print(f"调用阿里云图片生成API: {endpoint}")
-        
-        if "ali" in endpoint or "multimodal-generation" in endpoint:
-            data = {
-                "model": model,
-                "input": {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "text": request.prompt
-                                }
-                            ]
-                        }
-                    ]
-                },
-                "parameters": {
-                    "size": size,
-                    "n": request.n
-                }
-            }
-        else:
-            # 默认OpenAI格式
-            data = {
-                "model": model,
-                "prompt": request.prompt,
-                "size": size,
-                "n": request.n
-            }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        print(f"请求体: {data}")
-        
-        resp = requests.post(endpoint, headers=headers, json=data, timeout=60)
-        
-        print(f"响应状态: {resp.status_code}")
-        print(f"响应内容: {resp.text}")
-        
-        if resp.status_code >= 400:
-            raise HTTPException(
-                status_code=resp.status_code,
-                detail=f"API请求失败: {resp.text}"
-            )
-        
-        result = resp.json()
-        
-        # 增加IP使用计数
-        if not has_custom_key:
-            increment_ip_usage(client_ip, False)
-        
-        # 解析阿里云格式响应
-        images = []
-        if "output" in result and "choices" in result["output"]:
-            for choice in result["output"]["choices"]:
-                if "message" in choice and "content" in choice["message"]:
-                    for content_item in choice["message"]["content"]:
-                        if "image" in content_item:
-                            images.append({"url": content_item["image"]})
-
-        print(f"find image: {images}")
-        return {"images": images}
+        # 免费额度按成功生成的张数计（prepare_image 已按请求张数检查余量）
+        charge_ip = None if has_custom_key else client_ip
+
+        if request.stream:
+            # 每张图片完成后立即以 SSE 推送给前端
+            async def generate():
+                async for item in image_events(client, request.prompt, request.n, validator, fetch_remote, charge_ip):
+                    yield sse_frame(item)
+                yield SSE_DONE
+
+            return StreamingResponse(graceful_shutdown.guard(generate()), media_type="text/event-stream")
+
+        try:
+            generated = await client.generate(request.prompt, request.n)
+        except HTTPException as e:
+            if validator is not None:
+                validator.observe_rejection(client.endpoint, client.api_key, e.status_code)
+            raise
+        localized = [localize_image(image, fetch_remote) for image in generated]
+        images = [image for image in localized if "error" not in image]
+        if localized and not images:
+            raise HTTPException(status_code=502, detail=localized[0]["error"])
+
+        # 增加IP使用计数（按成功生成的张数）
+        if charge_ip is not None and images:
+            increment_ip_usage(charge_ip, False, len(images))
+
+        return FastJSONResponse({"images": images})
         
     except HTTPException:
         raise
@@ -594,128 +1103,310 @@ async def generate_image(
         raise HTTPException(status_code=500, detail=f"图片生成失败: {str(e)}")
 
 
+@app.get("/api/images/{key}")
+async def get_image(key: str, req: Request):
+    """Serve a locally cached generated image / 返回本地缓存的生成图片"""
+    store = get_image_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Image store disabled / 图片存储未启用")
+    return await serve_image(store, key, req)
+
+
+@app.get("/api/images/{key}/thumb")
+async def get_image_thumbnail(key: str, req: Request):
+    """Serve a generated image thumbnail / 返回生成图片的缩略图"""
+    store = get_image_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Image store disabled / 图片存储未启用")
+    return await serve_image(store, key, req, thumbnail=True)
+
+
+def agent_crisis_event(request: AgentRequest, settings: Settings) -> Optional[dict]:
+    """智能体输入命中危机关键词时返回求助信息事件"""
+    safety = get_safety_filter(settings)
+    prompt = request.input.get("prompt")
+    if safety and isinstance(prompt, str) and safety.check(prompt):
+        logging.warning("Safety filter matched incoming agent prompt")
+        return {"text": safety.response, "flagged": True}
+    return None
+
+
+async def open_agent_stream(
+    request: AgentRequest,
+    client_ip: str,
+    current_user: Optional[User],
+    settings: Settings
+):
+    """校验配额并连接上游智能体，返回 (上游响应, 事件生成器)（HTTP 与 WebSocket 共用）"""
+    has_custom_key = bool(request.api_key)
+
+    # IP limit check
+    ensure_quota(client_ip, has_custom_key)
+
+    # Use provided api_key or default agent key from env
+    api_key = request.api_key or settings.agent_api_key
+    app_id = settings.agent_app_id
+
+    if not api_key:
+        raise HTTPException(status_code=400, detail="Agent API key is required")
+    if not app_id:
+        raise HTTPException(status_code=400, detail="AGENT_APP_ID is not configured")
+
+    endpoint = f"https://dashscope.aliyuncs.com/api/v1/apps/{app_id}/completion"
+
+    # 自定义 Key：上游曾返回 401 时立即拒绝（应用接口没有模型列表可探测，只按实际响应判断）
+    validator = get_key_validator(settings) if has_custom_key else None
+    if validator is not None:
+        await validator.ensure_valid_async(endpoint, api_key, client_identity(current_user, client_ip))
+
+    # Enable incremental streaming output
+    params = request.parameters or {}
+    params["incremental_output"] = True
+
+    # 复用上游会话：只发送本轮 prompt，历史上下文由 DashScope 按 session_id 维护
+    input_data = dict(request.input)
+    conversation_id = request.conversation_id
+    if conversation_id and not input_data.get("session_id"):
+        session_id = await run_in_threadpool(
+            get_session_id, current_user, client_ip, conversation_id, settings.agent_session_ttl_minutes
+        )
+        if session_id:
+            input_data["session_id"] = session_id
+    user_id = current_user.id if current_user else None
+    
+    data = {
+        "input": input_data,
+        "parameters": params,
+        "debug": {}
+    }
+
+    # Call the upstream agent endpoint with streaming
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+        "X-DashScope-SSE": "enable"  # Enable SSE streaming
+    }
+
+    import requests  # 延迟导入，加快冷启动
+
+    started = time.monotonic()
+    resp = await run_in_threadpool(
+        lambda: requests.post(endpoint, headers=headers, json=data, timeout=120, stream=True)
+    )
+    if validator is not None:
+        # 耗时按收到响应头计算（首个事件之前的等待）
+        validator.observe(endpoint, api_key, time.monotonic() - started, resp.status_code)
+    if resp.status_code >= 400:
+        # 只读取错误响应的开头并关闭连接
+        raise HTTPException(status_code=resp.status_code, detail=f"Agent API请求失败: {error_message(resp)[:200]}")
+
+    # increase usage (only once at start)
+    if not has_custom_key:
+        increment_ip_usage(client_ip, False)
+
+    safety = get_safety_filter(settings)
+
+    def remember_session(session_id: str):
+        """上游会话 ID 一出现就保存，流被中断（包括停机）也不会丢失"""
+        try:
+            save_session_id(user_id, client_ip, conversation_id, session_id, settings.agent_session_ttl_minutes)
+        except Exception as e:
+            logging.error(f"Failed to save agent session: {e}")
+
+    # Stream the response
+    def generate():
+        buffer = ""
+        upstream_session_id = None
+        # 对输出同样做安全扫描（状态跨分块保留）；回答照常完整发出，匹配时记录日志并在回答之后附上求助信息
+        output_scanner = safety.scanner() if safety else None
+        output_flagged = False
+        try:
+            # Use iter_content to avoid buffering
+            for chunk in resp.iter_content(chunk_size=None, decode_unicode=False):
+                if chunk:
+                    buffer += chunk.decode('utf-8')
+                    # Process complete lines
+                    while '\n' in buffer:
+                        line, buffer = buffer.split('\n', 1)
+                        line = line.strip()
+                        
+                        if line.startswith('data:'):
+                            data_str = line[5:].strip()
+                            if data_str and data_str != '[DONE]':
+                                try:
+                                    chunk_data = loads(data_str)
+                                    # Extract text from the chunk
+                                    text = None
+                                    if isinstance(chunk_data, dict):
+                                        output = chunk_data.get("output", {})
+                                        if isinstance(output, dict):
+                                            session_id = output.get("session_id")
+                                            if session_id and session_id != upstream_session_id:
+                                                upstream_session_id = session_id
+                                                if conversation_id:
+                                                    remember_session(session_id)
+                                            # Try to get text from output.text
+                                            if "text" in output:
+                                                text = output["text"]
+                                            # Or from output.choices
+                                            elif "choices" in output:
+                                                choices = output["choices"]
+                                                if isinstance(choices, list) and len(choices) > 0:
+                                                    message = choices[0].get("message", {})
+                                                    content = message.get("content")
+                                                    if isinstance(content, str):
+                                                        text = content
+                                                    elif isinstance(content, list):
+                                                        for item in content:
+                                                            if isinstance(item, dict) and "text" in item:
+                                                                text = item["text"]
+                                                                break
+                                    
+                                    if text and output_scanner:
+                                        # 末尾可能是关键词开头的几个字符留到下一块再发送
+                                        text, matched = output_scanner.push(text)
+                                        if matched and not output_flagged:
+                                            output_flagged = True
+                                            logging.warning("Safety filter matched agent output")
+                                    if text:
+                                        # Send immediately
+                                        yield {'text': text}
+                                except json.JSONDecodeError as e:
+                                    logging.debug(f"JSON decode error: {e}")
+            if output_scanner and output_scanner.pending:
+                yield {'text': output_scanner.flush()}
+            if output_flagged:
+                yield {'text': "\n\n" + safety.response, 'flagged': True}
+        except Exception as e:
+            logging.error(f"Streaming error: {e}")
+            if output_scanner and output_scanner.pending:
+                yield {'text': output_scanner.flush()}
+            if output_flagged:
+                yield {'text': "\n\n" + safety.response, 'flagged': True}
+            yield {'error': str(e)}
+
+    return resp, generate()
+
+
 @app.post("/api/agent-completion")
 async def agent_completion(
     request: AgentRequest, 
     req: Request,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)
+    current_user: Optional[User] = Depends(get_current_user),
+    settings: Settings = Depends(get_settings)
 ):
     """Proxy endpoint for DashScope agent completion with streaming support"""
     try:
         # 检查是否需要强制认证
-        require_auth_enabled = os.getenv("REQUIRE_AUTH", "false").lower() == "true"
-        if require_auth_enabled and not current_user:
-            raise HTTPException(
-                status_code=401,
-                detail="Authentication required. Please login. / 需要登录才能使用。"
-            )
-        defaults = get_default_config()
-
-        client_ip = get_client_ip(req)
-        has_custom_key = bool(request.api_key)
-
-        # IP limit check
-        if not check_ip_limit(client_ip, has_custom_key):
-            usage = get_ip_usage(client_ip)
-            raise HTTPException(
-                status_code=429,
-                detail=f"Daily free quota exceeded ({usage['used']}/{usage['limit']}). Please provide your own API key. / 每日免费配额已用完 ({usage['used']}/{usage['limit']})，请输入自己的 API Key。"
-            )
-
-        # Use provided api_key or default agent key from env
-        api_key = request.api_key or os.getenv("DEFAULT_AGENT_API_KEY", "")
-        app_id = os.getenv("AGENT_APP_ID", "")
-
-        if not api_key:
-            raise HTTPException(status_code=400, detail="Agent API key is required")
-        if not app_id:
-            raise HTTPException(status_code=400, detail="AGENT_APP_ID is not configured")
-
-        endpoint = f"https://dashscope.aliyuncs.com/api/v1/apps/{app_id}/completion"
-
-        # Enable incremental streaming output
-        params = request.parameters or {}
-        params["incremental_output"] = True
-        
-        data = {
-            "input": request.input,
-            "parameters": params,
-            "debug": {}
-        }
+        ensure_login(current_user, settings)
 
-        # Call the upstream agent endpoint with streaming
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-            "X-DashScope-SSE": "enable"  # Enable SSE streaming
-        }
+        # 安全预过滤：危机消息直接以 SSE 返回求助信息，不调用智能体
+        crisis = agent_crisis_event(request, settings)
+        if crisis:
+            def crisis_stream():
+                yield sse_frame(crisis)
+                yield SSE_DONE
 
-        resp = requests.post(endpoint, headers=headers, json=data, timeout=120, stream=True)
-        if resp.status_code >= 400:
-            raise HTTPException(status_code=resp.status_code, detail=f"Agent API请求失败: {resp.text}")
+            return StreamingResponse(crisis_stream(), media_type="text/event-stream")
 
-        # increase usage (only once at start)
-        if not has_custom_key:
-            increment_ip_usage(client_ip, False)
+        resp, events = await open_agent_stream(request, get_client_ip(req), current_user, settings)
+        # 可选：合并逐 token 的小分块，减少写次数和前端渲染次数
+        events = coalesce_text(
+            iterate_in_threadpool(events), settings.agent_coalesce_ms, settings.coalesce_max_chars
+        )
 
-        # Stream the response
-        def generate():
-            buffer = ""
+        async def generate():
             try:
-                # Use iter_content to avoid buffering
-                for chunk in resp.iter_content(chunk_size=None, decode_unicode=False):
-                    if chunk:
-                        buffer += chunk.decode('utf-8')
-                        # Process complete lines
-                        while '\n' in buffer:
-                            line, buffer = buffer.split('\n', 1)
-                            line = line.strip()
-                            
-                            if line.startswith('data:'):
-                                data_str = line[5:].strip()
-                                if data_str and data_str != '[DONE]':
-                                    try:
-                                        chunk_data = json.loads(data_str)
-                                        # Extract text from the chunk
-                                        text = None
-                                        if isinstance(chunk_data, dict):
-                                            output = chunk_data.get("output", {})
-                                            if isinstance(output, dict):
-                                                # Try to get text from output.text
-                                                if "text" in output:
-                                                    text = output["text"]
-                                                # Or from output.choices
-                                                elif "choices" in output:
-                                                    choices = output["choices"]
-                                                    if isinstance(choices, list) and len(choices) > 0:
-                                                        message = choices[0].get("message", {})
-                                                        content = message.get("content")
-                                                        if isinstance(content, str):
-                                                            text = content
-                                                        elif isinstance(content, list):
-                                                            for item in content:
-                                                                if isinstance(item, dict) and "text" in item:
-                                                                    text = item["text"]
-                                                                    break
-                                        
-                                        if text:
-                                            # Send as SSE format immediately
-                                            yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
-                                    except json.JSONDecodeError as e:
-                                        logging.debug(f"JSON decode error: {e}")
-            except Exception as e:
-                logging.error(f"Streaming error: {e}")
-                yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+                async for event in events:
+                    yield sse_frame(event)
+                yield SSE_DONE
             finally:
-                yield "data: [DONE]\n\n"
+                resp.close()
 
-        return StreamingResponse(generate(), media_type="text/event-stream")
+        # 排空期限到达时先关闭上游连接，再以终止事件结束
+        return StreamingResponse(
+            graceful_shutdown.guard(generate(), on_abort=resp.close), media_type="text/event-stream"
+        )
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent 请求失败: {str(e)}")
+
+
+def load_user(token: str) -> Optional[User]:
+    """WebSocket 握手时按 JWT 加载用户（在线程池中执行）"""
+    with contextmanager(get_db)() as db:
+        return user_from_token(db, token)
+
+
+def ws_handlers(user: Optional[User], client_ip: str):
+    """WebSocket 上各类流的处理函数，与对应 HTTP 接口共用实现；每个流开始时读取当前配置"""
+    async def chat_stream(payload: dict):
+        request = ChatRequest.model_validate(payload)
+        yield await chat_completion(request, client_ip, user, get_settings())
+
+    async def agent_stream(payload: dict):
+        settings = get_settings()
+        request = AgentRequest.model_validate(payload)
+        ensure_login(user, settings)
+        crisis = agent_crisis_event(request, settings)
+        if crisis:
+            yield crisis
+            return
+        resp, events = await open_agent_stream(request, client_ip, user, settings)
+        try:
+            async for event in coalesce_text(
+                iterate_in_threadpool(events), settings.ws_coalesce_ms, settings.coalesce_max_chars
+            ):
+                yield event
+        finally:
+            # 取消时关闭上游连接，线程中阻塞的读取随之结束
+            resp.close()
+
+    async def image_stream(payload: dict):
+        settings = get_settings()
+        request = ImageRequest.model_validate(payload)
+        client = await prepare_image(request, client_ip, user, settings)
+        validator = get_key_validator(settings) if request.api_key else None
+        fetch_remote = uses_default_image_endpoint(request, settings)
+        charge_ip = None if request.api_key else client_ip
+        async for item in image_events(client, request.prompt, request.n, validator, fetch_remote, charge_ip):
+            yield item
+
+    return {"chat": chat_stream, "agent": agent_stream, "image": image_stream}
+
+
+@app.websocket("/api/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """WebSocket transport: authenticate once, multiplex chat/agent/image streams / 单连接认证一次，复用多个流"""
+    await websocket.accept()
+    token = await receive_auth(websocket)
+    if token is None:
+        return
+
+    settings = get_settings()
+    user = await run_in_threadpool(load_user, token) if token else None
+    if (token and user is None) or (settings.require_auth and user is None):
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+
+    mux = StreamMux(
+        websocket, ws_handlers(user, get_client_ip(websocket)),
+        max_streams=settings.ws_max_streams, window=settings.ws_stream_window
+    )
+    await mux.send({
+        "type": "ready",
+        "user": {"id": user.id, "username": user.username} if user else None,
+        "window": settings.ws_stream_window
+    })
+    # 登记到停机控制器：排空时等待其中的流，到期后以 1012 关闭
+    graceful_shutdown.connections.add(mux)
+    try:
+        await mux.run()
+    finally:
+        graceful_shutdown.connections.discard(mux)
     
 
 if __name__ == "__main__":
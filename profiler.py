@@ -0,0 +1,213 @@
+"""
+采样分析模块 - 后台线程定时采集事件循环线程和线程池工作线程的调用栈，聚合为 collapsed-stack 格式（可直接生成火焰图）；
+慢请求自动保留其处理期间的采样
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Starlette 的 run_in_threadpool / iterate_in_threadpool 由 anyio 工作线程执行
+WORKER_THREAD_NAME = "AnyIO worker thread"
+# 工作线程空闲时停在这些模块里（等待任务队列）
+IDLE_MODULES = ("threading.py", "queue.py")
+# 流式响应按首字节时间判断是否为慢请求
+STREAMING_TYPES = (b"text/event-stream", b"application/x-ndjson")
+# 聚合的不同调用栈数量上限，超过后计入 "(truncated)"
+MAX_STACKS = 20000
+
+
+class SamplingProfiler:
+    """定时采样调用栈；aggregate 为启动以来的累计结果，recent 保留最近 window 秒的逐条采样"""
+
+    def __init__(self, interval: float = 0.01, window: float = 60.0, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.aggregate: Counter = Counter()
+        # (monotonic 时间, 调用栈)
+        self.recent: Deque[Tuple[float, str]] = deque(maxlen=max(1000, int(window / interval) * 8))
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._labels: Dict[object, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """在事件循环线程中调用（记录该线程作为 event-loop）"""
+        if self._thread is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame, kind: str) -> Optional[str]:
+        """根在前、以分号分隔的调用栈；空闲的工作线程返回 None"""
+        codes = []
+        while frame is not None and len(codes) < self.max_depth:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        if kind == "threadpool":
+            busy = [code for code in codes if not code.co_filename.endswith(IDLE_MODULES)]
+            if not busy or "anyio" in busy[0].co_filename:
+                return None
+        codes.reverse()
+        return kind + ";" + ";".join(self._label(code) for code in codes)
+
+    def sample(self):
+        started = time.perf_counter()
+        workers = {thread.ident for thread in threading.enumerate() if thread.name == WORKER_THREAD_NAME}
+        now = time.monotonic()
+        stacks: List[str] = []
+        for ident, frame in sys._current_frames().items():
+            if ident == self._loop_thread:
+                stack = self._stack(frame, "event-loop")
+            elif ident in workers:
+                stack = self._stack(frame, "threadpool")
+            else:
+                continue
+            if stack is not None:
+                stacks.append(stack)
+        with self._lock:
+            for stack in stacks:
+                if stack in self.aggregate or len(self.aggregate) < MAX_STACKS:
+                    self.aggregate[stack] += 1
+                else:
+                    self.aggregate["(truncated)"] += 1
+                self.recent.append((now, stack))
+            self.samples += 1
+            self.sampling_seconds += time.perf_counter() - started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                pass  # 采样失败不影响服务
+
+    def window(self, start: float, end: Optional[float] = None) -> Counter:
+        """[start, end] 时间段内（monotonic）的采样聚合"""
+        end = end if end is not None else time.monotonic()
+        result: Counter = Counter()
+        with self._lock:
+            for at, stack in reversed(self.recent):
+                if at < start:
+                    break
+                if at <= end:
+                    result[stack] += 1
+        return result
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": len(self.aggregate),
+            # 采样线程自身耗时占比（持有 GIL 的时间，即对服务的额外开销上限）
+            "overhead": round(self.sampling_seconds / elapsed, 5) if elapsed else 0.0,
+        }
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.aggregate)
+
+
+def collapsed(stacks: Counter) -> str:
+    """collapsed-stack 文本（flamegraph.pl / speedscope 可直接读取）"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class SlowRequestLog:
+    """最近的慢请求及其处理期间的采样（阈值和保留条数可在配置重载时修改）"""
+
+    def __init__(self, keep: int = 50, threshold: float = 1.0):
+        self.threshold = threshold
+        self.traces: Deque[dict] = deque(maxlen=keep)
+        self._ids = itertools.count(1)
+
+    def add(self, trace: dict) -> dict:
+        trace["id"] = next(self._ids)
+        self.traces.append(trace)
+        return trace
+
+    def summaries(self) -> List[dict]:
+        return [{k: v for k, v in trace.items() if k != "stacks"} for trace in reversed(self.traces)]
+
+    def get(self, trace_id: int) -> Optional[dict]:
+        return next((trace for trace in self.traces if trace["id"] == trace_id), None)
+
+    def resize(self, keep: int):
+        if keep != self.traces.maxlen:
+            self.traces = deque(self.traces, maxlen=keep)
+
+
+class SlowRequestMiddleware:
+    """profiler 运行时记录超过阈值的请求（流式响应按首字节时间计算）"""
+
+    def __init__(self, app: ASGIApp, profiler: SamplingProfiler, log: SlowRequestLog):
+        self.app = app
+        self.profiler = profiler
+        self.log = log
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.profiler.running:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        state = {"status": None, "streaming": False, "first_byte": None}
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                content_type = dict(message.get("headers") or []).get(b"content-type", b"")
+                state["streaming"] = content_type.startswith(STREAMING_TYPES)
+            elif message["type"] == "http.response.body" and state["first_byte"] is None:
+                state["first_byte"] = time.monotonic()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = state["first_byte"] if state["streaming"] and state["first_byte"] else time.monotonic()
+            duration = end - started
+            if duration >= self.log.threshold:
+                stacks = self.profiler.window(started, end)
+                self.log.add({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": state["status"],
+                    "duration_ms": round(duration * 1000, 1),
+                    "streaming": state["streaming"],
+                    "at": time.time() - (time.monotonic() - started),
+                    "samples": sum(stacks.values()),
+                    "stacks": stacks,
+                })
@@ -0,0 +1,149 @@
+"""
+提示词注册表 - 服务端维护带版本的系统提示词 / 角色设定，请求通过 prompt_id 引用；
+每项加载时预先计算 token 数和发送给上游的系统消息，保证提示词前缀稳定以命中上游的前缀缓存
+"""
+import hashlib
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+# 默认提示词（可通过 PROMPTS_FILE 指定 JSON 文件覆盖）
+DEFAULT_PROMPTS = [
+    {
+        "id": "default",
+        "version": 1,
+        "name": "General assistant",
+        "name_zh": "通用助手",
+        "content": "You are a helpful, friendly assistant. Answer in the language the user writes in.",
+    },
+    {
+        "id": "therapist",
+        "version": 1,
+        "name": "Psychologist",
+        "name_zh": "心理医生",
+        "content": (
+            "你是一名温和、专业的心理咨询助手。认真倾听用户的感受，先共情再给建议；"
+            "提供情绪调节和放松练习方法，帮助用户梳理问题并给出可行的下一步。"
+            "不做医学诊断，不替代专业治疗。用户流露自伤、自杀或危机倾向时，"
+            "建议其立刻联系当地紧急服务、心理援助热线或信任的人。使用用户所用的语言回答。"
+        ),
+    },
+]
+
+# 上游自动前缀缓存的最小长度（OpenAI、DashScope 均为 1024 tokens），短于此的提示词不会被缓存
+PREFIX_CACHE_MIN_TOKENS = 1024
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算 token 数：中日韩字符按每字 1 个，其余按每 4 个字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class PromptEntry(BaseModel):
+    """注册表中的一项系统提示词"""
+    model_config = ConfigDict(frozen=True)
+
+    id: str = Field(pattern=r"^[A-Za-z0-9_.-]+$")
+    version: int = Field(1, ge=1)
+    name: str
+    name_zh: Optional[str] = None
+    content: str
+    # 显式缓存标记（DashScope / Anthropic 兼容接口的 cache_control），需要上游支持时才开启
+    cache_control: bool = False
+
+    _token_count: int = PrivateAttr()
+    _message: dict = PrivateAttr()
+
+    def model_post_init(self, __context):
+        self._token_count = estimate_tokens(self.content)
+        if self.cache_control:
+            content = [{"type": "text", "text": self.content, "cache_control": {"type": "ephemeral"}}]
+        else:
+            content = self.content
+        self._message = {"role": "system", "content": content}
+
+    @property
+    def key(self) -> str:
+        """日志和用量统计中使用的 "id@version" """
+        return f"{self.id}@{self.version}"
+
+    @property
+    def token_count(self) -> int:
+        return self._token_count
+
+    @property
+    def message(self) -> dict:
+        """发送给上游的系统消息（每个请求复用同一对象，只读）"""
+        return self._message
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "version": self.version,
+            "name": self.name,
+            "name_zh": self.name_zh,
+            "tokens": self.token_count,
+            "prefix_cacheable": self.cache_control or self.token_count >= PREFIX_CACHE_MIN_TOKENS,
+            "sha256": hashlib.sha256(self.content.encode("utf-8")).hexdigest()[:12],
+        }
+
+
+class PromptRegistry:
+    """按 "id"（最新版本）或 "id@version"（固定版本）查找提示词"""
+
+    def __init__(self, entries: List[PromptEntry]):
+        self._entries: Dict[str, PromptEntry] = {}
+        self._latest: Dict[str, PromptEntry] = {}
+        for entry in entries:
+            if entry.key in self._entries:
+                raise ValueError(f"Duplicate prompt {entry.key}")
+            self._entries[entry.key] = entry
+            if entry.id not in self._latest or entry.version > self._latest[entry.id].version:
+                self._latest[entry.id] = entry
+
+    def get(self, prompt_id: str) -> Optional[PromptEntry]:
+        return self._entries.get(prompt_id) or self._latest.get(prompt_id)
+
+    def resolve(self, prompt_id: str) -> PromptEntry:
+        entry = self.get(prompt_id)
+        if entry is None:
+            raise HTTPException(status_code=400, detail=f"Unknown prompt_id / 未知的提示词: {prompt_id}")
+        return entry
+
+    def listing(self) -> List[dict]:
+        return [entry.summary() for entry in sorted(self._entries.values(), key=lambda e: (e.id, e.version))]
+
+
+class PromptUsage:
+    """按提示词版本累计请求数和上游返回的 token 用量（配置重载后保留）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        )
+
+    def record(self, key: str, usage: Optional[dict]):
+        usage = usage or {}
+        details = usage.get("prompt_tokens_details") or {}
+        with self._lock:
+            stats = self._stats[key]
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+            # 上游前缀缓存命中的 token 数（OpenAI / DashScope 兼容接口返回）
+            stats["cached_tokens"] += details.get("cached_tokens") or 0
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+
+prompt_usage = PromptUsage()
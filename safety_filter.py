@@ -0,0 +1,158 @@
+"""
+安全预过滤模块 - 用 Aho-Corasick 自动机在线性时间内匹配危机/自伤关键词（中英文）
+"""
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# 默认关键词（可通过 SAFETY_PHRASES_FILE 指定文件覆盖，每行一个，# 开头为注释）
+DEFAULT_PHRASES = [
+    # 中文
+    "自杀", "想死", "不想活", "活不下去", "结束生命", "结束自己的生命", "了结自己",
+    "轻生", "寻死", "割腕", "跳楼", "跳河", "上吊", "服毒", "吃安眠药", "安眠药自杀",
+    "自残", "自伤", "伤害自己", "不如死了", "死了算了", "活着没意思", "活着没有意义",
+    "遗书", "告别信", "想消失", "离开这个世界",
+    # English
+    "suicide", "suicidal", "kill myself", "killing myself", "end my life", "ending my life",
+    "take my own life", "want to die", "wanna die", "better off dead", "no reason to live",
+    "don't want to live", "dont want to live", "self harm", "self-harm", "hurt myself",
+    "cut myself", "cutting myself", "overdose", "jump off a bridge", "hang myself",
+    "suicide note", "goodbye letter",
+]
+
+DEFAULT_RESPONSE = (
+    "我注意到你可能正在经历非常痛苦的时刻。你的安全最重要，请立即联系身边信任的人，"
+    "或拨打心理援助热线：全国心理援助热线 400-161-9995，北京心理危机干预中心 010-82951332，"
+    "紧急情况请拨打 110 / 120。你并不孤单，愿意的话也可以继续和我聊聊你现在的感受。\n\n"
+    "It sounds like you may be going through something very painful. Your safety matters most. "
+    "Please reach out to someone you trust right now, or contact a crisis line "
+    "(for example, call or text 988 in the US, or your local emergency number). "
+    "You are not alone, and I'm here to keep listening if you'd like to talk."
+)
+
+
+class AhoCorasick:
+    """多模式匹配自动机：构建 O(总模式长度)，匹配 O(文本长度 + 匹配数)"""
+
+    def __init__(self, phrases: List[str]):
+        # 每个节点：子节点表、失败指针、输出（以该节点结尾的模式）、深度（已匹配的模式前缀长度）
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[str, ...]] = [()]
+        self.depth: List[int] = [0]
+        self.phrases = sorted({p.casefold() for p in phrases if p.strip()})
+        for phrase in self.phrases:
+            self._add(phrase)
+        self._build_failure_links()
+
+    def _add(self, phrase: str):
+        node = 0
+        for ch in phrase:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+                self.depth.append(self.depth[node] + 1)
+            node = nxt
+        self.output[node] = self.output[node] + (phrase,)
+
+    def _build_failure_links(self):
+        # 第一层节点的失败指针都指向根，从第一层开始 BFS
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def step(self, state: int, text: str) -> Tuple[int, List[str]]:
+        """从 state 开始消费 text，返回新状态和匹配到的模式"""
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = []
+        for ch in text.casefold():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                matches.extend(output[state])
+        return state, matches
+
+    def search(self, text: str) -> List[str]:
+        """返回文本中出现的所有模式"""
+        return self.step(0, text)[1]
+
+
+class StreamScanner:
+    """流式扫描：在多个分块之间保留自动机状态，跨分块边界的匹配也能识别"""
+
+    def __init__(self, automaton: AhoCorasick):
+        self.automaton = automaton
+        self.state = 0
+        self.matches: List[str] = []
+        self.pending = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self.state, matches = self.automaton.step(self.state, chunk)
+        self.matches.extend(matches)
+        return matches
+
+    def push(self, chunk: str) -> Tuple[str, List[str]]:
+        """先扫描再放行：返回 (可以发出的文本, 匹配到的模式)；末尾可能是关键词开头的几个字符先保留，
+        随下一块发出，这样完整的关键词总在报告匹配的那一块里；文本本身从不丢弃"""
+        matches = self.feed(chunk)
+        text = self.pending + chunk
+        keep = min(self.automaton.depth[self.state], len(text))
+        self.pending = text[len(text) - keep:]
+        return text[:len(text) - keep], matches
+
+    def flush(self) -> str:
+        """流结束时发出保留的文本（只是某个关键词的前缀，不构成匹配）"""
+        text, self.pending = self.pending, ""
+        return text
+
+
+class SafetyFilter:
+    """安全预过滤：编译一次，配置重载时整体替换"""
+
+    def __init__(self, phrases: List[str], response: str):
+        self.automaton = AhoCorasick(phrases)
+        self.response = response
+
+    def check(self, text: str) -> List[str]:
+        return self.automaton.search(text)
+
+    def scanner(self) -> StreamScanner:
+        return StreamScanner(self.automaton)
+
+
+def load_phrases(path: Optional[str]) -> List[str]:
+    """读取关键词文件；未配置时使用内置列表"""
+    if not path:
+        return DEFAULT_PHRASES
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+_current: Optional[Tuple[object, SafetyFilter]] = None
+
+
+def get_safety_filter(settings) -> Optional[SafetyFilter]:
+    """按当前配置返回过滤器；配置对象被重载替换后自动重新编译"""
+    global _current
+    if not settings.safety_filter_enabled:
+        return None
+    if _current is None or _current[0] is not settings:
+        try:
+            phrases = load_phrases(settings.safety_phrases_file)
+        except OSError as e:
+            logging.error(f"Safety phrases file unreadable, using defaults: {e}")
+            phrases = DEFAULT_PHRASES
+        _current = (settings, SafetyFilter(phrases, settings.safety_response or DEFAULT_RESPONSE))
+    return _current[1]
@@ -0,0 +1,180 @@
+"""
+语义缓存模块 - 对首轮提问做本地哈希向量化，相似度超过阈值时直接返回缓存的回答（纯 CPU、离线）
+"""
+import hashlib
+import re
+import time
+import zlib
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+# numpy 在首次创建缓存时才导入（约 50 ms），未启用语义缓存时不加载
+np = None
+
+
+def _load_numpy() -> bool:
+    """导入 numpy；未安装时语义缓存不可用"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+CJK_RE = re.compile(r"[㐀-鿿]+")
+
+
+def _features(text: str) -> List[str]:
+    """中文取字符 1-2 gram，英文取单词和相邻词对"""
+    text = text.casefold()
+    features = []
+    for run in CJK_RE.findall(text):
+        features.extend(run)
+        features.extend(run[i:i + 2] for i in range(len(run) - 1))
+    words = WORD_RE.findall(text)
+    features.extend(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return features
+
+
+class HashingVectorizer:
+    """带符号的特征哈希向量化，输出 L2 归一化向量"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def transform(self, text: str):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in _features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec
+
+
+class SemanticCache:
+    """固定容量的向量索引：小规模时暴力点积，超过 brute_force_limit 后用随机超平面 LSH 预筛候选"""
+
+    def __init__(self, capacity: int = 5000, threshold: float = 0.92, dim: int = 1024,
+                 brute_force_limit: int = 2000, lsh_tables: int = 8, lsh_bits: int = 12):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.brute_force_limit = brute_force_limit
+        self.vectorizer = HashingVectorizer(dim)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.namespaces: List[Optional[str]] = [None] * capacity
+        self.answers: List[Optional[dict]] = [None] * capacity
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+
+        rng = np.random.default_rng(0)
+        self.planes = rng.standard_normal((lsh_tables, lsh_bits, dim)).astype(np.float32)
+        self.bit_weights = (1 << np.arange(lsh_bits)).astype(np.int64)
+        self.buckets: List[Dict[int, Set[int]]] = [dict() for _ in range(lsh_tables)]
+        self.slot_keys: List[Optional[Tuple[int, ...]]] = [None] * capacity
+
+        self.hits = 0
+        self.misses = 0
+        self.lookup_ms = deque(maxlen=1000)
+
+    def _lsh_keys(self, vec) -> Tuple[int, ...]:
+        bits = (self.planes @ vec) > 0
+        return tuple(int(k) for k in bits.astype(np.int64) @ self.bit_weights)
+
+    def _candidates(self, vec, keys) -> "np.ndarray":
+        if self.size <= self.brute_force_limit:
+            return np.arange(self.size)
+        slots = set()
+        for table, key in zip(self.buckets, keys):
+            slots |= table.get(key, set())
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def lookup(self, namespace: str, prompt: str) -> Optional[dict]:
+        """返回相似问题的缓存回答；未命中返回 None"""
+        started = time.perf_counter()
+        vec = self.vectorizer.transform(prompt)
+        result = None
+        if self.size:
+            candidates = self._candidates(vec, self._lsh_keys(vec))
+            if len(candidates):
+                scores = self.vectors[candidates] @ vec
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    slot = int(candidates[i])
+                    if self.namespaces[slot] == namespace:
+                        self.last_used[slot] = time.monotonic()
+                        result = self.answers[slot]
+                        break
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.lookup_ms.append((time.perf_counter() - started) * 1000)
+        return result
+
+    def store(self, namespace: str, prompt: str, answer: dict):
+        """写入回答；满时淘汰最久未命中的条目"""
+        vec = self.vectorizer.transform(prompt)
+        if not vec.any():
+            return
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+            for table, key in zip(self.buckets, self.slot_keys[slot] or ()):
+                table.get(key, set()).discard(slot)
+
+        keys = self._lsh_keys(vec)
+        for table, key in zip(self.buckets, keys):
+            table.setdefault(key, set()).add(slot)
+        self.slot_keys[slot] = keys
+        self.vectors[slot] = vec
+        self.namespaces[slot] = namespace
+        self.answers[slot] = answer
+        self.last_used[slot] = time.monotonic()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        latencies = sorted(self.lookup_ms)
+        return {
+            "entries": self.size,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "index": "brute-force" if self.size <= self.brute_force_limit else "lsh",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "lookup_ms_p50": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+            "lookup_ms_p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0.0,
+            "memory_bytes": int(self.vectors.nbytes),
+        }
+
+
+def cache_namespace(tenant: str, endpoint: str, model: str, system_prompt: str, temperature: Optional[float]) -> str:
+    """同一用户（tenant）在同一端点、模型、系统提示词和温度下的回答才可互相复用"""
+    raw = f"{tenant}\n{endpoint}\n{model}\n{temperature}\n{system_prompt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache(settings) -> Optional[SemanticCache]:
+    """SEMANTIC_CACHE_ENABLED=true 且已安装 numpy 时返回全局缓存；重载后容量变化时重建（已缓存的回答丢弃）"""
+    global _cache
+    if not settings.semantic_cache_enabled or not _load_numpy():
+        return None
+    if _cache is None or _cache.capacity != settings.semantic_cache_capacity:
+        _cache = SemanticCache(
+            capacity=settings.semantic_cache_capacity,
+            threshold=settings.semantic_cache_threshold,
+        )
+    _cache.threshold = settings.semantic_cache_threshold
+    return _cache
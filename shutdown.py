@@ -0,0 +1,148 @@
+"""
+优雅停机模块 - 收到 SIGTERM 后不再接收新请求（快速 503），等待进行中的请求和流式响应在期限内完成，
+到期仍未结束的流发送终止事件后关闭，最后交给 uvicorn 正常退出
+"""
+import asyncio
+import logging
+import os
+import signal
+from typing import AsyncIterator, Callable, Optional, Sequence, Set
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from fast_json import SSE_DONE, dumps, sse_frame
+from health import InFlightCounter
+
+RESTART_MESSAGE = "Server is restarting, please retry / 服务正在重启，请稍后重试"
+
+# SSE 流被中止时的最后两帧
+SSE_TERMINAL = (sse_frame({"error": RESTART_MESSAGE, "retry": True}), SSE_DONE)
+
+# WebSocket 关闭码 1012: Service Restart
+CLOSE_SERVICE_RESTART = 1012
+
+# 排空期间仍然放行的路径（探针自己返回相应状态）
+DRAIN_EXEMPT_PATHS = {"/healthz", "/readyz"}
+
+_REJECT_BODY = dumps({"detail": RESTART_MESSAGE})
+
+
+class GracefulShutdown:
+    """SIGTERM -> 排空 -> 到期中止剩余流 -> 触发 uvicorn 退出"""
+
+    def __init__(self, counter: InFlightCounter, drain_timeout: float = 25.0, abort_grace: float = 3.0):
+        self.counter = counter
+        self.drain_timeout = drain_timeout
+        self.abort_grace = abort_grace
+        self.draining = False
+        self.connections: Set = set()  # 活跃的 WebSocket 多路复用器（StreamMux）
+        self._expired = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _busy(self) -> bool:
+        return self.counter.count > 0 or any(mux.streams for mux in self.connections)
+
+    async def drain(self):
+        """停止接收新请求并等待进行中的请求完成；到期后中止剩余的流"""
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        logging.warning(f"Draining: {self.counter.count} in-flight request(s), timeout {self.drain_timeout}s")
+        while self._busy() and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self._busy():
+            logging.warning(f"Drain timeout, aborting {self.counter.count} in-flight request(s)")
+        self._expired.set()
+        await asyncio.gather(*(mux.close_for_restart() for mux in list(self.connections)), return_exceptions=True)
+
+        # 给被中止的流一点时间写出终止事件
+        deadline = loop.time() + self.abort_grace
+        while self.counter.count > 0 and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def _drain_and_exit(self):
+        try:
+            await self.drain()
+        except Exception as e:
+            logging.error(f"Drain failed: {e}")
+        finally:
+            # 交回 uvicorn 的正常退出流程（关闭监听、lifespan shutdown）
+            os.kill(os.getpid(), signal.SIGINT)
+
+    def on_sigterm(self):
+        if self._task is not None:
+            # 第二次 SIGTERM：不再等待
+            self._expired.set()
+            os.kill(os.getpid(), signal.SIGINT)
+            return
+        self._task = asyncio.get_running_loop().create_task(self._drain_and_exit())
+
+    def install(self):
+        """接管 SIGTERM（uvicorn 在 lifespan 启动前安装自己的处理函数，这里会覆盖它）"""
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.on_sigterm)
+        except (NotImplementedError, RuntimeError, AttributeError, ValueError):
+            logging.debug("SIGTERM drain not available on this platform")
+
+    async def guard(self, frames: AsyncIterator[bytes], on_abort: Optional[Callable[[], None]] = None,
+                    terminal: Sequence[bytes] = SSE_TERMINAL) -> AsyncIterator[bytes]:
+        """包装流式响应：排空期限到达时调用 on_abort（如关闭上游连接），输出 terminal 后结束"""
+        iterator = frames.__aiter__()
+        expired = asyncio.ensure_future(self._expired.wait())
+        pending = None
+        try:
+            while True:
+                pending = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({pending, expired}, return_when=asyncio.FIRST_COMPLETED)
+                if pending.done():
+                    try:
+                        frame = pending.result()
+                    except StopAsyncIteration:
+                        return
+                    pending = None
+                    yield frame
+                    continue
+
+                # 期限已到：先关闭上游，让线程中阻塞的读取尽快返回
+                if on_abort:
+                    on_abort()
+                pending.cancel()
+                await asyncio.wait({pending}, timeout=1.0)
+                pending = None
+                for frame in terminal:
+                    yield frame
+                return
+        finally:
+            expired.cancel()
+            if pending is not None:
+                pending.cancel()
+
+
+class DrainMiddleware:
+    """排空期间新请求直接返回 503（WebSocket 以 1012 关闭），不进入应用"""
+
+    def __init__(self, app: ASGIApp, shutdown: GracefulShutdown):
+        self.app = app
+        self.shutdown = shutdown
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.shutdown.draining or scope["type"] not in ("http", "websocket") \
+                or scope["path"] in DRAIN_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": CLOSE_SERVICE_RESTART})
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_REJECT_BODY)).encode()),
+                (b"retry-after", b"1"),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _REJECT_BODY})
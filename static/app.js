@@ -4,9 +4,12 @@ let models = { aliyun: [], openai: [] };
 let isLoading = false;
 let showImageGen = false;
 let showSettings = false;
-let chatHistory = JSON.parse(localStorage.getItem('chatHistory') || '[]');
+// 侧边栏对话列表（只含元数据，消息在打开对话时从 historyStore 加载）
+let chatHistory = [];
 let currentChatId = null;
 let currentAgent = 'default';
+// 心理医生对话ID：服务端据此复用上游 session，每轮只需发送新消息
+let agentConversationId = null;
 let dailyFreeLimit = 10;
 let requireAuth = false;
 let currentUser = null;
@@ -26,6 +29,109 @@ function getAuthHeaders() {
     return headers;
 }
 
+// WebSocket 传输：一条连接认证一次，多轮对话/图片复用；连接不可用时回退到 HTTP
+const chatSocket = {
+    ws: null,
+    connecting: null,
+    disabled: false,
+    window: 64,
+    nextId: 1,
+    streams: new Map(),
+
+    connect() {
+        if (this.ws) return Promise.resolve(this.ws);
+        if (this.connecting) return this.connecting;
+        this.connecting = new Promise((resolve, reject) => {
+            const proto = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const ws = new WebSocket(`${proto}//${window.location.host}${BASE}/api/ws`);
+            const timer = setTimeout(() => ws.close(), 5000);
+            ws.onopen = () => ws.send(JSON.stringify({ type: 'auth', token: authToken || '' }));
+            ws.onmessage = (event) => {
+                const msg = JSON.parse(event.data);
+                if (msg.type === 'ready') {
+                    clearTimeout(timer);
+                    this.ws = ws;
+                    this.window = msg.window || this.window;
+                    this.connecting = null;
+                    resolve(ws);
+                    return;
+                }
+                this.handle(msg);
+            };
+            ws.onclose = () => {
+                clearTimeout(timer);
+                if (this.ws !== ws) {
+                    // 握手或认证失败
+                    this.connecting = null;
+                    reject(new Error('WebSocket unavailable'));
+                    return;
+                }
+                this.ws = null;
+                for (const stream of this.streams.values()) {
+                    stream.resolve({ ok: false, status: 0, detail: 'Connection closed' });
+                }
+                this.streams.clear();
+            };
+        });
+        return this.connecting;
+    },
+
+    // 是否可用；首次失败后本页面不再尝试（例如代理不支持 WebSocket）
+    async isAvailable() {
+        if (this.disabled || !('WebSocket' in window)) return false;
+        try {
+            await this.connect();
+            return true;
+        } catch (e) {
+            console.warn('[WS] Falling back to HTTP:', e.message);
+            this.disabled = true;
+            return false;
+        }
+    },
+
+    // 发起一个流：onEvent 逐条接收事件；返回 { ok, status, detail }；signal 中止时发送 cancel
+    async stream(type, payload, onEvent, signal) {
+        const ws = await this.connect();
+        const id = String(this.nextId++);
+        return new Promise((resolve) => {
+            this.streams.set(id, { onEvent, resolve, unacked: 0, error: null });
+            ws.send(JSON.stringify({ type, id, payload }));
+            if (signal) {
+                signal.addEventListener('abort', () => {
+                    if (this.streams.has(id)) ws.send(JSON.stringify({ type: 'cancel', id }));
+                });
+            }
+        });
+    },
+
+    handle(msg) {
+        const stream = this.streams.get(msg.id);
+        if (!stream) return;
+        if (msg.type === 'event') {
+            stream.onEvent(msg.data);
+            // 事件处理完后再归还额度，渲染跟不上时服务端会暂停发送
+            if (++stream.unacked >= Math.max(1, Math.floor(this.window / 2))) {
+                this.ws.send(JSON.stringify({ type: 'ack', id: msg.id, n: stream.unacked }));
+                stream.unacked = 0;
+            }
+        } else if (msg.type === 'error') {
+            stream.error = msg;
+        } else if (msg.type === 'done') {
+            this.streams.delete(msg.id);
+            stream.resolve(stream.error
+                ? { ok: false, status: stream.error.status, detail: stream.error.detail }
+                : { ok: true, status: 200, cancelled: msg.cancelled });
+        }
+    },
+
+    // 登录状态变化后重新连接
+    close() {
+        this.disabled = false;
+        if (this.ws) this.ws.close();
+        this.ws = null;
+    }
+};
+
 // 检查登录状态
 async function checkAuth() {
     if (!requireAuth) return true;
@@ -46,6 +152,7 @@ async function checkAuth() {
             return true;
         } else {
             authToken = null;
+            chatSocket.close();
             localStorage.removeItem('authToken');
             showLoginModal();
             return false;
@@ -110,6 +217,7 @@ function updateUserUI() {
 // 登出
 function logout() {
     authToken = null;
+    chatSocket.close();
     currentUser = null;
     localStorage.removeItem('authToken');
     updateUserUI();
@@ -131,6 +239,27 @@ function showRegisterForm() {
 }
 
 // 登录
+// 微信扫码登录：跳转到服务端，由服务端重定向到微信授权页
+function loginWithWeChat() {
+    window.location.href = `${BASE}/api/auth/wechat/authorize`;
+}
+
+// 读取 /wechat-callback 重定向回来时 # 后的参数，然后清掉，避免令牌留在地址栏和历史记录中
+function consumeWeChatRedirect() {
+    if (!location.hash) return;
+    const params = new URLSearchParams(location.hash.slice(1));
+    const token = params.get('wechat_token');
+    const error = params.get('wechat_error');
+    if (!token && !error) return;
+    history.replaceState(null, '', location.pathname + location.search);
+    if (token) {
+        authToken = token;
+        localStorage.setItem('authToken', authToken);
+    } else {
+        alert(error);
+    }
+}
+
 async function login() {
     const username = document.getElementById('loginUsername').value.trim();
     const password = document.getElementById('loginPassword').value;
@@ -150,6 +279,7 @@ async function login() {
         if (resp.ok) {
             const data = await resp.json();
             authToken = data.token;
+            chatSocket.close();
             localStorage.setItem('authToken', authToken);
             currentUser = data.user;
             updateUserUI();
@@ -218,6 +348,7 @@ async function register() {
         if (resp.ok) {
             const data = await resp.json();
             authToken = data.token;
+            chatSocket.close();
             localStorage.setItem('authToken', authToken);
             currentUser = data.user;
             updateUserUI();
@@ -265,6 +396,9 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Load app config
     await loadConfig();
     
+    // 微信扫码登录回调带回的令牌或错误
+    consumeWeChatRedirect();
+    
     // 检查认证
     await checkAuth();
     
@@ -321,7 +455,11 @@ async function loadConfig() {
         dailyFreeLimit = config.dailyFreeLimit || 10;
         requireAuth = config.requireAuth || false;
         
-        // 微信登录选项始终显示（点击时会提示是否配置）
+        // 仅在服务端配置了微信登录时显示按钮
+        const wechatBtn = document.getElementById('wechatLoginBtn');
+        if (wechatBtn) {
+            wechatBtn.style.display = config.wechatEnabled ? '' : 'none';
+        }
         
         updateUsageQuota();
         
@@ -450,10 +588,18 @@ function newChat() {
 }
 
 // Open Therapist (心理医生) chat view
+function newConversationId() {
+    if (window.crypto && typeof crypto.randomUUID === 'function') {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
 function openTherapist() {
     currentChatId = null;
     messages = [];
     currentAgent = 'therapist';
+    agentConversationId = newConversationId();
     
     // Exit image generation mode if active
     if (showImageGen) {
@@ -494,15 +640,16 @@ function openTherapist() {
 }
 
 // Chat history management
-function loadChatHistory() {
-    chatHistory = JSON.parse(localStorage.getItem('chatHistory') || '[]');
+async function loadChatHistory() {
+    try {
+        chatHistory = await historyStore.listChats();
+    } catch (e) {
+        console.error('Failed to load chat history:', e);
+        chatHistory = [];
+    }
     updateChatHistoryUI();
 }
 
-function saveChatHistory() {
-    localStorage.setItem('chatHistory', JSON.stringify(chatHistory));
-}
-
 function updateChatHistoryUI() {
     const listEl = document.getElementById('chatHistoryList');
     if (!listEl) return;
@@ -528,46 +675,65 @@ function updateChatHistoryUI() {
     }
 }
 
-function saveCurrentChat() {
+async function saveCurrentChat() {
     if (messages.length === 0) return;
     
     const title = messages.find(m => m.role === 'user')?.content.substring(0, 30) || '新对话';
+    const now = new Date().toISOString();
+    let chat = currentChatId ? chatHistory.find(c => c.id === currentChatId) : null;
+    // 只写入上次保存之后新增的消息
+    let fromSeq = 0;
     
-    if (currentChatId) {
+    if (chat) {
         // Update existing chat
-        const chat = chatHistory.find(c => c.id === currentChatId);
-        if (chat) {
-            chat.messages = [...messages];
-            chat.title = title;
-            chat.updatedAt = new Date().toISOString();
-        }
+        fromSeq = Math.min(chat.messageCount || 0, messages.length);
+        chat.title = title;
+        chat.updatedAt = now;
     } else {
         // Create new chat
         currentChatId = Date.now().toString();
-        chatHistory.unshift({
+        chat = {
             id: currentChatId,
             title: title,
-            messages: [...messages],
-            createdAt: new Date().toISOString(),
-            updatedAt: new Date().toISOString()
-        });
+            createdAt: now,
+            updatedAt: now,
+            messageCount: 0
+        };
+        chatHistory.unshift(chat);
     }
     
     // Keep only last 50 chats
-    if (chatHistory.length > 50) {
-        chatHistory = chatHistory.slice(0, 50);
-    }
-    
-    saveChatHistory();
+    const removed = chatHistory.splice(historyStore.MAX_CHATS);
     updateChatHistoryUI();
+    
+    const snapshot = [...messages];
+    try {
+        await historyStore.saveChat(chat, snapshot, fromSeq);
+        chat.messageCount = snapshot.length;
+        for (const old of removed) {
+            await historyStore.deleteChat(old.id);
+        }
+    } catch (e) {
+        console.error('Failed to save chat history:', e);
+    }
 }
 
-function loadChat(chatId) {
+async function loadChat(chatId) {
     const chat = chatHistory.find(c => c.id === chatId);
     if (!chat) return;
     
     currentChatId = chatId;
-    messages = [...chat.messages];
+    let loaded;
+    try {
+        loaded = await historyStore.getMessages(chatId);
+    } catch (e) {
+        console.error('Failed to load chat:', e);
+        return;
+    }
+    // 加载期间用户已切换到其它对话
+    if (currentChatId !== chatId) return;
+    messages = loaded;
+    chat.messageCount = loaded.length;
     renderMessages();
     updateChatHistoryUI();
     // set UI active states: this is a loaded chat (regular chat)
@@ -584,7 +750,7 @@ function loadChat(chatId) {
 function deleteChat(chatId) {
     if (confirm('确定要删除这个对话吗？')) {
         chatHistory = chatHistory.filter(c => c.id !== chatId);
-        saveChatHistory();
+        historyStore.deleteChat(chatId).catch(e => console.error('Failed to delete chat:', e));
         
         if (currentChatId === chatId) {
             newChat();
@@ -644,9 +810,12 @@ async function updateUsageQuota() {
     // Only show quota if using default key
     if (customKey) {
         quotaEl.style.display = 'none';
+        updateEndpointWarning();
     } else {
+        const warningEl = document.getElementById('endpointWarning');
+        if (warningEl) warningEl.style.display = 'none';
         try {
-            const response = await fetch(`${BASE}/api/usage`);
+            const response = await fetch(`${BASE}/api/usage`, { headers: getAuthHeaders() });
             const usage = await response.json();
             
             quotaEl.style.display = 'block';
@@ -667,6 +836,25 @@ async function updateUsageQuota() {
     }
 }
 
+// Warn about a rejected or slow custom API key / endpoint
+async function updateEndpointWarning() {
+    const warningEl = document.getElementById('endpointWarning');
+    const textEl = document.getElementById('endpointWarningText');
+    if (!warningEl || !textEl) return;
+
+    try {
+        const response = await fetch(`${BASE}/api/usage`, { headers: getAuthHeaders() });
+        const usage = await response.json();
+        const warning = usage.custom_key && usage.custom_key.warning;
+        textEl.textContent = warning || '';
+        textEl.style.color = '#d29922';
+        warningEl.style.display = warning ? 'block' : 'none';
+    } catch (error) {
+        console.error('Failed to fetch usage:', error);
+        warningEl.style.display = 'none';
+    }
+}
+
 // Send message
 async function sendMessage() {
     // 检查认证
@@ -704,97 +892,55 @@ async function sendMessage() {
         let response, data;
         if (currentAgent === 'therapist') {
             // Use agent completion proxy with streaming
+            if (!agentConversationId) {
+                agentConversationId = newConversationId();
+            }
             const agentBody = {
                 input: { prompt: message },
-                parameters: {}
+                parameters: {},
+                conversation_id: agentConversationId
             };
 
-            response = await fetch(`${BASE}/api/agent-completion`, {
-                method: 'POST',
-                headers: getAuthHeaders(),
-                body: JSON.stringify(agentBody)
-            });
-            
-            // Handle streaming response
-            if (response.ok && response.headers.get('content-type')?.includes('text/event-stream')) {
-                const reader = response.body.getReader();
-                const decoder = new TextDecoder();
-                let accumulatedText = '';
-                
-                // Add assistant message placeholder
-                messages.push({
-                    role: 'assistant',
-                    content: ''
-                });
-                
-                // Remove thinking indicator and reuse its wrapper
-                const chatArea = document.getElementById('chatArea');
-                const thinkingIndicator = document.getElementById('thinkingIndicator');
-                let wrapper, markdownDiv;
-                
-                if (thinkingIndicator) {
-                    // Reuse existing wrapper
-                    wrapper = thinkingIndicator;
-                    wrapper.id = '';
-                    const content = wrapper.querySelector('.message-content');
-                    content.innerHTML = '';
-                    markdownDiv = document.createElement('div');
-                    markdownDiv.className = 'message-markdown';
-                    content.appendChild(markdownDiv);
-                } else {
-                    // Create new wrapper if no thinking indicator
-                    wrapper = document.createElement('div');
-                    wrapper.className = 'message-wrapper assistant';
-                    const content = document.createElement('div');
-                    content.className = 'message-content';
-                    markdownDiv = document.createElement('div');
-                    markdownDiv.className = 'message-markdown';
-                    content.appendChild(markdownDiv);
-                    wrapper.appendChild(content);
-                    chatArea.appendChild(wrapper);
+            if (await chatSocket.isAvailable()) {
+                const stream = startAssistantStream();
+                const result = await chatSocket.stream('agent', agentBody, stream.onEvent);
+                stream.finish();
+                if (result.ok) {
+                    updateUsageQuota();
+                    saveCurrentChat();
+                    isLoading = false;
+                    return;
                 }
-                
-                while (true) {
-                    const { done, value } = await reader.read();
-                    if (done) break;
-                    
-                    const chunk = decoder.decode(value);
-                    console.log('[Stream] Received chunk:', chunk.substring(0, 100));
-                    const lines = chunk.split('\n');
-                    
-                    for (const line of lines) {
-                        if (line.startsWith('data: ')) {
-                            const dataStr = line.slice(6).trim();
-                            if (dataStr === '[DONE]') {
-                                console.log('[Stream] Completed');
-                                break;
-                            }
-                            try {
-                                const parsed = JSON.parse(dataStr);
-                                if (parsed.text) {
-                                    console.log('[Stream] Text chunk:', parsed.text.substring(0, 50));
-                                    accumulatedText += parsed.text;
-                                    // Update only the last message content
-                                    messages[messages.length - 1].content = accumulatedText;
-                                    markdownDiv.innerHTML = marked.parse(accumulatedText);
-                                    chatArea.scrollTop = chatArea.scrollHeight;
-                                }
-                            } catch (e) {
-                                console.error('Parse error:', e);
-                            }
-                        }
-                    }
+                // 尚未收到内容时移除占位消息，按 HTTP 错误处理
+                if (!messages[messages.length - 1].content) {
+                    messages.pop();
                 }
+                response = { ok: false, status: result.status };
+                data = { detail: result.detail };
+            } else {
+                response = await fetch(`${BASE}/api/agent-completion`, {
+                    method: 'POST',
+                    headers: getAuthHeaders(),
+                    body: JSON.stringify(agentBody)
+                });
+            
+                // Handle streaming response
+                if (response.ok && response.headers.get('content-type')?.includes('text/event-stream')) {
+                    const stream = startAssistantStream();
+                    await readSSE(response, stream.onEvent);
+                    stream.finish();
+                    console.log('[Stream] Completed');
                 
-                // Update usage and save after streaming completes
-                updateUsageQuota();
-                saveCurrentChat();
-                isLoading = false;
-                return;
-            }
+                    // Update usage and save after streaming completes
+                    updateUsageQuota();
+                    saveCurrentChat();
+                    isLoading = false;
+                    return;
+                }
             
-            // Fallback to non-streaming
-            data = await response.json();
+                // Fallback to non-streaming
+                data = await response.json();
+            }
         } else {
             const requestBody = {
                 messages,
@@ -805,12 +951,19 @@ async function sendMessage() {
                 api_key: customApiKey
             };
 
-            response = await fetch(`${BASE}/api/chat`, {
-                method: 'POST',
-                headers: getAuthHeaders(),
-                body: JSON.stringify(requestBody)
-            });
-            data = await response.json();
+            if (await chatSocket.isAvailable()) {
+                let reply = null;
+                const result = await chatSocket.stream('chat', requestBody, (event) => { reply = event; });
+                response = { ok: result.ok, status: result.status };
+                data = result.ok ? reply : { detail: result.detail };
+            } else {
+                response = await fetch(`${BASE}/api/chat`, {
+                    method: 'POST',
+                    headers: getAuthHeaders(),
+                    body: JSON.stringify(requestBody)
+                });
+                data = await response.json();
+            }
         }
         
         if (response.ok) {
@@ -866,6 +1019,187 @@ async function sendMessage() {
     }
 }
 
+// 添加助手消息占位并返回流式事件处理函数（SSE 与 WebSocket 共用）
+function startAssistantStream() {
+    let accumulatedText = '';
+    
+    // Add assistant message placeholder
+    messages.push({
+        role: 'assistant',
+        content: ''
+    });
+    
+    // Remove thinking indicator and reuse its wrapper
+    const chatArea = document.getElementById('chatArea');
+    const thinkingIndicator = document.getElementById('thinkingIndicator');
+    let wrapper, markdownDiv;
+    
+    if (thinkingIndicator) {
+        // Reuse existing wrapper
+        wrapper = thinkingIndicator;
+        wrapper.id = '';
+        const content = wrapper.querySelector('.message-content');
+        content.innerHTML = '';
+        markdownDiv = document.createElement('div');
+        markdownDiv.className = 'message-markdown';
+        content.appendChild(markdownDiv);
+    } else {
+        // Create new wrapper if no thinking indicator
+        wrapper = document.createElement('div');
+        wrapper.className = 'message-wrapper assistant';
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        markdownDiv = document.createElement('div');
+        markdownDiv.className = 'message-markdown';
+        content.appendChild(markdownDiv);
+        wrapper.appendChild(content);
+        chatArea.appendChild(wrapper);
+    }
+
+    const renderer = createStreamingMarkdown(markdownDiv, () => {
+        chatArea.scrollTop = chatArea.scrollHeight;
+    });
+
+    return {
+        onEvent(parsed) {
+            if (parsed.text) {
+                accumulatedText += parsed.text;
+                // Update only the last message content
+                messages[messages.length - 1].content = accumulatedText;
+                renderer.append(parsed.text);
+            }
+        },
+        // 流结束：立即渲染剩余内容
+        finish() {
+            renderer.finish();
+        }
+    };
+}
+
+// 逐行读取 SSE 响应：不完整的行留到下一个网络分块再处理，[DONE] 之后停止
+async function readSSE(response, onData) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (!line.startsWith('data: ')) continue;
+            const dataStr = line.slice(6).trim();
+            if (dataStr === '[DONE]') {
+                reader.cancel();
+                return;
+            }
+            let parsed;
+            try {
+                parsed = JSON.parse(dataStr);
+            } catch (e) {
+                console.error('Parse error:', e);
+                continue;
+            }
+            onData(parsed);
+        }
+    }
+}
+
+// 流式 Markdown 渲染：已完成的块只解析并插入一次，每个动画帧只重新解析末尾未完成的块，避免每个分块都解析全文。
+// 提交点是代码块外的空行；列表和缩进代码块可以跨空行延续，要等到下一行既不缩进也不是列表项才算结束
+const MD_FENCE = /^ {0,3}(```|~~~)/;
+const MD_LIST_ITEM = /^ {0,3}([*+-]|\d{1,9}[.)])(\s|$)/;
+const MD_INDENTED = /^( {4}|\t)/;
+// 引用式链接的定义可能出现在使用之后，出现定义后改为每帧解析全文
+const MD_LINK_DEFINITION = /^ {0,3}\[[^\]]+\]:\s*\S/m;
+
+function createStreamingMarkdown(container, onRender) {
+    let source = '';
+    let committed = 0;        // 已固定渲染的字符数
+    let committedNodes = 0;   // 已固定渲染的 DOM 节点数
+    let hasDefinitions = false;
+    let frame = null;
+
+    // 待渲染部分中最后一个确定已结束的块之后的位置
+    function lastBoundary() {
+        let boundary = committed;
+        let inFence = false;
+        let continuable = false;  // 当前块是列表或缩进代码块，遇到空行还不能确定结束
+        let blankEnd = -1;        // 这类块之后空行的结束位置，看到下一行再决定
+        let pos = committed;
+        while (true) {
+            const end = source.indexOf('\n', pos);
+            if (end === -1) break;  // 最后一行尚未结束
+            const line = source.slice(pos, end);
+            if (!inFence && line.trim() === '') {
+                if (!continuable) {
+                    boundary = end + 1;
+                } else if (blankEnd === -1) {
+                    blankEnd = end + 1;
+                }
+            } else {
+                if (blankEnd !== -1) {
+                    if (!/^\s/.test(line) && !MD_LIST_ITEM.test(line)) {
+                        boundary = blankEnd;
+                        continuable = false;
+                    }
+                    blankEnd = -1;
+                }
+                if (MD_FENCE.test(line)) {
+                    inFence = !inFence;
+                } else if (!inFence && (MD_LIST_ITEM.test(line) || (MD_INDENTED.test(line) && pos === boundary))) {
+                    continuable = true;
+                }
+            }
+            pos = end + 1;
+        }
+        return boundary;
+    }
+
+    function render(final) {
+        frame = null;
+        // 移除上一帧渲染的未完成块
+        while (container.childNodes.length > committedNodes) {
+            container.removeChild(container.lastChild);
+        }
+        if (!hasDefinitions && MD_LINK_DEFINITION.test(source.slice(committed))) {
+            // 之前已提交的块可能引用了这个定义，全部重新渲染
+            hasDefinitions = true;
+            container.innerHTML = '';
+            committed = 0;
+            committedNodes = 0;
+        }
+        const boundary = final ? source.length : (hasDefinitions ? committed : lastBoundary());
+        if (boundary > committed) {
+            container.insertAdjacentHTML('beforeend', marked.parse(source.slice(committed, boundary)));
+            committed = boundary;
+            committedNodes = container.childNodes.length;
+        }
+        if (committed < source.length) {
+            container.insertAdjacentHTML('beforeend', marked.parse(source.slice(committed)));
+        }
+        if (onRender) onRender();
+    }
+
+    return {
+        append(text) {
+            source += text;
+            if (frame === null) {
+                frame = requestAnimationFrame(() => render(false));
+            }
+        },
+        finish() {
+            if (frame !== null) {
+                cancelAnimationFrame(frame);
+            }
+            render(true);
+        }
+    };
+}
+
 // Render messages
 function renderMessages() {
     const chatArea = document.getElementById('chatArea');
@@ -951,28 +1285,63 @@ async function generateImage() {
             n: 1,
             api_key: apiKey,
             endpoint_url: endpointUrl,
-            api_type: endpointUrl.includes('dashscope') ? 'aliyun_multimodal' : 'openai'
+            api_type: endpointUrl.includes('dashscope') ? 'aliyun_multimodal' : 'openai',
+            stream: true
         };
         
         console.log('发送的请求体:', requestBody);
+        
+        const gallery = document.getElementById('imageGallery');
+        const appendImage = (img) => {
+            const imgEl = document.createElement('img');
+            imgEl.src = img.url;
+            imgEl.className = 'generated-image';
+            gallery.appendChild(imgEl);
+        };
+        let errors = [];
+        let received = 0;
+        const onImageEvent = (parsed) => {
+            if (parsed.url) {
+                appendImage(parsed);
+                received++;
+            } else if (parsed.error) {
+                errors.push(parsed.error);
+            }
+        };
+
+        if (await chatSocket.isAvailable()) {
+            gallery.innerHTML = '';
+            const result = await chatSocket.stream('image', requestBody, onImageEvent);
+            if (!result.ok) {
+                alert(`Error: ${result.detail || 'Failed to generate image'}`);
+            } else if (received === 0 && errors.length > 0) {
+                alert(`Error: ${errors[0]}`);
+            }
+            return;
+        }
+
         const response = await fetch(`${BASE}/api/generate-image`, {
             method: 'POST',
             headers: getAuthHeaders(),
             body: JSON.stringify(requestBody)
         });
-        
+
+        // 流式返回：每张图片完成即显示
+        if (response.ok && response.headers.get('content-type')?.includes('text/event-stream')) {
+            gallery.innerHTML = '';
+            await readSSE(response, onImageEvent);
+
+            if (received === 0 && errors.length > 0) {
+                alert(`Error: ${errors[0]}`);
+            }
+            return;
+        }
+
         const data = await response.json();
         
         if (response.ok && data.images) {
-            const gallery = document.getElementById('imageGallery');
             gallery.innerHTML = '';
-            
-            data.images.forEach(img => {
-                const imgEl = document.createElement('img');
-                imgEl.src = img.url;
-                imgEl.className = 'generated-image';
-                gallery.appendChild(imgEl);
-            });
+            data.images.forEach(appendImage);
         } else {
             alert(`Error: ${data.detail || 'Failed to generate image'}`);
         }
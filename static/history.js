@@ -0,0 +1,196 @@
+// 聊天记录存储：IndexedDB 中每个对话一条元数据记录、每条消息一条记录
+// 侧边栏只读取元数据，打开对话时才加载消息；保存时只写入新增的消息
+// 浏览器不支持 IndexedDB（或打开失败）时回退到原来的 localStorage 整体存储
+const historyStore = (() => {
+    const DB_NAME = 'openchatbox';
+    const DB_VERSION = 1;
+    const LEGACY_KEY = 'chatHistory';
+    const MAX_CHATS = 50;
+
+    let dbPromise = null;
+
+    function promisify(req) {
+        return new Promise((resolve, reject) => {
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    }
+
+    function completed(tx) {
+        return new Promise((resolve, reject) => {
+            tx.oncomplete = () => resolve();
+            tx.onerror = tx.onabort = () => reject(tx.error);
+        });
+    }
+
+    function messageRange(chatId, fromSeq = 0) {
+        return IDBKeyRange.bound([chatId, fromSeq], [chatId, Infinity]);
+    }
+
+    function toMeta(chat, messageCount) {
+        return {
+            id: chat.id,
+            title: chat.title,
+            createdAt: chat.createdAt,
+            updatedAt: chat.updatedAt,
+            messageCount
+        };
+    }
+
+    // 写入对话元数据和 fromSeq 之后的消息；消息变少时删除多余记录
+    function writeChat(tx, chat, messages, fromSeq) {
+        tx.objectStore('chats').put(toMeta(chat, messages.length));
+        const store = tx.objectStore('messages');
+        for (let seq = fromSeq; seq < messages.length; seq++) {
+            const { role, content } = messages[seq];
+            store.put({ chatId: chat.id, seq, role, content });
+        }
+        if ((chat.messageCount || 0) > messages.length) {
+            store.delete(messageRange(chat.id, messages.length));
+        }
+    }
+
+    // 一次性迁移 localStorage 中的旧数据，成功后删除旧键释放配额
+    async function migrate(db) {
+        const raw = localStorage.getItem(LEGACY_KEY);
+        if (!raw) return;
+        let chats = [];
+        try {
+            chats = JSON.parse(raw);
+        } catch (e) {
+            console.error('Legacy chat history unreadable:', e);
+        }
+        const tx = db.transaction(['chats', 'messages'], 'readwrite');
+        for (const chat of chats) {
+            writeChat(tx, { ...chat, messageCount: 0 }, chat.messages || [], 0);
+        }
+        await completed(tx);
+        localStorage.removeItem(LEGACY_KEY);
+        console.log(`[History] Migrated ${chats.length} chats to IndexedDB`);
+    }
+
+    function open() {
+        if (!dbPromise) {
+            dbPromise = new Promise((resolve, reject) => {
+                if (!window.indexedDB) {
+                    reject(new Error('IndexedDB unavailable'));
+                    return;
+                }
+                const req = indexedDB.open(DB_NAME, DB_VERSION);
+                req.onupgradeneeded = () => {
+                    const db = req.result;
+                    const chats = db.createObjectStore('chats', { keyPath: 'id' });
+                    chats.createIndex('createdAt', 'createdAt');
+                    db.createObjectStore('messages', { keyPath: ['chatId', 'seq'] });
+                };
+                req.onsuccess = () => resolve(req.result);
+                req.onerror = () => reject(req.error);
+            }).then(async (db) => {
+                await migrate(db);
+                return db;
+            });
+        }
+        return dbPromise;
+    }
+
+    const indexed = {
+        // 最新创建的 MAX_CHATS 个对话（只含元数据）
+        async listChats() {
+            const db = await open();
+            const index = db.transaction('chats').objectStore('chats').index('createdAt');
+            return new Promise((resolve, reject) => {
+                const result = [];
+                const req = index.openCursor(null, 'prev');
+                req.onsuccess = () => {
+                    const cursor = req.result;
+                    if (cursor && result.length < MAX_CHATS) {
+                        result.push(cursor.value);
+                        cursor.continue();
+                    } else {
+                        resolve(result);
+                    }
+                };
+                req.onerror = () => reject(req.error);
+            });
+        },
+
+        async getMessages(chatId) {
+            const db = await open();
+            const records = await promisify(
+                db.transaction('messages').objectStore('messages').getAll(messageRange(chatId))
+            );
+            return records.map(({ role, content }) => ({ role, content }));
+        },
+
+        // chat.messageCount 为已保存的消息数，只写入 fromSeq 之后的消息
+        async saveChat(chat, messages, fromSeq) {
+            const db = await open();
+            const tx = db.transaction(['chats', 'messages'], 'readwrite');
+            writeChat(tx, chat, messages, fromSeq);
+            await completed(tx);
+        },
+
+        async deleteChat(chatId) {
+            const db = await open();
+            const tx = db.transaction(['chats', 'messages'], 'readwrite');
+            tx.objectStore('chats').delete(chatId);
+            tx.objectStore('messages').delete(messageRange(chatId));
+            await completed(tx);
+        }
+    };
+
+    // 回退实现：与改造前相同的整体 JSON 存储
+    const legacy = {
+        load() {
+            try {
+                return JSON.parse(localStorage.getItem(LEGACY_KEY) || '[]');
+            } catch (e) {
+                return [];
+            }
+        },
+        save(chats) {
+            localStorage.setItem(LEGACY_KEY, JSON.stringify(chats.slice(0, MAX_CHATS)));
+        },
+        async listChats() {
+            return this.load().map(chat => toMeta(chat, (chat.messages || []).length));
+        },
+        async getMessages(chatId) {
+            const chat = this.load().find(c => c.id === chatId);
+            return chat ? [...chat.messages] : [];
+        },
+        async saveChat(chat, messages) {
+            const chats = this.load();
+            const record = { ...toMeta(chat, messages.length), messages: [...messages] };
+            const index = chats.findIndex(c => c.id === chat.id);
+            if (index >= 0) {
+                chats[index] = record;
+            } else {
+                chats.unshift(record);
+            }
+            this.save(chats);
+        },
+        async deleteChat(chatId) {
+            this.save(this.load().filter(c => c.id !== chatId));
+        }
+    };
+
+    // 首次调用时决定使用哪种实现
+    let backend = null;
+    async function getBackend() {
+        if (!backend) {
+            backend = open().then(() => indexed, (e) => {
+                console.warn('[History] Falling back to localStorage:', e.message);
+                return legacy;
+            });
+        }
+        return backend;
+    }
+
+    return {
+        MAX_CHATS,
+        listChats: async () => (await getBackend()).listChats(),
+        getMessages: async (chatId) => (await getBackend()).getMessages(chatId),
+        saveChat: async (chat, messages, fromSeq = 0) => (await getBackend()).saveChat(chat, messages, fromSeq),
+        deleteChat: async (chatId) => (await getBackend()).deleteChat(chatId)
+    };
+})();
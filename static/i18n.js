@@ -41,6 +41,7 @@ const translations = {
         loginTitle: "登录",
         loginSubtitle: "输入用户名和密码",
         loginButton: "登录",
+        wechatLogin: "微信登录",
         registerTitle: "注册",
         registerSubtitle: "创建新账号",
         registerButton: "注册",
@@ -97,6 +98,7 @@ const translations = {
         loginTitle: "Login",
         loginSubtitle: "Enter username and password",
         loginButton: "Login",
+        wechatLogin: "Login with WeChat",
         registerTitle: "Register",
         registerSubtitle: "Create new account",
         registerButton: "Register",
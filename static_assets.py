@@ -0,0 +1,147 @@
+"""
+静态资源模块 - 启动时生成内容哈希文件名与 gzip/brotli 预压缩版本，按 Accept-Encoding 返回
+"""
+import gzip
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只提供 gzip
+    brotli = None
+
+# 带哈希的文件名内容不会变化，可以永久缓存
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 未带哈希的文件（含 index.html）每次都需要用 ETag 校验
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".svg", ".json", ".ico", ".txt"}
+# 太小的文件压缩收益不如额外的头部开销
+MIN_COMPRESS_SIZE = 512
+
+STATIC_REF_RE = re.compile(r"static/([\w.\-]+)")
+
+
+class Asset:
+    """单个静态文件及其各编码版本"""
+
+    def __init__(self, name: str, body: bytes):
+        self.name = name
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type in ("application/javascript", "application/json"):
+            self.media_type += "; charset=utf-8"
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:16]}"'
+        stem, dot, suffix = name.rpartition(".")
+        self.fingerprinted = f"{stem}.{self.digest[:10]}.{suffix}" if dot else f"{name}.{self.digest[:10]}"
+        self.variants: Dict[str, bytes] = {"identity": body}
+
+        if Path(name).suffix in COMPRESSIBLE_SUFFIXES and len(body) >= MIN_COMPRESS_SIZE:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.variants["br"] = br
+
+
+def accepted_encodings(header: Optional[str]) -> set:
+    """解析 Accept-Encoding，忽略 q=0 的编码"""
+    encodings = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        encodings.add(token)
+    return encodings
+
+
+def asset_response(asset: Asset, request: Request, cache_control: str) -> Response:
+    """选择编码并处理 ETag / 304"""
+    accepted = accepted_encodings(request.headers.get("accept-encoding"))
+    encoding = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in asset.variants and (candidate in accepted or "*" in accepted):
+            encoding = candidate
+            break
+
+    headers = {
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    etag = asset.etag if encoding == "identity" else f'"{asset.digest[:16]}-{encoding}"'
+    headers["ETag"] = etag
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+
+class StaticAssets:
+    """替代 StaticFiles 的 ASGI 应用：挂载在 /static 下"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.assets: Dict[str, Asset] = {}
+        self.by_fingerprint: Dict[str, Asset] = {}
+        self.index: Optional[Asset] = None
+
+    def ensure_built(self):
+        """未在启动阶段构建时，首次请求时构建"""
+        if self.index is None:
+            self.build()
+
+    def build(self):
+        """读取目录中的所有文件，生成哈希文件名和压缩版本，并改写 index.html 中的引用"""
+        assets = {}
+        for path in sorted(self.directory.iterdir()):
+            if path.is_file() and not path.name.startswith(".") and path.name != "index.html":
+                assets[path.name] = Asset(path.name, path.read_bytes())
+
+        html = (self.directory / "index.html").read_text(encoding="utf-8")
+
+        def rewrite(match):
+            asset = assets.get(match.group(1))
+            return f"static/{asset.fingerprinted}" if asset else match.group(0)
+
+        self.assets = assets
+        self.by_fingerprint = {asset.fingerprinted: asset for asset in assets.values()}
+        self.index = Asset("index.html", STATIC_REF_RE.sub(rewrite, html).encode("utf-8"))
+
+    def index_response(self, request: Request) -> Response:
+        """返回改写后的 index.html"""
+        self.ensure_built()
+        return asset_response(self.index, request, REVALIDATE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.ensure_built()
+        request = Request(scope, receive)
+        # static 目录是扁平的，只取最后一段（兼容 root_path 前缀）
+        name = scope["path"].rsplit("/", 1)[-1]
+        if request.method not in ("GET", "HEAD"):
+            response = Response("Method Not Allowed", status_code=405)
+        elif name in self.by_fingerprint:
+            response = asset_response(self.by_fingerprint[name], request, IMMUTABLE)
+        elif name in self.assets:
+            response = asset_response(self.assets[name], request, REVALIDATE)
+        elif name == "index.html":
+            response = self.index_response(request)
+        else:
+            response = Response("Not Found", status_code=404)
+        await response(scope, receive, send)
@@ -0,0 +1,73 @@
+"""
+流式分块合并模块 - 把上游逐 token 的 text 事件合并后按时间窗口或字数阈值发出，首个 token 立即发出
+"""
+import asyncio
+from typing import AsyncIterator
+
+
+def _is_text(event: dict) -> bool:
+    """只合并纯文本增量；带 flagged / error 等字段的事件原样透传"""
+    return len(event) == 1 and isinstance(event.get("text"), str)
+
+
+async def coalesce_text(events: AsyncIterator[dict], window_ms: float,
+                        max_chars: int = 256) -> AsyncIterator[dict]:
+    """合并相邻的 {"text": ...} 事件
+
+    - 第一个文本事件立即发出（不影响首字延迟）
+    - 之后的文本累积到 window_ms 毫秒或 max_chars 个字符时发出
+    - 其它事件发出前先冲刷已累积的文本，保证顺序不变
+    window_ms <= 0 时原样透传
+    """
+    if window_ms <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    iterator = events.__aiter__()
+    pending = None
+    buffer = []
+    size = 0
+    deadline = None
+    first = True
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 时间窗口到期，上游还没有新数据
+                yield {"text": "".join(buffer)}
+                buffer, size = [], 0
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            if not _is_text(event):
+                if buffer:
+                    yield {"text": "".join(buffer)}
+                    buffer, size = [], 0
+                yield event
+            elif first:
+                first = False
+                yield event
+            else:
+                if not buffer:
+                    deadline = loop.time() + window
+                buffer.append(event["text"])
+                size += len(event["text"])
+                if size >= max_chars:
+                    yield {"text": "".join(buffer)}
+                    buffer, size = [], 0
+        if buffer:
+            yield {"text": "".join(buffer)}
+    finally:
+        if pending is not None:
+            pending.cancel()
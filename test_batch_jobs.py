@@ -0,0 +1,81 @@
+"""
+批量任务测试 - 请求体大小上限（Content-Length 与分块传输）、JSONL 解析、按偏移量续传结果
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from batch_jobs import BatchItemError, BatchJobStore, parse_jsonl, read_request_body
+
+LIMIT = 1024
+
+
+async def upload(request):
+    try:
+        body = await read_request_body(request, LIMIT)
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+    return JSONResponse({"size": len(body)})
+
+
+client = TestClient(Starlette(routes=[Route("/upload", upload, methods=["POST"])]))
+
+
+def test_body_within_limit_is_read():
+    assert client.post("/upload", content=b"x" * LIMIT).json() == {"size": LIMIT}
+
+
+def test_declared_length_over_limit_is_rejected():
+    assert client.post("/upload", content=b"x" * (LIMIT + 1)).status_code == 413
+
+
+def test_chunked_body_over_limit_is_rejected():
+    def chunks():
+        for _ in range(8):
+            yield b"x" * 256
+
+    response = client.post("/upload", content=chunks())
+    assert response.status_code == 413
+
+
+def test_parse_jsonl_keeps_index_of_invalid_lines():
+    items = parse_jsonl(b'{"a": 1}\n\nnot json\n{"b": 2}\n', max_items=10)
+    assert items[0] == {"a": 1}
+    assert isinstance(items[1], BatchItemError)
+    assert items[2] == {"b": 2}
+    with pytest.raises(HTTPException) as error:
+        parse_jsonl(b"{}\n{}\n{}\n", max_items=2)
+    assert error.value.status_code == 413
+
+
+def collect(job, offset):
+    async def main():
+        return [json.loads(line) async for line in job.follow(offset)]
+    return main()
+
+
+def test_resume_from_offset_returns_only_remaining_results():
+    async def scenario():
+        store = BatchJobStore()
+        job = store.create(1, [{"n": i} for i in range(5)])
+        job.start(lambda item: item["n"] * 10, concurrency=2)
+        full = await collect(job, 0)
+        resumed = await collect(store.get(job.id, 1), 3)
+        with pytest.raises(HTTPException) as other_owner:
+            store.get(job.id, 2)
+        return full, resumed, other_owner.value
+
+    full, resumed, other_owner = asyncio.run(scenario())
+    results = [line for line in full if "index" in line]
+    assert sorted(r["result"] for r in results) == [0, 10, 20, 30, 40]
+    assert full[-1]["done"] and full[-1]["completed"] == 5
+    # 续传只返回偏移量之后的结果，顺序与首次输出一致
+    assert resumed[0] == {"job_id": full[0]["job_id"], "total": 5, "offset": 3}
+    assert [line for line in resumed if "index" in line] == results[3:]
+    assert other_owner.status_code == 404
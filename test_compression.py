@@ -0,0 +1,84 @@
+"""
+响应压缩测试 - SSE 每个事件压缩后立即可解出、小响应不压缩，缓存的 JSON 使用弱 ETag 并声明 Vary
+"""
+import asyncio
+import zlib
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import CompressionMiddleware
+from config import CachedJSON
+
+EVENTS = [b'data: {"text": "first"}\n\n', b'data: {"text": "second"}\n\n', b'data: [DONE]\n\n']
+
+
+async def sse_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream")]})
+    for i, event in enumerate(EVENTS):
+        await send({"type": "http.response.body", "body": event, "more_body": i < len(EVENTS) - 1})
+
+
+def test_sse_events_are_flushed_one_by_one():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(sse_app)(scope, receive, send))
+
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    # 每条消息发出后，客户端已能解出对应的事件，不需要等后续数据
+    decoder = zlib.decompressobj(31)
+    bodies = [message["body"] for message in sent[1:]]
+    assert [decoder.decompress(body) for body in bodies] == EVENTS
+    assert decoder.eof
+
+
+cached = CachedJSON({"message": "x" * 2048})
+
+
+async def cached_endpoint(request):
+    return cached.response(request)
+
+
+def make_client():
+    app = Starlette(routes=[Route("/cached", cached_endpoint)])
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_cached_json_uses_weak_etag_and_vary():
+    client = make_client()
+    plain = client.get("/cached", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/cached", headers={"Accept-Encoding": "gzip"})
+    assert plain.headers["etag"].startswith('W/"')
+    assert plain.headers["etag"] == compressed.headers["etag"]
+    assert compressed.headers["content-encoding"] == "gzip"
+    for response in (plain, compressed):
+        assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_cached_json_revalidates_weakly():
+    client = make_client()
+    etag = cached.etag
+    for tag in (etag, etag[2:], f'"other", {etag}'):
+        response = client.get("/cached", headers={"If-None-Match": tag})
+        assert response.status_code == 304
+    assert client.get("/cached", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_small_response_is_not_compressed():
+    app = Starlette(routes=[Route("/small", lambda request: CachedJSON({"ok": True}).response(request))])
+    app.add_middleware(CompressionMiddleware)
+    response = TestClient(app).get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"ok": True}
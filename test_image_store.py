@@ -0,0 +1,122 @@
+"""
+图片存储测试 - Range / ETag / 304、LRU 淘汰，以及只下载公网 http(s) 地址和图片类型
+"""
+import base64
+import os
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from image_store import ImageStore, is_public_url, serve_image
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+def data_url(payload: bytes, content_type: str = "image/png") -> str:
+    return f"data:{content_type};base64,{base64.b64encode(payload).decode()}"
+
+
+@pytest.fixture
+def store(tmp_path):
+    image_store = ImageStore(str(tmp_path), max_bytes=10 * 1024 * 1024, max_file_bytes=1024 * 1024)
+    yield image_store
+    image_store._executor.shutdown(wait=True)
+
+
+def make_client(image_store):
+    async def image(request):
+        return await serve_image(image_store, request.path_params["key"], request)
+    return TestClient(Starlette(routes=[Route("/images/{key}", image)]))
+
+
+def test_full_response_etag_and_revalidation(store):
+    key = store.submit(data_url(PNG))
+    client = make_client(store)
+    response = client.get(f"/images/{key}")
+    assert response.status_code == 200
+    assert response.content == PNG
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert client.get(f"/images/{key}", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_range_requests(store):
+    key = store.submit(data_url(PNG))
+    client = make_client(store)
+    size = len(PNG)
+
+    head = client.get(f"/images/{key}", headers={"Range": "bytes=0-9"})
+    assert head.status_code == 206
+    assert head.content == PNG[:10]
+    assert head.headers["content-range"] == f"bytes 0-9/{size}"
+
+    tail = client.get(f"/images/{key}", headers={"Range": "bytes=-16"})
+    assert tail.content == PNG[-16:]
+    assert tail.headers["content-range"] == f"bytes {size - 16}-{size - 1}/{size}"
+
+    # 结束位置超出文件大小时截断到末尾
+    assert client.get(f"/images/{key}", headers={"Range": f"bytes=100-{size * 2}"}).content == PNG[100:]
+
+    for bad in (f"bytes={size}-", "bytes=-", "items=0-1"):
+        response = client.get(f"/images/{key}", headers={"Range": bad})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{size}"
+
+
+def test_least_recently_used_blob_is_evicted(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=2 * len(PNG) + 10, max_file_bytes=1024 * 1024)
+    images = [PNG + bytes([i]) for i in range(3)]
+    keys = []
+    for payload in images[:2]:
+        keys.append(store.submit(data_url(payload)))
+        store.flush(5)
+    client = make_client(store)
+    # 访问第一张，使第二张成为最久未访问的
+    assert client.get(f"/images/{keys[0]}").status_code == 200
+    keys.append(store.submit(data_url(images[2])))
+    store.flush(5)
+
+    assert client.get(f"/images/{keys[1]}").status_code == 404
+    assert client.get(f"/images/{keys[0]}").content == images[0]
+    assert client.get(f"/images/{keys[2]}").content == images[2]
+    assert len(os.listdir(tmp_path / "blobs")) == 2
+    store._executor.shutdown(wait=True)
+
+
+def test_non_image_data_url_is_not_stored(store):
+    key = store.submit(data_url(b"<script>alert(1)</script>", "text/html"))
+    store.flush(5)
+    # data: 源地址不保留，不会被重定向
+    assert make_client(store).get(f"/images/{key}", follow_redirects=False).status_code == 404
+    assert os.listdir(store.blob_dir) == []
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/image.png",
+    "http://localhost:8000/image.png",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.1/image.png",
+    "http://[::1]/image.png",
+    "http://0x7f000001/image.png",
+    "file:///etc/passwd",
+    "ftp://example.com/image.png",
+])
+def test_internal_or_non_http_urls_are_not_fetched(url):
+    assert not is_public_url(url)
+
+
+def test_private_source_download_fails_without_request(store, monkeypatch):
+    import requests
+
+    def fail(*args, **kwargs):
+        raise AssertionError("must not fetch internal address")
+
+    monkeypatch.setattr(requests, "get", fail)
+    key = store.submit("http://127.0.0.1:9/image.png")
+    store.flush(5)
+    name, source = store._keys.get(key), store._failed.get(key)
+    assert name is None
+    assert source == "http://127.0.0.1:9/image.png"
@@ -0,0 +1,132 @@
+"""
+自定义 Key 校验测试 - 只有 401 判定无效，403 只让缓存过期；并发请求只探测一次；客户端报告
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from fastapi import HTTPException
+
+from key_validator import INVALID, UNVERIFIED, VALID, KeyValidator, models_url
+
+ENDPOINT = "https://api.example.com/v1/chat/completions"
+
+
+class ProbeStub:
+    """替代 requests.get：返回固定状态码并记录调用次数"""
+
+    def __init__(self, status_code: int, delay: float = 0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, url, headers=None, timeout=None):
+        with self._lock:
+            self.calls.append(url)
+        time.sleep(self.delay)
+        stub = self
+
+        class Response:
+            status_code = stub.status_code
+
+            def close(self):
+                pass
+
+        return Response()
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    def install(status_code: int, delay: float = 0.0) -> ProbeStub:
+        stub = ProbeStub(status_code, delay)
+        monkeypatch.setattr(requests, "get", stub)
+        return stub
+    return install
+
+
+def test_models_url_is_derived_from_endpoint():
+    assert models_url(ENDPOINT) == "https://api.example.com/v1/models"
+    assert models_url("https://api.example.com/v1") == "https://api.example.com/v1/models"
+    assert models_url("https://api.example.com/custom") is None
+
+
+@pytest.mark.parametrize("status_code, expected", [(200, VALID), (401, INVALID), (403, UNVERIFIED), (500, UNVERIFIED)])
+def test_only_401_marks_key_invalid(probe, status_code, expected):
+    probe(status_code)
+    validator = KeyValidator()
+    assert validator.validate(ENDPOINT, "sk-test") == expected
+    if expected == INVALID:
+        with pytest.raises(HTTPException) as error:
+            validator.ensure_valid(ENDPOINT, "sk-test")
+        assert error.value.status_code == 400
+    else:
+        validator.ensure_valid(ENDPOINT, "sk-test")
+
+
+def test_result_is_cached_per_key(probe):
+    stub = probe(200)
+    validator = KeyValidator()
+    for _ in range(3):
+        assert validator.validate(ENDPOINT, "sk-a") == VALID
+    assert validator.validate(ENDPOINT, "sk-b") == VALID
+    assert len(stub.calls) == 2
+    assert validator.lookup(ENDPOINT, "sk-a") == VALID
+
+
+def test_concurrent_validation_probes_once(probe):
+    stub = probe(200, delay=0.2)
+    validator = KeyValidator()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: validator.validate(ENDPOINT, "sk-test"), range(8)))
+    assert results == [VALID] * 8
+    assert len(stub.calls) == 1
+
+
+def test_upstream_401_invalidates_a_valid_key(probe):
+    probe(200)
+    validator = KeyValidator()
+    validator.validate(ENDPOINT, "sk-test")
+    validator.observe(ENDPOINT, "sk-test", 0.5, 401)
+    assert validator.lookup(ENDPOINT, "sk-test") == INVALID
+
+
+def test_upstream_403_only_expires_the_cached_verdict(probe):
+    stub = probe(200)
+    validator = KeyValidator()
+    validator.validate(ENDPOINT, "sk-test")
+    validator.observe(ENDPOINT, "sk-test", 0.5, 403)
+    # 不判定为无效，下次请求重新探测
+    assert validator.lookup(ENDPOINT, "sk-test") is None
+    assert validator.validate(ENDPOINT, "sk-test") == VALID
+    assert len(stub.calls) == 2
+
+
+def test_unreachable_endpoint_does_not_block(monkeypatch):
+    def fail(*args, **kwargs):
+        raise requests.ConnectionError("refused")
+
+    monkeypatch.setattr(requests, "get", fail)
+    validator = KeyValidator()
+    assert validator.validate(ENDPOINT, "sk-test") == UNVERIFIED
+    validator.ensure_valid(ENDPOINT, "sk-test")
+
+
+def test_client_report_warns_about_rejected_or_slow_keys(probe):
+    probe(401)
+    validator = KeyValidator(slow_threshold=1.0)
+    validator.validate(ENDPOINT, "sk-bad", client="user:1")
+    report = validator.client_report("user:1")
+    assert report["status"] == INVALID
+    assert "api.example.com" in report["warning"]
+
+    probe(200)
+    validator.validate(ENDPOINT, "sk-good", client="user:2")
+    for elapsed in (2.0, 3.0, 0.5):
+        validator.observe(ENDPOINT, "sk-good", elapsed)
+    report = validator.client_report("user:2")
+    assert report["median_latency_ms"] == 2000
+    assert report["slow"] is True
+    assert validator.client_report("user:3") is None
@@ -0,0 +1,71 @@
+"""
+提示词注册表测试 - 按 id 取最新版本、按 id@version 固定版本、重复版本报错，以及用量统计
+"""
+import pytest
+from fastapi import HTTPException
+
+from prompt_registry import PREFIX_CACHE_MIN_TOKENS, PromptEntry, PromptRegistry, PromptUsage, estimate_tokens
+
+
+def entry(version: int, content: str = "You are kind.", **kwargs) -> PromptEntry:
+    return PromptEntry(id="coach", version=version, name="Coach", content=content, **kwargs)
+
+
+def test_plain_id_resolves_to_latest_version():
+    registry = PromptRegistry([entry(2, "v2"), entry(1, "v1"), entry(3, "v3")])
+    assert registry.resolve("coach").content == "v3"
+    assert registry.resolve("coach@1").content == "v1"
+    assert registry.resolve("coach@2").key == "coach@2"
+
+
+def test_unknown_prompt_or_version_is_rejected():
+    registry = PromptRegistry([entry(1)])
+    for prompt_id in ("missing", "coach@2"):
+        with pytest.raises(HTTPException) as error:
+            registry.resolve(prompt_id)
+        assert error.value.status_code == 400
+
+
+def test_duplicate_version_is_rejected():
+    with pytest.raises(ValueError):
+        PromptRegistry([entry(1, "a"), entry(1, "b")])
+
+
+def test_invalid_id_is_rejected():
+    with pytest.raises(ValueError):
+        PromptEntry(id="bad id", name="x", content="x")
+
+
+def test_system_message_is_prebuilt_and_stable():
+    plain = entry(1)
+    assert plain.message == {"role": "system", "content": "You are kind."}
+    assert plain.message is plain.message
+    marked = entry(2, cache_control=True)
+    assert marked.message["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_listing_reports_versions_tokens_and_cacheability():
+    long_prompt = "x" * (PREFIX_CACHE_MIN_TOKENS * 4)
+    registry = PromptRegistry([entry(2, long_prompt), entry(1)])
+    listing = registry.listing()
+    assert [(item["id"], item["version"]) for item in listing] == [("coach", 1), ("coach", 2)]
+    assert listing[0]["prefix_cacheable"] is False
+    assert listing[1]["prefix_cacheable"] is True
+    assert listing[1]["tokens"] == PREFIX_CACHE_MIN_TOKENS
+
+
+def test_token_estimate_counts_cjk_per_character():
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("你好abcd") == 3
+
+
+def test_usage_is_tracked_per_version():
+    usage = PromptUsage()
+    usage.record("coach@1", {"prompt_tokens": 100, "completion_tokens": 20,
+                             "prompt_tokens_details": {"cached_tokens": 64}})
+    usage.record("coach@1", None)
+    usage.record("coach@2", {"prompt_tokens": 5})
+    snapshot = usage.snapshot()
+    assert snapshot["coach@1"] == {"requests": 2, "prompt_tokens": 100, "completion_tokens": 20, "cached_tokens": 64}
+    assert snapshot["coach@2"]["requests"] == 1
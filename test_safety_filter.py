@@ -0,0 +1,57 @@
+"""
+安全预过滤测试 - 跨分块的关键词匹配、保留文本的放行，以及智能体回答命中时不截断
+"""
+from safety_filter import DEFAULT_PHRASES, SafetyFilter
+
+
+def make_scanner():
+    return SafetyFilter(DEFAULT_PHRASES, "help").scanner()
+
+
+def test_match_split_across_chunks():
+    scanner = make_scanner()
+    emitted = []
+    for chunk in ["If you think about sui", "ci", "de, please call help."]:
+        text, matches = scanner.push(chunk)
+        emitted.append((text, matches))
+    # 关键词的前缀先保留，完整关键词出现在报告匹配的那一块里
+    assert emitted[0] == ("If you think about ", [])
+    assert emitted[1] == ("", [])
+    assert emitted[2][1] == ["suicide"]
+    assert emitted[2][0].startswith("suicide")
+    assert "".join(text for text, _ in emitted) + scanner.flush() == "If you think about suicide, please call help."
+
+
+def test_pending_prefix_is_flushed_at_end():
+    scanner = make_scanner()
+    text, matches = scanner.push("I will kill my")
+    assert matches == []
+    assert text == "I will "
+    assert scanner.pending == "kill my"
+    assert scanner.flush() == "kill my"
+    assert scanner.pending == ""
+
+
+def test_non_matching_prefix_is_released_with_next_chunk():
+    scanner = make_scanner()
+    assert scanner.push("sui") == ("", [])
+    assert scanner.push("ts me.") == ("suits me.", [])
+
+
+def test_matching_output_is_never_dropped():
+    scanner = make_scanner()
+    reply = "Hello, if you think about suicide please call help."
+    out = []
+    for i in range(0, len(reply), 5):
+        text, _ = scanner.push(reply[i:i + 5])
+        out.append(text)
+    out.append(scanner.flush())
+    assert "".join(out) == reply
+    assert scanner.matches == ["suicide"]
+
+
+def test_chinese_phrases_match_case_insensitively():
+    safety = SafetyFilter(DEFAULT_PHRASES, "help")
+    assert safety.check("我最近总是想死") == ["想死"]
+    assert safety.check("I want to DIE") == ["want to die"]
+    assert safety.check("今天天气不错") == []
@@ -0,0 +1,69 @@
+"""
+语义缓存测试 - 相似提问命中、按用户 / 模型 / 系统提示词隔离、LSH 预筛与容量淘汰
+"""
+import pytest
+
+from semantic_cache import SemanticCache, _load_numpy, cache_namespace
+
+# numpy 由 get_semantic_cache 延迟导入，直接构造缓存前先加载
+if not _load_numpy():
+    pytest.skip("numpy not installed", allow_module_level=True)
+
+QUESTION = "How can I sleep better when I feel anxious at night?"
+SIMILAR = "how can i sleep better when i feel anxious at night"
+ANSWER = {"message": {"role": "assistant", "content": "Try a wind-down routine."}}
+
+
+def namespace(tenant: str, model: str = "qwen-plus", system_prompt: str = "", temperature=None) -> str:
+    return cache_namespace(tenant, "https://api.example.com/v1", model, system_prompt, temperature)
+
+
+def test_similar_prompt_hits_and_unrelated_misses():
+    cache = SemanticCache(capacity=16)
+    cache.store(namespace("user:1"), QUESTION, ANSWER)
+    assert cache.lookup(namespace("user:1"), SIMILAR) == ANSWER
+    assert cache.lookup(namespace("user:1"), "What is the capital of France?") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.parametrize("other", [
+    namespace("user:2"),
+    namespace("ip:203.0.113.7"),
+    namespace("user:1", model="qwen-max"),
+    namespace("user:1", system_prompt="You are a pirate."),
+    namespace("user:1", temperature=0.2),
+])
+def test_answers_are_not_shared_across_tenants_or_settings(other):
+    cache = SemanticCache(capacity=16)
+    cache.store(namespace("user:1"), QUESTION, ANSWER)
+    assert cache.lookup(other, QUESTION) is None
+    assert cache.lookup(namespace("user:1"), QUESTION) == ANSWER
+
+
+def test_same_prompt_from_two_tenants_keeps_both_answers():
+    cache = SemanticCache(capacity=16)
+    cache.store(namespace("user:1"), QUESTION, {"answer": 1})
+    cache.store(namespace("user:2"), QUESTION, {"answer": 2})
+    assert cache.lookup(namespace("user:1"), QUESTION) == {"answer": 1}
+    assert cache.lookup(namespace("user:2"), QUESTION) == {"answer": 2}
+
+
+def test_lsh_index_finds_similar_prompt():
+    cache = SemanticCache(capacity=64, brute_force_limit=0)
+    for i in range(32):
+        cache.store(namespace("user:1"), f"unrelated question number {i} about topic {i * 7}", {"i": i})
+    cache.store(namespace("user:1"), QUESTION, ANSWER)
+    assert cache.stats()["index"] == "lsh"
+    assert cache.lookup(namespace("user:1"), SIMILAR) == ANSWER
+
+
+def test_full_cache_evicts_least_recently_used():
+    cache = SemanticCache(capacity=2)
+    cache.store(namespace("user:1"), "first question about sleep", {"n": 1})
+    cache.store(namespace("user:1"), "second question about work stress", {"n": 2})
+    assert cache.lookup(namespace("user:1"), "first question about sleep") == {"n": 1}
+    cache.store(namespace("user:1"), "third question about family", {"n": 3})
+    assert cache.lookup(namespace("user:1"), "second question about work stress") is None
+    assert cache.lookup(namespace("user:1"), "first question about sleep") == {"n": 1}
+    assert cache.lookup(namespace("user:1"), "third question about family") == {"n": 3}
@@ -0,0 +1,79 @@
+"""
+优雅停机测试 - 长时间的模拟流进行中触发排空（等同收到 SIGTERM），流以重试事件结束，停机时保存当日用量
+"""
+import asyncio
+import json
+import threading
+import time
+from datetime import date
+
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import main
+from shutdown import SSE_TERMINAL
+
+
+async def slow_stream():
+    """先输出一帧，之后长时间没有数据（模拟上游卡住的长回答）"""
+    yield b'data: {"text": "first"}\n\n'
+    await asyncio.sleep(3600)
+    yield b'data: {"text": "never"}\n\n'
+
+
+@main.app.get("/test/slow-stream")
+async def slow_stream_endpoint():
+    return StreamingResponse(main.graceful_shutdown.guard(slow_stream()), media_type="text/event-stream")
+
+
+def test_drain_aborts_stream_and_saves_usage(tmp_path, monkeypatch):
+    # 数据库与用量文件都写到临时目录
+    monkeypatch.chdir(tmp_path)
+    shutdown = main.graceful_shutdown
+    monkeypatch.setattr(shutdown, "drain_timeout", 0.5)
+    monkeypatch.setattr(shutdown, "abort_grace", 1.0)
+    main.ip_usage.clear()
+
+    try:
+        with TestClient(main.app) as client:
+            main.increment_ip_usage("203.0.113.7", False)
+            result = {}
+
+            def consume():
+                response = client.get("/test/slow-stream")
+                result["status"] = response.status_code
+                result["body"] = response.content
+
+            consumer = threading.Thread(target=consume)
+            consumer.start()
+            deadline = time.monotonic() + 5
+            while main.in_flight.count == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert main.in_flight.count == 1
+
+            # 相当于 SIGTERM 的处理：排空（不向测试进程发送 SIGINT）
+            started = time.monotonic()
+            client.portal.call(shutdown.drain)
+            consumer.join(timeout=5)
+            assert not consumer.is_alive()
+            assert time.monotonic() - started < 3
+
+            assert result["status"] == 200
+            assert result["body"].startswith(b'data: {"text": "first"}\n\n')
+            assert result["body"].endswith(b"".join(SSE_TERMINAL))
+            assert b"never" not in result["body"]
+
+            # 排空期间新请求直接 503，探针照常响应
+            rejected = client.get("/api/config")
+            assert rejected.status_code == 503
+            assert rejected.headers["retry-after"] == "1"
+            assert client.get("/healthz").status_code == 200
+            assert client.get("/readyz").status_code == 503
+
+        # lifespan 关闭时写入当日用量
+        state = json.loads((tmp_path / "usage_state.json").read_text(encoding="utf-8"))
+        assert state == {"date": date.today().isoformat(), "usage": {"203.0.113.7": 1}}
+    finally:
+        shutdown.draining = False
+        shutdown._expired.clear()
+        main.ip_usage.clear()
@@ -0,0 +1,122 @@
+"""
+上游响应读取测试 - 大小上限、base64 字段边读边解码写入临时文件（任意分块边界、转义、路径转义），出错时清理
+"""
+import base64
+import json
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from upstream_body import SPILL_PREFIX, error_message, iter_body, read_body, read_json_spilling
+
+IMAGE = bytes(range(256)) * 40
+
+
+class FakeResponse:
+    """模拟 requests 的流式响应：按给定大小切块"""
+
+    def __init__(self, body: bytes, chunk: int = 64 * 1024, headers=None):
+        self.body = body
+        self.chunk = chunk
+        self.headers = headers or {}
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.body), self.chunk):
+            self.read += len(self.body[i:i + self.chunk])
+            yield self.body[i:i + self.chunk]
+
+    def close(self):
+        self.closed = True
+
+
+def image_json(b64: str) -> bytes:
+    return json.dumps({"created": 1, "data": [{"b64_json": b64, "revised_prompt": "a cat"}]}).encode()
+
+
+def test_body_within_limit():
+    assert read_body(FakeResponse(b"x" * 100, chunk=7), 100) == b"x" * 100
+
+
+def test_declared_length_over_limit_is_not_read():
+    resp = FakeResponse(b"x" * 100, headers={"Content-Length": "100"})
+    with pytest.raises(HTTPException) as error:
+        list(iter_body(resp, 99))
+    assert error.value.status_code == 502
+    assert resp.read == 0
+    assert resp.closed
+
+
+def test_streamed_body_over_limit_stops_reading():
+    resp = FakeResponse(b"x" * 1000, chunk=10)
+    with pytest.raises(HTTPException):
+        read_body(resp, 95)
+    assert resp.read == 100
+    assert resp.closed
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 7, 64, 4096])
+def test_base64_field_is_spilled_at_any_chunk_boundary(tmp_path, chunk):
+    # JSON 编码器可能把 / 转义为 \/
+    b64 = base64.b64encode(IMAGE).decode().replace("/", "\\/")
+    body = image_json(b64).replace(b"\\\\/", b"\\/")
+    data = read_json_spilling(FakeResponse(body, chunk), 1024, str(tmp_path), len(IMAGE))
+
+    item = data["data"][0]
+    assert item["revised_prompt"] == "a cat"
+    assert item["b64_json"].startswith(SPILL_PREFIX)
+    path = item["b64_json"][len(SPILL_PREFIX):]
+    with open(path, "rb") as f:
+        assert f.read() == IMAGE
+
+
+def test_spill_path_is_json_escaped(tmp_path):
+    spill_dir = tmp_path / 'quote"and\\backslash'
+    spill_dir.mkdir()
+    body = image_json(base64.b64encode(IMAGE).decode())
+    data = read_json_spilling(FakeResponse(body, 100), 1024, str(spill_dir), len(IMAGE))
+    path = data["data"][0]["b64_json"][len(SPILL_PREFIX):]
+    assert os.path.dirname(path) == str(spill_dir)
+    assert os.path.exists(path)
+
+
+def test_spilled_bytes_do_not_count_toward_json_limit(tmp_path):
+    body = image_json(base64.b64encode(IMAGE).decode())
+    assert len(body) > 4 * 1024
+    data = read_json_spilling(FakeResponse(body, 512), 1024, str(tmp_path), len(IMAGE))
+    assert data["created"] == 1
+
+
+def test_oversized_image_is_rejected_and_cleaned_up(tmp_path):
+    body = image_json(base64.b64encode(IMAGE).decode())
+    resp = FakeResponse(body, 512)
+    with pytest.raises(HTTPException) as error:
+        read_json_spilling(resp, 1024, str(tmp_path), len(IMAGE) - 1)
+    assert error.value.status_code == 502
+    assert resp.closed
+    assert os.listdir(tmp_path) == []
+
+
+def test_oversized_json_is_rejected_and_cleaned_up(tmp_path):
+    body = json.dumps({"data": [{"b64_json": "AAAA"}], "padding": "x" * 5000}).encode()
+    with pytest.raises(HTTPException):
+        read_json_spilling(FakeResponse(body, 512), 1024, str(tmp_path), 1024)
+    assert os.listdir(tmp_path) == []
+
+
+def test_truncated_base64_field_is_cleaned_up(tmp_path):
+    body = image_json(base64.b64encode(IMAGE).decode())[:2000]
+    with pytest.raises(ValueError):
+        read_json_spilling(FakeResponse(body, 512), 1024, str(tmp_path), len(IMAGE))
+    assert os.listdir(tmp_path) == []
+
+
+def test_error_message_reads_only_the_excerpt():
+    body = json.dumps({"error": {"message": "Invalid API key"}}).encode()
+    assert error_message(FakeResponse(body)) == "Invalid API key"
+    resp = FakeResponse(b"<html>" + b"x" * 100000, chunk=4096)
+    assert len(error_message(resp)) == 4096
+    assert resp.read == 4096
+    assert resp.closed
@@ -0,0 +1,181 @@
+"""
+微信 OAuth 客户端测试 - 本地模拟 api.weixin.qq.com：授权码并发换取合并、不可重放、令牌刷新、用户信息缓存
+"""
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from fastapi import HTTPException
+
+from wechat_client import WeChatClient
+
+
+class StubWeChat:
+    """模拟微信接口：授权码只能换取一次，记录每个接口的调用次数"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.used_codes = set()
+        self.delay = 0.0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                stub.calls[parts.path] += 1
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+                body = json.dumps(stub.handle(parts.path, params)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, path: str, params: dict) -> dict:
+        if path == "/sns/oauth2/access_token":
+            code = params["code"]
+            if code in self.used_codes or code == "bad":
+                return {"errcode": 40163, "errmsg": "code been used"}
+            self.used_codes.add(code)
+            return {"access_token": f"at-{code}", "refresh_token": "rt", "openid": "openid-1", "expires_in": 7200}
+        if path == "/sns/oauth2/refresh_token":
+            if params["refresh_token"] != "rt":
+                return {"errcode": 42002, "errmsg": "refresh_token expired"}
+            return {"access_token": "at-refreshed", "refresh_token": "rt", "openid": "openid-1", "expires_in": 7200}
+        if path == "/sns/userinfo":
+            return {"openid": params["openid"], "nickname": f"user via {params['access_token']}"}
+        return {"errcode": 404, "errmsg": "not found"}
+
+
+@pytest.fixture
+def stub():
+    server = StubWeChat()
+    yield server
+    server.server.shutdown()
+
+
+def run(coro_fn, stub):
+    async def main():
+        client = WeChatClient("appid", "secret", base_url=stub.base_url)
+        try:
+            return await coro_fn(client)
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_concurrent_login_exchanges_code_once(stub):
+    stub.delay = 0.1
+
+    async def scenario(client):
+        return await asyncio.gather(*(client.login("code-1") for _ in range(5)))
+
+    results = run(scenario, stub)
+    assert all(info["nickname"] == "user via at-code-1" for info in results)
+    assert stub.calls["/sns/oauth2/access_token"] == 1
+    assert stub.calls["/sns/userinfo"] == 1
+
+
+def test_used_code_cannot_be_replayed(stub):
+    async def scenario(client):
+        await client.exchange_code("code-2")
+        with pytest.raises(HTTPException) as replay:
+            await client.exchange_code("code-2")
+        return replay.value
+
+    error = run(scenario, stub)
+    assert error.status_code == 400
+    # 重放在本地拒绝，不会再请求微信接口，也不会返回之前的令牌
+    assert stub.calls["/sns/oauth2/access_token"] == 1
+
+
+def test_failed_exchange_can_be_retried(stub):
+    async def scenario(client):
+        for _ in range(2):
+            with pytest.raises(HTTPException) as error:
+                await client.exchange_code("bad")
+            assert error.value.status_code == 400
+
+    run(scenario, stub)
+    assert stub.calls["/sns/oauth2/access_token"] == 2
+
+
+def test_expiring_token_is_refreshed_once(stub):
+    async def scenario(client):
+        token = await client.exchange_code("code-3")
+        token.expires_at = 0  # 已进入提前刷新窗口
+        return await asyncio.gather(*(client.get_access_token(token.openid) for _ in range(5)))
+
+    tokens = run(scenario, stub)
+    assert tokens == ["at-refreshed"] * 5
+    assert stub.calls["/sns/oauth2/refresh_token"] == 1
+
+
+def test_user_info_is_cached(stub):
+    async def scenario(client):
+        token = await client.exchange_code("code-4")
+        first = await client.get_user_info(token.openid)
+        second = await client.get_user_info(token.openid)
+        return first, second, client.stats
+
+    first, second, stats = run(scenario, stub)
+    assert first == second
+    assert stub.calls["/sns/userinfo"] == 1
+    assert stats["userinfo_hits"] == 1
+
+
+def test_import_does_not_load_httpx():
+    code = "import sys, wechat_client; sys.exit('httpx' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+def test_callback_route_signs_in_and_creates_user(stub, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from urllib.parse import parse_qs as parse_fragment
+
+    import main
+
+    monkeypatch.chdir(tmp_path)
+    settings = main.get_settings().model_copy(update={
+        "wechat_app_id": "appid", "wechat_app_secret": "secret", "wechat_api_base": stub.base_url,
+    })
+    main.app.dependency_overrides[main.get_settings] = lambda: settings
+    try:
+        with TestClient(main.app, base_url="http://chat.test") as client:
+            authorize = client.get("/api/auth/wechat/authorize", follow_redirects=False)
+            assert authorize.status_code == 302
+            state = parse_qs(urlsplit(authorize.headers["location"]).query)["state"][0]
+            assert "redirect_uri=http%3A%2F%2Fchat.test%2Fwechat-callback" in authorize.headers["location"]
+
+            # state 不匹配时不换取授权码
+            forged = client.get("/wechat-callback", params={"code": "code-5", "state": "forged"}, follow_redirects=False)
+            assert "wechat_error" in urlsplit(forged.headers["location"]).fragment
+            assert stub.calls["/sns/oauth2/access_token"] == 0
+
+            client.cookies.set("wechat_state", state)
+            callback = client.get("/wechat-callback", params={"code": "code-5", "state": state}, follow_redirects=False)
+            token = parse_fragment(urlsplit(callback.headers["location"]).fragment)["wechat_token"][0]
+            me = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"}).json()
+            assert me["username"] == "wechat_openid-1"
+            assert me["nickname"] == "user via at-code-5"
+
+            # 保留前缀不能通过普通注册抢占
+            register = client.post("/api/auth/register", json={"username": "wechat_x", "password": "secret123"})
+            assert register.status_code == 400
+    finally:
+        main.app.dependency_overrides.pop(main.get_settings, None)
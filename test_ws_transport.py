@@ -0,0 +1,103 @@
+"""
+WebSocket 多路复用测试 - 发送额度用完后等待 ack、取消流、二进制帧以 1003 关闭、并发流上限
+"""
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import WebSocketRoute
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from ws_transport import CLOSE_UNSUPPORTED_DATA, StreamMux, receive_auth
+
+
+async def count(payload):
+    for i in range(payload["n"]):
+        yield {"i": i}
+
+
+async def forever(payload):
+    i = 0
+    while True:
+        yield {"i": i}
+        i += 1
+        await asyncio.sleep(0.01)
+
+
+async def endpoint(websocket):
+    await websocket.accept()
+    if await receive_auth(websocket, timeout=5) is None:
+        return
+    await websocket.send_json({"type": "ready"})
+    await StreamMux(websocket, {"count": count, "forever": forever}, max_streams=2, window=2).run()
+
+
+client = TestClient(Starlette(routes=[WebSocketRoute("/ws", endpoint)]))
+
+
+def authenticate(session):
+    session.send_json({"type": "auth", "token": ""})
+    assert session.receive_json() == {"type": "ready"}
+
+
+def test_stream_waits_for_ack_when_window_is_used_up():
+    with client.websocket_connect("/ws") as session:
+        authenticate(session)
+        session.send_json({"type": "count", "id": "r1", "payload": {"n": 5}})
+        assert [session.receive_json()["data"] for _ in range(2)] == [{"i": 0}, {"i": 1}]
+        # 额度用完：流暂停，连接上的其它消息照常处理
+        session.send_json({"type": "ping"})
+        assert session.receive_json() == {"type": "pong"}
+        session.send_json({"type": "ack", "id": "r1", "n": 3})
+        assert [session.receive_json()["data"] for _ in range(3)] == [{"i": 2}, {"i": 3}, {"i": 4}]
+        assert session.receive_json() == {"type": "done", "id": "r1", "cancelled": False}
+
+
+def test_cancel_ends_stream_with_cancelled_done():
+    with client.websocket_connect("/ws") as session:
+        authenticate(session)
+        session.send_json({"type": "forever", "id": "r1", "payload": {}})
+        assert session.receive_json()["type"] == "event"
+        session.send_json({"type": "cancel", "id": "r1"})
+        while True:
+            message = session.receive_json()
+            if message["type"] == "done":
+                break
+        assert message == {"type": "done", "id": "r1", "cancelled": True}
+        # 取消后 id 可以复用
+        session.send_json({"type": "count", "id": "r1", "payload": {"n": 1}})
+        assert session.receive_json() == {"type": "event", "id": "r1", "data": {"i": 0}}
+
+
+def test_concurrent_stream_limit_and_duplicate_id():
+    with client.websocket_connect("/ws") as session:
+        authenticate(session)
+        session.send_json({"type": "forever", "id": "a", "payload": {}})
+        session.send_json({"type": "forever", "id": "a", "payload": {}})
+        session.send_json({"type": "forever", "id": "b", "payload": {}})
+        session.send_json({"type": "forever", "id": "c", "payload": {}})
+        errors = []
+        while len(errors) < 2:
+            message = session.receive_json()
+            if message["type"] == "error":
+                errors.append((message["id"], message["status"]))
+        assert errors == [("a", 409), ("c", 429)]
+
+
+def test_binary_frame_closes_with_1003():
+    with client.websocket_connect("/ws") as session:
+        authenticate(session)
+        session.send_bytes(b"\x00\x01")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                session.receive_json()
+        assert closed.value.code == CLOSE_UNSUPPORTED_DATA
+
+
+def test_binary_auth_frame_closes_with_1003():
+    with client.websocket_connect("/ws") as session:
+        session.send_bytes(b"token")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            session.receive_json()
+        assert closed.value.code == CLOSE_UNSUPPORTED_DATA
@@ -0,0 +1,183 @@
+"""
+上游响应读取模块 - 流式读取并限制响应大小，只解析一次；图片的 base64 字段边读边解码写入临时文件，不进入 Python 字符串
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Iterator, List, Optional
+
+from fastapi import HTTPException
+
+from fast_json import loads
+
+READ_CHUNK = 64 * 1024
+# 错误响应只读取开头这么多字节
+ERROR_EXCERPT_BYTES = 4096
+
+# 被写入文件的 base64 字段在 JSON 中替换为 "spill:<文件路径>"
+SPILL_PREFIX = "spill:"
+B64_FIELD = b'"b64_json"'
+
+
+def too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=502,
+        detail=f"Upstream response too large (> {limit // (1024 * 1024)} MB) / 上游响应过大"
+    )
+
+
+def iter_body(resp, max_bytes: int) -> Iterator[bytes]:
+    """逐块读取响应体，超过 max_bytes 时抛出 502（Content-Length 已超限时不读取）"""
+    length = resp.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        resp.close()
+        raise too_large(max_bytes)
+    total = 0
+    for chunk in resp.iter_content(chunk_size=READ_CHUNK):
+        total += len(chunk)
+        if total > max_bytes:
+            resp.close()
+            raise too_large(max_bytes)
+        yield chunk
+
+
+def read_body(resp, max_bytes: int) -> bytes:
+    return b"".join(iter_body(resp, max_bytes))
+
+
+def error_message(resp) -> str:
+    """错误响应的说明：只读取开头 ERROR_EXCERPT_BYTES 字节，优先取 JSON 中的 error.message / message"""
+    head = b""
+    try:
+        for chunk in resp.iter_content(chunk_size=ERROR_EXCERPT_BYTES):
+            head += chunk
+            if len(head) >= ERROR_EXCERPT_BYTES:
+                break
+    except Exception:
+        pass
+    finally:
+        resp.close()
+    try:
+        data = loads(head)
+        if isinstance(data, dict):
+            error = data.get("error")
+            message = error.get("message") if isinstance(error, dict) else error
+            message = message or data.get("message")
+            if isinstance(message, str) and message:
+                return message
+    except ValueError:
+        pass
+    return head[:ERROR_EXCERPT_BYTES].decode("utf-8", "replace")
+
+
+class Base64Spill:
+    """一个 base64 字段的解码输出：边解码边写入临时文件并计算 sha256"""
+
+    def __init__(self, spill_dir: Optional[str], max_bytes: int):
+        fd, self.path = tempfile.mkstemp(dir=spill_dir, prefix=".b64-")
+        self.file = os.fdopen(fd, "wb")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._carry = b""
+
+    def write(self, data: bytes):
+        # JSON 中 base64 只可能出现 "\/" 转义；末尾的反斜杠留到下一块处理
+        data = (self._carry + data).replace(b"\\/", b"/")
+        cut = len(data) - (1 if data.endswith(b"\\") else 0)
+        cut -= cut % 4
+        self._carry = data[cut:]
+        self._emit(base64.b64decode(data[:cut]))
+
+    def _emit(self, decoded: bytes):
+        self.size += len(decoded)
+        if self.size > self.max_bytes:
+            raise too_large(self.max_bytes)
+        self.digest.update(decoded)
+        self.file.write(decoded)
+
+    def close(self) -> str:
+        if self._carry:
+            self._emit(base64.b64decode(self._carry + b"=" * (-len(self._carry) % 4)))
+            self._carry = b""
+        self.file.close()
+        return self.path
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def read_json_spilling(resp, max_bytes: int, spill_dir: Optional[str], max_spill_bytes: int) -> Any:
+    """流式读取 JSON；"b64_json" 字段的值解码写入 spill_dir 下的文件，JSON 中替换为 "spill:<路径>"
+
+    max_bytes 限制其余 JSON 的大小，max_spill_bytes 限制单个解码后文件的大小；
+    出错时删除已写入的文件
+    """
+    kept: List[bytes] = []
+    kept_size = 0
+    spills: List[Base64Spill] = []
+    current: Optional[Base64Spill] = None
+    pending = b""  # 尚未确定是否包含字段名的尾部
+
+    def keep(data: bytes):
+        nonlocal kept_size
+        kept_size += len(data)
+        if kept_size > max_bytes:
+            raise too_large(max_bytes)
+        kept.append(data)
+
+    try:
+        for chunk in resp.iter_content(chunk_size=READ_CHUNK):
+            data = pending + chunk
+            pending = b""
+            while data:
+                if current is not None:
+                    end = data.find(b'"')
+                    if end < 0:
+                        current.write(data)
+                        data = b""
+                        break
+                    current.write(data[:end])
+                    # 路径可能含 \ 或 "，按 JSON 字符串内容转义（外层引号已在原文中）
+                    keep(json.dumps(f"{SPILL_PREFIX}{current.close()}")[1:-1].encode("utf-8"))
+                    current = None
+                    data = data[end:]
+                    continue
+
+                start = data.find(B64_FIELD)
+                if start < 0:
+                    # 保留可能被切断的字段名
+                    split = max(0, len(data) - len(B64_FIELD))
+                    keep(data[:split])
+                    pending = data[split:]
+                    break
+                # 字段名后面是 空白 : 空白 "，等凑齐后再进入字段值
+                after = start + len(B64_FIELD)
+                quote = data.find(b'"', after)
+                if quote < 0:
+                    keep(data[:start])
+                    pending = data[start:]
+                    break
+                if data[after:quote].strip() != b":":
+                    keep(data[:after])
+                    data = data[after:]
+                    continue
+                keep(data[:quote + 1])
+                current = Base64Spill(spill_dir, max_spill_bytes)
+                spills.append(current)
+                data = data[quote + 1:]
+        if current is not None:
+            raise ValueError("unterminated base64 field")
+        keep(pending)
+        return loads(b"".join(kept))
+    except Exception:
+        resp.close()
+        for spill in spills:
+            spill.discard()
+        raise
@@ -0,0 +1,235 @@
+"""
+微信 OAuth 客户端 - 异步连接池请求 api.weixin.qq.com，同一授权码的并发换取合并为一次且授权码只能使用一次，
+access_token 到期前用 refresh_token 刷新，用户信息按 openid 缓存
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+API_BASE = "https://api.weixin.qq.com"
+
+# access_token 剩余有效期少于该秒数时提前刷新
+REFRESH_MARGIN = 300
+# 授权码 5 分钟内有效且只能使用一次：已换取过的授权码记录同样时长，重复提交直接拒绝（不再返回令牌）
+CODE_TTL = 300
+# 内存中最多保留的 openid 数（令牌与用户信息各自独立淘汰）
+MAX_ENTRIES = 10000
+
+# refresh_token 失效（需重新授权）的错误码
+REAUTH_ERRCODES = {40030, 42002, 42007}
+
+
+class WeChatToken:
+    """一次授权得到的令牌（expires_at 为 time.monotonic() 时间）"""
+
+    def __init__(self, data: dict):
+        self.access_token: str = data["access_token"]
+        self.refresh_token: str = data.get("refresh_token", "")
+        self.openid: str = data["openid"]
+        self.unionid: Optional[str] = data.get("unionid")
+        self.scope: str = data.get("scope", "")
+        self.expires_at = time.monotonic() + int(data.get("expires_in", 7200))
+
+    def needs_refresh(self) -> bool:
+        return time.monotonic() >= self.expires_at - REFRESH_MARGIN
+
+
+class WeChatClient:
+    """微信网站应用 OAuth2 客户端（同一事件循环内共享）"""
+
+    def __init__(self, app_id: str, app_secret: str, base_url: str = API_BASE,
+                 timeout: float = 10.0, userinfo_ttl: float = 3600, max_connections: int = 20):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.base_url = base_url.rstrip("/")
+        self.userinfo_ttl = userinfo_ttl
+        import httpx  # 延迟导入（约 170 ms），只有启用微信登录时才需要
+
+        self._http_error = httpx.HTTPError
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._tokens: "OrderedDict[str, WeChatToken]" = OrderedDict()
+        self._userinfo: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        # 正在换取的授权码 -> 换取任务（并发重复提交共用一次换取）；已用过的授权码 -> 过期时间
+        self._exchanges: Dict[str, asyncio.Future] = {}
+        self._used_codes: Dict[str, float] = {}
+        # openid -> 正在进行的刷新 / 用户信息请求
+        self._refreshing: Dict[str, asyncio.Future] = {}
+        self._fetching: Dict[str, asyncio.Future] = {}
+        self.stats = {"exchanges": 0, "exchange_dedup": 0, "refreshes": 0, "userinfo_hits": 0, "userinfo_misses": 0}
+
+    async def _get(self, path: str, params: dict, action: str) -> dict:
+        """GET 微信接口；网络错误返回 502，errcode 返回 400（refresh_token 失效返回 401）"""
+        try:
+            resp = await self._client.get(path, params=params)
+            data = resp.json()
+        except (self._http_error, ValueError) as e:
+            raise HTTPException(
+                status_code=502,
+                detail=f"WeChat API request failed / 微信API请求失败: {str(e)}"
+            )
+        if data.get("errcode"):
+            status = 401 if data["errcode"] in REAUTH_ERRCODES else 400
+            raise HTTPException(
+                status_code=status,
+                detail=f"{action}: {data.get('errmsg', 'Unknown error')}"
+            )
+        return data
+
+    def _remember(self, token: WeChatToken):
+        self._tokens[token.openid] = token
+        self._tokens.move_to_end(token.openid)
+        while len(self._tokens) > MAX_ENTRIES:
+            self._tokens.popitem(last=False)
+
+    # ---- 授权码换取 ----
+
+    async def _exchange(self, code: str) -> WeChatToken:
+        self.stats["exchanges"] += 1
+        data = await self._get("/sns/oauth2/access_token", {
+            "appid": self.app_id,
+            "secret": self.app_secret,
+            "code": code,
+            "grant_type": "authorization_code"
+        }, "WeChat auth failed / 微信认证失败")
+        token = WeChatToken(data)
+        self._remember(token)
+        return token
+
+    async def exchange_code(self, code: str) -> WeChatToken:
+        """用授权码换取令牌；换取进行中的重复提交共用结果，换取成功后再次提交同一授权码返回 400"""
+        now = time.monotonic()
+        for key in [k for k, expires in self._used_codes.items() if expires < now]:
+            del self._used_codes[key]
+        if code in self._used_codes:
+            raise HTTPException(
+                status_code=400,
+                detail="Authorization code already used / 授权码已使用，请重新扫码"
+            )
+
+        future = self._exchanges.get(code)
+        if future is not None:
+            self.stats["exchange_dedup"] += 1
+        else:
+            future = asyncio.ensure_future(self._exchange(code))
+            self._exchanges[code] = future
+
+            def finished(f: asyncio.Future):
+                # 成功的结果不缓存，只记录授权码已使用；失败的换取允许用户重试
+                self._exchanges.pop(code, None)
+                if not f.cancelled() and f.exception() is None:
+                    self._used_codes[code] = time.monotonic() + CODE_TTL
+
+            future.add_done_callback(finished)
+        # shield：某个请求被取消时不影响共用同一换取的其它请求
+        return await asyncio.shield(future)
+
+    # ---- 令牌刷新 ----
+
+    async def _refresh(self, token: WeChatToken) -> WeChatToken:
+        self.stats["refreshes"] += 1
+        try:
+            data = await self._get("/sns/oauth2/refresh_token", {
+                "appid": self.app_id,
+                "grant_type": "refresh_token",
+                "refresh_token": token.refresh_token
+            }, "WeChat token refresh failed, please sign in again / 微信授权已过期，请重新登录")
+        except HTTPException as e:
+            if e.status_code == 401:
+                self._tokens.pop(token.openid, None)
+            raise
+        refreshed = WeChatToken(data)
+        self._remember(refreshed)
+        return refreshed
+
+    async def get_access_token(self, openid: str) -> str:
+        """返回有效的 access_token，临近过期时用 refresh_token 刷新（同一 openid 只刷新一次）"""
+        token = self._tokens.get(openid)
+        if token is None:
+            raise HTTPException(
+                status_code=401,
+                detail="WeChat authorization required / 需要微信授权"
+            )
+        if not token.needs_refresh():
+            return token.access_token
+
+        future = self._refreshing.get(openid)
+        if future is None:
+            future = asyncio.ensure_future(self._refresh(token))
+            self._refreshing[openid] = future
+            future.add_done_callback(lambda f: self._refreshing.pop(openid, None))
+        return (await asyncio.shield(future)).access_token
+
+    # ---- 用户信息 ----
+
+    async def _fetch_user_info(self, openid: str) -> dict:
+        self.stats["userinfo_misses"] += 1
+        access_token = await self.get_access_token(openid)
+        data = await self._get("/sns/userinfo", {
+            "access_token": access_token,
+            "openid": openid,
+            "lang": "zh_CN"
+        }, "Failed to get user info / 获取用户信息失败")
+        self._userinfo[openid] = (time.monotonic() + self.userinfo_ttl, data)
+        self._userinfo.move_to_end(openid)
+        while len(self._userinfo) > MAX_ENTRIES:
+            self._userinfo.popitem(last=False)
+        return data
+
+    async def get_user_info(self, openid: str, force: bool = False) -> dict:
+        """获取微信用户信息，按 openid 缓存 userinfo_ttl 秒；同一 openid 的并发未命中只请求一次"""
+        cached = self._userinfo.get(openid)
+        if cached is not None and not force and cached[0] > time.monotonic():
+            self.stats["userinfo_hits"] += 1
+            return cached[1]
+
+        future = self._fetching.get(openid)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_user_info(openid))
+            self._fetching[openid] = future
+            future.add_done_callback(lambda f: self._fetching.pop(openid, None))
+        return await asyncio.shield(future)
+
+    async def login(self, code: str) -> dict:
+        """授权码登录：换取令牌并返回用户信息"""
+        token = await self.exchange_code(code)
+        return await self.get_user_info(token.openid)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_client: Optional[WeChatClient] = None
+
+
+def get_wechat_client(settings) -> WeChatClient:
+    """按当前配置返回全局客户端；AppID/AppSecret/接口地址变化后重新创建"""
+    global _client
+    if not settings.wechat_app_id or not settings.wechat_app_secret:
+        raise HTTPException(
+            status_code=500,
+            detail="WeChat not configured / 微信登录未配置"
+        )
+    key = (settings.wechat_app_id, settings.wechat_app_secret, settings.wechat_api_base.rstrip("/"))
+    if _client is None or (_client.app_id, _client.app_secret, _client.base_url) != key:
+        if _client is not None:
+            asyncio.ensure_future(_client.aclose())
+        _client = WeChatClient(*key, userinfo_ttl=settings.wechat_userinfo_ttl)
+    _client.userinfo_ttl = settings.wechat_userinfo_ttl
+    return _client
+
+
+async def close_wechat_client():
+    """应用关闭时释放连接池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logging.debug("WeChat client closed")
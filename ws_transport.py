@@ -0,0 +1,210 @@
+"""
+WebSocket 传输模块 - 一条连接上复用多个聊天/智能体/图片流，按请求 id 区分，支持流控与取消
+
+协议（均为 JSON 文本帧）：
+  客户端 -> 服务端
+    {"type": "auth", "token": "<JWT 或空>"}                 连接后第一条消息，只认证一次
+    {"type": "chat" | "agent" | "image", "id": "r1", "payload": {...}}  与对应 HTTP 接口请求体相同
+    {"type": "ack", "id": "r1", "n": 16}                     归还 n 个发送额度
+    {"type": "cancel", "id": "r1"}                           取消该流
+    {"type": "ping"}
+  服务端 -> 客户端
+    {"type": "ready", "user": {...} | null, "window": 64}
+    {"type": "event", "id": "r1", "data": {...}}             与 SSE 中 data: 后的内容相同
+    {"type": "error", "id": "r1", "status": 429, "detail": "..."}
+    {"type": "done", "id": "r1", "cancelled": false}
+    {"type": "pong"}
+  服务重启时未完成的流以 {"type": "error", "status": 503} 结束，连接以 1012 关闭；收到二进制帧时以 1003 关闭
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from fast_json import dumps_str, loads
+from shutdown import CLOSE_SERVICE_RESTART, RESTART_MESSAGE
+
+# 关闭码（4000-4999 为应用自定义）
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_PROTOCOL_ERROR = 4400
+# 标准关闭码：不支持的数据类型（协议只使用文本帧）
+CLOSE_UNSUPPORTED_DATA = 1003
+
+# 流处理函数：接收请求体，产出事件字典
+StreamHandler = Callable[[dict], AsyncIterator[dict]]
+
+
+async def receive_text_frame(websocket: WebSocket) -> Optional[str]:
+    """读取一帧：文本帧返回内容，二进制帧返回 None（receive_text 遇到二进制帧会抛出 KeyError）"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message.get("text")
+
+
+class StreamCredit:
+    """单个流的发送额度：额度用完时生产者等待客户端 ack"""
+
+    def __init__(self, window: int):
+        self.available = window
+        self._event = asyncio.Event()
+        self._event.set()
+
+    def grant(self, n: int):
+        self.available += n
+        if self.available > 0:
+            self._event.set()
+
+    async def acquire(self):
+        while self.available <= 0:
+            self._event.clear()
+            await self._event.wait()
+        self.available -= 1
+
+
+class StreamMux:
+    """一条已认证连接上的多路复用器"""
+
+    def __init__(self, websocket: WebSocket, handlers: Dict[str, StreamHandler],
+                 max_streams: int = 8, window: int = 64):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.max_streams = max_streams
+        self.window = window
+        self.streams: Dict[str, asyncio.Task] = {}
+        self.credits: Dict[str, StreamCredit] = {}
+        self._send_lock = asyncio.Lock()
+        self.restarting = False
+
+    async def send(self, message: dict):
+        # 多个流共用一个连接，发送需串行；websocket.send 会等待底层缓冲区排空，慢客户端会反压到各生产者
+        async with self._send_lock:
+            await self.websocket.send_text(dumps_str(message))
+
+    async def _run_stream(self, stream_id: str, handler: StreamHandler, payload: dict):
+        credit = self.credits[stream_id]
+        final = {"type": "done", "id": stream_id, "cancelled": False}
+        error = None
+        try:
+            async for data in handler(payload):
+                await credit.acquire()
+                await self.send({"type": "event", "id": stream_id, "data": data})
+        except asyncio.CancelledError:
+            if self.restarting:
+                error = {"status": 503, "detail": RESTART_MESSAGE}
+            else:
+                final["cancelled"] = True
+        except HTTPException as e:
+            error = {"status": e.status_code, "detail": e.detail}
+        except ValidationError as e:
+            error = {"status": 422, "detail": str(e)[:500]}
+        except Exception as e:
+            logging.error(f"WebSocket stream {stream_id} failed: {e}")
+            error = {"status": 500, "detail": str(e)[:500]}
+        finally:
+            self.streams.pop(stream_id, None)
+            self.credits.pop(stream_id, None)
+        try:
+            if error:
+                await self.send({"type": "error", "id": stream_id, **error})
+            await self.send(final)
+        except Exception:
+            pass  # 连接已关闭
+
+    def _open(self, message: dict):
+        stream_id = message.get("id")
+        handler = self.handlers.get(message["type"])
+        if not isinstance(stream_id, str) or not stream_id:
+            raise HTTPException(status_code=400, detail="Stream id is required / 缺少流 id")
+        if stream_id in self.streams:
+            raise HTTPException(status_code=409, detail="Stream id already in use / 流 id 已被占用")
+        if len(self.streams) >= self.max_streams:
+            raise HTTPException(status_code=429, detail="Too many concurrent streams / 并发流过多")
+        payload = message.get("payload")
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=400, detail="payload must be an object / payload 必须是对象")
+        self.credits[stream_id] = StreamCredit(self.window)
+        self.streams[stream_id] = asyncio.create_task(self._run_stream(stream_id, handler, payload))
+
+    async def _dispatch(self, message: dict):
+        kind = message.get("type")
+        if kind in self.handlers:
+            try:
+                self._open(message)
+            except HTTPException as e:
+                await self.send({"type": "error", "id": message.get("id"), "status": e.status_code, "detail": e.detail})
+        elif kind == "ack":
+            credit = self.credits.get(message.get("id"))
+            n = message.get("n", 1)
+            if credit and isinstance(n, int) and n > 0:
+                credit.grant(n)
+        elif kind == "cancel":
+            task = self.streams.get(message.get("id"))
+            if task:
+                task.cancel()
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+        else:
+            await self.send({"type": "error", "id": message.get("id"), "status": 400,
+                             "detail": f"Unknown message type / 未知消息类型: {kind}"})
+
+    async def close_for_restart(self, timeout: float = 2.0):
+        """服务重启：未完成的流以 503 结束，然后以 1012 关闭连接，客户端可重连到新实例"""
+        self.restarting = True
+        tasks = list(self.streams.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        try:
+            await self.websocket.close(code=CLOSE_SERVICE_RESTART)
+        except Exception:
+            pass  # 连接已关闭
+
+    async def run(self):
+        """读取客户端消息直到断开；断开时取消所有未完成的流"""
+        try:
+            while True:
+                text = await receive_text_frame(self.websocket)
+                if text is None:
+                    await self.websocket.close(code=CLOSE_UNSUPPORTED_DATA)
+                    return
+                try:
+                    message = loads(text)
+                except ValueError:
+                    await self.websocket.close(code=CLOSE_PROTOCOL_ERROR)
+                    return
+                if isinstance(message, dict):
+                    await self._dispatch(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in list(self.streams.values()):
+                task.cancel()
+
+
+async def receive_auth(websocket: WebSocket, timeout: float = 10.0) -> Optional[str]:
+    """读取第一条 auth 消息，返回 token（可为空字符串表示匿名）；格式错误、超时或断开时关闭连接并返回 None"""
+    try:
+        text = await asyncio.wait_for(receive_text_frame(websocket), timeout)
+    except WebSocketDisconnect:
+        return None
+    except asyncio.TimeoutError:
+        text = ""
+    if text is None:
+        await websocket.close(code=CLOSE_UNSUPPORTED_DATA)
+        return None
+    try:
+        message = loads(text)
+    except ValueError:
+        message = None
+    token = None
+    if isinstance(message, dict) and message.get("type") == "auth":
+        token = message.get("token") or ""
+    if not isinstance(token, str):
+        await websocket.close(code=CLOSE_PROTOCOL_ERROR)
+        return None
+    return token